@@ -1,19 +1,43 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import io
+import codecs
 import os
+import sys
 from datetime import datetime, timedelta, date
 import hashlib
+import gzip
+import json
+import zipfile
+import shutil
+import tempfile
+import socket
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import multiprocessing
+import itertools
 import bcrypt
-from html import escape
+from html import escape, unescape
 import difflib
 from sqlalchemy.sql import text
 import requests
 import xml.etree.ElementTree as ET
+from openpyxl import load_workbook
 
 # --- ENHANCED AI IMPORTS ---
 import re
 
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
 # --- UPDATED: Sentence Transformers Only ---
 try:
     from sentence_transformers import SentenceTransformer, util
@@ -678,13 +702,1214 @@ def get_sentence_transformer_model():
     return SentenceTransformer('all-MiniLM-L6-v2')
 
 
-@st.cache_data(show_spinner=False)
-def load_uploaded_file(file_bytes, filename):
-    """Load uploaded CSV/XLSX data with caching for faster reruns."""
-    buffer = io.BytesIO(file_bytes)
+# Uploads larger than this are parsed in fixed-size chunks instead of in one go
+LARGE_UPLOAD_THRESHOLD_BYTES = 20 * 1024 * 1024
+UPLOAD_CHUNK_ROWS = 100_000
+BANK_REQUIRED_COLUMNS = ['Date', 'Narration', 'Debit', 'Credit']
+BANK_CANONICAL_COLUMNS = set(BANK_REQUIRED_COLUMNS) | {'Amount', 'Indicator', 'Balance'}
+
+
+CSV_SNIFF_BYTES = 64 * 1024
+# Narrations are kept as Arrow-backed strings (NaN for missing, like pandas' default str dtype)
+try:
+    ARROW_STRING_DTYPE = pd.StringDtype("pyarrow", na_value=float("nan")) if PYARROW_AVAILABLE else object
+except TypeError:
+    ARROW_STRING_DTYPE = "string[pyarrow]" if PYARROW_AVAILABLE else object
+
+
+def detect_text_encoding(sample):
+    """Pick a CSV encoding from its first bytes: BOM, then strict UTF-8, then latin1 (never fails)."""
+    if sample.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    if sample.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return 'utf-16'
+    try:
+        # Incremental decode so a multi-byte character cut at the sample edge is not an error
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        return 'latin1'
+
+
+def sniff_upload_encoding(file_obj):
+    """Detect the encoding of a file path or seekable upload without moving its read position."""
+    if isinstance(file_obj, str):
+        with open(file_obj, 'rb') as f:
+            return detect_text_encoding(f.read(CSV_SNIFF_BYTES))
+    position = file_obj.tell()
+    sample = file_obj.read(CSV_SNIFF_BYTES)
+    file_obj.seek(position)
+    return detect_text_encoding(sample)
+
+
+def has_undecoded_columns(df):
+    """True when a text column came back as raw bytes (pyarrow's result for undecodable text)."""
+    for col in df.columns[(df.dtypes == object).to_numpy()]:
+        first = df[col].first_valid_index()
+        if first is not None and isinstance(df[col].loc[first], bytes):
+            return True
+    return False
+
+
+def read_csv_upload(file_obj, encoding=None):
+    """
+    Read a whole CSV upload (a file path or seekable buffer) with the detected encoding.
+    Uses pandas' multithreaded pyarrow engine when available and falls back to the
+    C parser for layouts it rejects; a UTF-8 guess that fails later in the file
+    is retried as latin1. Paths are memory-mapped by the C parser.
+    """
+    encoding = encoding or sniff_upload_encoding(file_obj)
+    is_path = isinstance(file_obj, str)
+    start = None if is_path else file_obj.tell()
+    if PYARROW_AVAILABLE:
+        try:
+            df = pd.read_csv(file_obj, engine='pyarrow', encoding=encoding)
+            # The pyarrow engine doesn't de-duplicate repeated headers, and returns bytes for
+            # columns that don't decode; the C parser handles both (see below)
+            if not df.columns.duplicated().any() and not has_undecoded_columns(df):
+                return df
+        except Exception as e:
+            print(f"pyarrow CSV engine failed, falling back to C parser: {e}")
+        if not is_path:
+            file_obj.seek(start)
+    try:
+        return pd.read_csv(file_obj, encoding=encoding, memory_map=is_path)
+    except UnicodeDecodeError:
+        if not is_path:
+            file_obj.seek(start)
+        return pd.read_csv(file_obj, encoding='latin1', memory_map=is_path)
+
+
+def load_uploaded_file(source, filename, header_tokens=None):
+    """
+    Parse uploaded CSV/XLSX data from raw bytes, a spooled file path or a seekable buffer.
+    ``header_tokens`` locate the header row of XLSX sheets (see detect_header_row).
+    Reruns are served from the upload store (see load_upload).
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
     if filename.lower().endswith(".csv"):
-        return pd.read_csv(buffer, encoding='latin1')
-    return pd.read_excel(buffer)
+        return read_csv_upload(source)
+    if filename.lower().endswith(".xlsx"):
+        return read_xlsx_streaming(source, header_tokens)
+    return pd.read_excel(source)
+
+
+# Uploads above LARGE_UPLOAD_THRESHOLD_BYTES are copied once to a temp file here
+# (None: the system temp dir) and parsed from disk rather than from memory
+UPLOAD_SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR") or None
+SPOOL_COPY_BYTES = 8 * 1024 * 1024
+
+
+class SpooledUpload:
+    """
+    An upload copied to a temporary file, hashed during the copy. Parsers read it
+    from ``spool_path`` (memory-mapped CSV, streamed XLSX), so no further in-memory
+    copies of the raw bytes are made. ``discard()`` removes the file.
+    """
+
+    def __init__(self, name, spool_path, size, digest, file_id=None):
+        self.name = name
+        self.spool_path = spool_path
+        self.size = size
+        self.digest = digest
+        self.file_id = file_id
+
+    def discard(self):
+        try:
+            os.remove(self.spool_path)
+        except OSError:
+            pass
+
+
+def spool_upload(stream, name, file_id=None, chunk_bytes=SPOOL_COPY_BYTES):
+    """Copy a readable stream to a temp file in ``chunk_bytes`` blocks, computing its SHA-256 on the way."""
+    if hasattr(stream, 'seek'):
+        stream.seek(0)
+    sha = hashlib.sha256()
+    size = 0
+    fd, path = tempfile.mkstemp(prefix="upload-", suffix=os.path.splitext(name)[1], dir=UPLOAD_SPOOL_DIR)
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                block = stream.read(chunk_bytes)
+                if not block:
+                    break
+                sha.update(block)
+                out.write(block)
+                size += len(block)
+    except Exception:
+        os.remove(path)
+        raise
+    return SpooledUpload(name, path, size, sha.hexdigest(), file_id)
+
+
+def upload_source(upload):
+    """What parsers should read: the temp file of a spooled upload, else the upload buffer itself."""
+    return getattr(upload, 'spool_path', None) or upload
+
+
+# Parsed uploads are kept on disk under their content digest, within this byte budget.
+# Bump UPLOAD_PARSER_VERSION whenever parsing produces a different frame for the same file.
+UPLOAD_STORE_DIR = os.path.join("data", "uploads")
+UPLOAD_STORE_MAX_BYTES = 512 * 1024 * 1024
+UPLOAD_PARSER_VERSION = 5
+
+
+def upload_store_key(digest, kind):
+    """Upload store key for a file digest, parse kind and the current parser version."""
+    return f"{digest}.{kind}.v{UPLOAD_PARSER_VERSION}"
+
+
+def write_frame_file(base_path, df, index=False):
+    """
+    Write ``df`` to ``base_path``.parquet atomically, or to ``base_path``.pkl when
+    pyarrow rejects it (mixed-type object columns). Returns True on success.
+    """
+    parquet_path, pickle_path = base_path + ".parquet", base_path + ".pkl"
+    tmp_path = f"{base_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        try:
+            df.to_parquet(tmp_path, index=index)
+            os.replace(tmp_path, parquet_path)
+            stale_path = pickle_path
+        except Exception as e:
+            # pyarrow rejects mixed-type object columns; keep those frames as pickle
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            print(f"Falling back to pickle for {base_path}: {e}")
+            df.to_pickle(tmp_path)
+            os.replace(tmp_path, pickle_path)
+            stale_path = parquet_path
+        if os.path.exists(stale_path):
+            os.remove(stale_path)
+        return True
+    except Exception as e:
+        print(f"Frame write failed for {base_path}: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return False
+
+
+def read_frame_file(base_path, touch=False):
+    """Read a frame written by write_frame_file, or None. ``touch`` refreshes its mtime for LRU."""
+    try:
+        for path, reader in ((base_path + ".parquet", pd.read_parquet), (base_path + ".pkl", pd.read_pickle)):
+            if os.path.exists(path):
+                if touch:
+                    os.utime(path)
+                return reader(path)
+    except Exception as e:
+        print(f"Frame read failed for {base_path}: {e}")
+    return None
+
+
+class UploadStore:
+    """
+    Parsed upload frames persisted as Parquet files named by content digest.
+    Reads refresh a file's mtime and writes evict the least recently used files
+    once the store exceeds ``max_bytes``. Frames Parquet cannot represent
+    (mixed-type object columns) fall back to a pickle file.
+    """
+
+    def __init__(self, root=UPLOAD_STORE_DIR, max_bytes=UPLOAD_STORE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+
+    def get(self, key):
+        """Return the stored frame for ``key``, or None."""
+        return read_frame_file(os.path.join(self.root, key), touch=True)
+
+    def put(self, key, df):
+        """Persist ``df`` under ``key`` and evict old entries beyond the byte budget."""
+        os.makedirs(self.root, exist_ok=True)
+        if write_frame_file(os.path.join(self.root, key), df):
+            self.evict()
+
+    def evict(self):
+        """Delete least recently used files until the store fits its byte budget."""
+        try:
+            entries = []
+            for name in os.listdir(self.root):
+                if name.endswith((".parquet", ".pkl")):
+                    path = os.path.join(self.root, name)
+                    stat = os.stat(path)
+                    entries.append((stat.st_mtime, stat.st_size, path))
+        except OSError:
+            return
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        # Always keep the most recently used entry, even if it alone is over budget
+        for _, size, path in entries[:-1]:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+
+@st.cache_resource(show_spinner=False)
+def get_upload_store():
+    """One upload store per process."""
+    return UploadStore()
+
+
+# Working DataFrames held by sessions (e.g. the bank mapping grid) live here: a small
+# hot set in memory, the rest spilled to local disk
+SESSION_FRAME_DIR = os.path.join("data", "sessions")
+SESSION_FRAME_MEMORY_BUDGET_BYTES = int(os.getenv("SESSION_FRAME_MEMORY_MB", "512")) * 1024 * 1024
+SESSION_FRAME_TTL_SECONDS = 24 * 60 * 60
+
+
+class SessionFrameStore:
+    """
+    Per-process manager for large session DataFrames keyed by (session id, name).
+    Frames stay in an in-memory LRU hot set while it fits ``budget_bytes``; colder
+    frames are written to Parquet under ``root`` (only if changed since last
+    written) and dropped from memory, then read back on demand. ``get`` hands out
+    the stored frame itself, not a copy, so callers that mutate it must ``put`` it
+    back. Spilled files of sessions idle longer than ``ttl_seconds`` are removed.
+    """
+
+    def __init__(self, root=SESSION_FRAME_DIR, budget_bytes=SESSION_FRAME_MEMORY_BUDGET_BYTES,
+                 ttl_seconds=SESSION_FRAME_TTL_SECONDS):
+        self.root = root
+        self.budget_bytes = budget_bytes
+        self.ttl_seconds = ttl_seconds
+        self.hot = OrderedDict()  # key -> [df, nbytes, dirty]
+        self.hot_bytes = 0
+        # Sizes measured at put time, kept for spilled frames so reloads are not measured again
+        self.spilled_bytes = {}
+        # Streamlit runs every session's script in its own thread
+        self.lock = threading.RLock()
+
+    def _base_path(self, key):
+        session_id, name = key
+        return os.path.join(self.root, session_id, name)
+
+    @staticmethod
+    def _frame_bytes(df):
+        # deep=True: object columns (fingerprints, ledger names) only count their pointers otherwise
+        return int(df.memory_usage(index=True, deep=True).sum())
+
+    def get(self, key):
+        """The frame stored under ``key`` (loaded from disk if spilled), or None."""
+        with self.lock:
+            entry = self.hot.get(key)
+            if entry is not None:
+                self.hot.move_to_end(key)
+                return entry[0]
+            df = read_frame_file(self._base_path(key), touch=True)
+            if df is not None:
+                self._admit(key, df, dirty=False, nbytes=self.spilled_bytes.pop(key, None))
+            return df
+
+    def put(self, key, df):
+        """
+        Store ``df`` under ``key``; it is written to disk only if it gets evicted. Its
+        size is measured here, so callers put frames only when they changed.
+        """
+        with self.lock:
+            self._discard(key)
+            self._admit(key, df, dirty=True)
+
+    def delete(self, key):
+        with self.lock:
+            self._discard(key)
+            self.spilled_bytes.pop(key, None)
+            for suffix in (".parquet", ".pkl"):
+                path = self._base_path(key) + suffix
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def drop_session(self, session_id):
+        """Forget every frame of a session (e.g. on logout)."""
+        with self.lock:
+            for key in [k for k in self.hot if k[0] == session_id]:
+                self._discard(key)
+            for key in [k for k in self.spilled_bytes if k[0] == session_id]:
+                del self.spilled_bytes[key]
+            session_dir = os.path.join(self.root, session_id)
+            if os.path.isdir(session_dir):
+                for name in os.listdir(session_dir):
+                    os.remove(os.path.join(session_dir, name))
+                os.rmdir(session_dir)
+
+    def _discard(self, key):
+        entry = self.hot.pop(key, None)
+        if entry is not None:
+            self.hot_bytes -= entry[1]
+
+    def _admit(self, key, df, dirty, nbytes=None):
+        if nbytes is None:
+            nbytes = self._frame_bytes(df)
+        self.hot[key] = [df, nbytes, dirty]
+        self.hot_bytes += nbytes
+        self._evict()
+
+    def _evict(self):
+        # The most recently used frame always stays hot, even if it alone is over budget
+        spilled = False
+        while self.hot_bytes > self.budget_bytes and len(self.hot) > 1:
+            key, (df, nbytes, dirty) = self.hot.popitem(last=False)
+            self.hot_bytes -= nbytes
+            self.spilled_bytes[key] = nbytes
+            if dirty:
+                os.makedirs(os.path.dirname(self._base_path(key)), exist_ok=True)
+                write_frame_file(self._base_path(key), df, index=None)
+            spilled = True
+        if spilled:
+            self._prune_idle_sessions()
+
+    def _prune_idle_sessions(self):
+        if not os.path.isdir(self.root):
+            return
+        cutoff = datetime.now().timestamp() - self.ttl_seconds
+        live_sessions = {key[0] for key in self.hot}
+        for session_id in os.listdir(self.root):
+            session_dir = os.path.join(self.root, session_id)
+            try:
+                if session_id not in live_sessions and os.path.getmtime(session_dir) < cutoff:
+                    self.drop_session(session_id)
+            except OSError:
+                pass
+
+
+@st.cache_resource(show_spinner=False)
+def get_session_frame_store():
+    """One session frame store per process."""
+    return SessionFrameStore()
+
+
+def _session_frame_key(name):
+    session_id = st.session_state.setdefault('session_frame_id', uuid.uuid4().hex)
+    return session_id, name
+
+
+def get_session_frame(name):
+    """This session's working frame ``name``, or None."""
+    return get_session_frame_store().get(_session_frame_key(name))
+
+
+def set_session_frame(name, df):
+    """Store this session's working frame ``name`` (replacing any previous one)."""
+    get_session_frame_store().put(_session_frame_key(name), df)
+
+
+def get_upload_digest(uploaded_file):
+    """
+    SHA-256 of an upload's bytes, computed once per uploaded file and remembered
+    in session state by Streamlit's file_id so reruns never re-hash.
+    """
+    digests = st.session_state.setdefault('upload_digests', {})
+    file_id = getattr(uploaded_file, 'file_id', None)
+    if file_id is not None and file_id in digests:
+        return digests[file_id]
+    digest = getattr(uploaded_file, 'digest', None) or hashlib.sha256(uploaded_file.getbuffer()).hexdigest()
+    if file_id is not None:
+        digests[file_id] = digest
+    return digest
+
+
+def spool_large_upload(uploaded_file, force=False):
+    """
+    Spool an upload above LARGE_UPLOAD_THRESHOLD_BYTES to disk and return the
+    SpooledUpload, or None to keep parsing it from memory. Unless ``force``d, a large
+    upload whose digest is already known is not spooled (a store hit needs no bytes).
+    """
+    if getattr(uploaded_file, 'spool_path', None) or uploaded_file.size <= LARGE_UPLOAD_THRESHOLD_BYTES:
+        return None
+    file_id = getattr(uploaded_file, 'file_id', None)
+    digest_known = hasattr(uploaded_file, 'digest') or file_id in st.session_state.get('upload_digests', {})
+    if not force and digest_known:
+        return None
+    if isinstance(uploaded_file, ZipMemberSource):
+        return uploaded_file.spool()
+    spooled = spool_upload(uploaded_file, uploaded_file.name, file_id)
+    get_upload_digest(spooled)  # remember the digest computed during the copy
+    return spooled
+
+
+def load_upload(uploaded_file, kind="raw", parse=None, keep_handle=True):
+    """
+    Return the parsed frame for an upload as a cheap handle on reruns.
+    The frame for the current file of each ``kind`` is held in the session frame store; a new
+    file is looked up in the upload store by digest and only parsed (with
+    ``parse(upload)``, default load_uploaded_file) on a store miss. Large uploads
+    are spooled to a temp file first and parsed from there.
+    Pages that keep their own working copy pass ``keep_handle=False``.
+    """
+    handle_key = f"upload_handle_{kind}"
+    handle = st.session_state.get(handle_key)
+    file_id = getattr(uploaded_file, 'file_id', None)
+    if handle and file_id is not None and handle['file_id'] == file_id:
+        df = get_session_frame(handle_key)
+        if df is not None:
+            return df
+
+    spooled = spool_large_upload(uploaded_file)
+    try:
+        digest = get_upload_digest(spooled or uploaded_file)
+        store = get_upload_store()
+        store_key = upload_store_key(digest, kind)
+        df = store.get(store_key)
+        if df is None:
+            spooled = spooled or spool_large_upload(uploaded_file, force=True)
+            upload = spooled or uploaded_file
+            if parse is None:
+                df = load_uploaded_file(upload_source(upload), upload.name)
+            else:
+                df = parse(upload)
+            store.put(store_key, df)
+    finally:
+        if spooled is not None:
+            spooled.discard()
+    if keep_handle:
+        st.session_state[handle_key] = {'file_id': file_id, 'digest': digest}
+        set_session_frame(handle_key, df)
+    return df
+
+
+# Header cells that identify the real column header row in bank/journal exports
+KNOWN_HEADER_TOKENS = {
+    'date', 'txn date', 'tran date', 'transaction date', 'value date', 'posting date',
+    'narration', 'description', 'particulars', 'remarks', 'details', 'transaction details',
+    'debit', 'credit', 'withdrawal', 'withdrawals', 'withdrawal amt', 'deposit', 'deposits',
+    'deposit amt', 'amount', 'balance', 'closing balance', 'chq no', 'cheque no',
+    'chq/ref no', 'ref no', 'reference', 'dr', 'cr', 'voucher type', 'ledger',
+}
+XLSX_HEADER_SCAN_ROWS = 30
+
+
+def _header_cell_key(value):
+    return re.sub(r'[^a-z/ ]', '', str(value).strip().lower()).strip() if value is not None else ''
+
+
+def detect_header_row(rows, header_tokens=None):
+    """
+    Pick the header row among the first rows of a sheet: the earliest row with the
+    most cells matching ``header_tokens`` (default KNOWN_HEADER_TOKENS; at least two).
+    Falls back to the first non-empty row, which is what pandas would use.
+    """
+    header_tokens = KNOWN_HEADER_TOKENS if header_tokens is None else header_tokens
+    best_idx, best_score = None, 1
+    first_non_empty = None
+    for idx, row in enumerate(rows):
+        if first_non_empty is None and any(v is not None and str(v).strip() for v in row):
+            first_non_empty = idx
+        score = sum(1 for v in row if _header_cell_key(v) in header_tokens)
+        if score > best_score:
+            best_idx, best_score = idx, score
+    if best_idx is not None:
+        return best_idx
+    return first_non_empty
+
+
+def _xlsx_columns(header_row):
+    """Header cells as column names; trailing blanks dropped, inner blanks named like pandas."""
+    cells = list(header_row)
+    while cells and (cells[-1] is None or not str(cells[-1]).strip()):
+        cells.pop()
+    columns = []
+    for i, value in enumerate(cells):
+        name = str(value).strip() if value is not None and str(value).strip() else f"Unnamed: {i}"
+        if name in columns:
+            name = f"{name}.{columns.count(name)}"
+        columns.append(name)
+    return columns
+
+
+def iter_xlsx_batches(file_obj, batch_rows=UPLOAD_CHUNK_ROWS, header_scan_rows=XLSX_HEADER_SCAN_ROWS,
+                      header_tokens=None):
+    """
+    Stream the first sheet of an .xlsx file as DataFrame batches of ``batch_rows`` rows.
+    Uses openpyxl's read-only, values-only mode, so cells arrive as plain typed Python
+    values (datetime, float, str) without building per-cell objects. Preamble rows
+    above the detected header row (see detect_header_row) are skipped; fully blank
+    rows are dropped.
+    """
+    wb = load_workbook(file_obj, read_only=True, data_only=True)
+    try:
+        rows = wb.active.iter_rows(values_only=True)
+        head = []
+        for row in rows:
+            head.append(row)
+            if len(head) >= header_scan_rows:
+                break
+        header_idx = detect_header_row(head, header_tokens)
+        if header_idx is None:
+            return
+        columns = _xlsx_columns(head[header_idx])
+        width = len(columns)
+
+        batch = []
+        for row in itertools.chain(head[header_idx + 1:], rows):
+            row = tuple(row[:width])
+            if not any(v is not None and (not isinstance(v, str) or v.strip()) for v in row):
+                continue
+            if len(row) < width:
+                row = row + (None,) * (width - len(row))
+            batch.append(row)
+            if len(batch) >= batch_rows:
+                yield pd.DataFrame.from_records(batch, columns=columns)
+                batch = []
+        if batch:
+            yield pd.DataFrame.from_records(batch, columns=columns)
+    finally:
+        wb.close()
+
+
+def read_xlsx_streaming(file_obj, header_tokens=None):
+    """Read an .xlsx file into one DataFrame via the streaming, header-detecting reader."""
+    batches = list(iter_xlsx_batches(file_obj, header_tokens=header_tokens))
+    if not batches:
+        return pd.DataFrame()
+    return pd.concat(batches, ignore_index=True)
+
+
+AMOUNT_DR_CR_PATTERN = r'(?i)\s*(dr|cr)\.?\s*$'
+AMOUNT_DR_PATTERN = r'(?i)dr\.?$'
+AMOUNT_CR_PATTERN = r'(?i)cr\.?$'
+AMOUNT_CURRENCY_PATTERN = r'(?i)₹|rs\.?|inr'
+AMOUNT_NUMBER_PATTERN = r'\d*(?:\.\d*)?'
+# Whole rupees beyond this many digits would overflow int64 paise
+AMOUNT_MAX_WHOLE_DIGITS = 16
+
+
+def parse_amounts(values):
+    """
+    Parse an amount column to exact int64 paise using whole-column string operations.
+    Handles Indian digit grouping ("1,23,456.00"), currency markers ("₹", "Rs.", "INR"),
+    parentheses or a leading minus for negatives, and trailing Dr/Cr markers.
+    Blank cells are 0. Returns (paise, dr_cr, invalid): ``dr_cr`` holds 'Dr'/'Cr'
+    where a marker was present, ``invalid`` flags non-blank cells that did not
+    parse or are too large for int64 paise (their paise are 0).
+    """
+    if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+        numeric = pd.to_numeric(values, errors='coerce')
+        invalid = (numeric.abs() >= 10 ** AMOUNT_MAX_WHOLE_DIGITS).fillna(False).astype(bool)
+        paise = (numeric.where(~invalid, 0).fillna(0) * 100).round().astype('int64')
+        return paise, pd.Series(pd.NA, index=values.index, dtype='string'), invalid
+
+    # Arrow-backed strings keep every step below a vectorized pyarrow compute kernel;
+    # without pyarrow the same steps run on pandas' own string dtype
+    string_dtype = 'string[pyarrow]' if PYARROW_AVAILABLE else pd.StringDtype("python")
+    int_dtype = 'int64[pyarrow]' if PYARROW_AVAILABLE else 'int64'
+    text = values.astype(string_dtype).str.strip()
+    is_dr = text.str.contains(AMOUNT_DR_PATTERN, regex=True).fillna(False).astype(bool)
+    is_cr = text.str.contains(AMOUNT_CR_PATTERN, regex=True).fillna(False).astype(bool)
+    dr_cr = pd.Series(pd.NA, index=values.index, dtype='string').mask(is_dr, 'Dr').mask(is_cr, 'Cr')
+    text = text.str.replace(AMOUNT_DR_CR_PATTERN, '', regex=True)
+    text = text.str.replace(AMOUNT_CURRENCY_PATTERN, '', regex=True).str.replace(r'[,\s]', '', regex=True)
+
+    in_parens = (text.str.startswith('(') & text.str.endswith(')')).fillna(False).astype(bool)
+    text = text.str.replace(r'^\((.*)\)$', r'\1', regex=True)
+    has_minus = text.str.startswith('-').fillna(False).astype(bool)
+    text = text.str.replace(r'^[+-]', '', regex=True)
+    negative = in_parens | has_minus
+
+    blank = (text.isna() | text.eq('')).fillna(True).astype(bool)
+    valid = text.str.fullmatch(AMOUNT_NUMBER_PATTERN).fillna(False).astype(bool) & ~blank
+    whole = text.str.replace(r'\..*$', '', regex=True).str.replace(r'^0+', '', regex=True)
+    valid &= (whole.str.len() <= AMOUNT_MAX_WHOLE_DIGITS).fillna(False).astype(bool)
+    invalid = ~valid & ~blank
+    text = text.where(valid, '0')
+
+    whole = whole.where(valid, '0').str.replace(r'^$', '0', regex=True)
+    # First two decimals are paise, the third rounds half-up
+    frac = text.str.replace(r'^[^.]*\.?', '', regex=True) + '000'
+    paise = (
+        whole.astype(int_dtype).astype('int64') * 100
+        + frac.str.slice(0, 2).astype(int_dtype).astype('int64')
+        + (frac.str.slice(2, 3).astype(int_dtype).astype('int64') >= 5).astype('int64')
+    )
+    paise = paise.where(~negative, -paise).astype('int64')
+    return paise, dr_cr, invalid
+
+
+def format_paise(paise):
+    """Exact rupee string for Tally from integer paise, e.g. -123456 -> '-1234.56'."""
+    paise = int(paise)
+    sign = "-" if paise < 0 else ""
+    whole, frac = divmod(abs(paise), 100)
+    return f"{sign}{whole}.{frac:02d}"
+
+
+def format_paise_column(paise):
+    """format_paise over a whole int64 paise Series, as Arrow-backed strings."""
+    paise = paise.astype('int64')
+    magnitude = paise.abs().to_numpy()
+    sign = np.where(paise.to_numpy() < 0, "-", "")
+    if PYARROW_AVAILABLE:
+        # Arrow casts and pads in native code; pandas' zfill is a per-element Python loop
+        rupees = pc.binary_join_element_wise(
+            pc.cast(pa.array(magnitude // 100), pa.string()),
+            pc.utf8_lpad(pc.cast(pa.array(magnitude % 100), pa.string()), 2, "0"), "."
+        )
+        formatted = pc.binary_join_element_wise(pa.array(sign), rupees, "")
+        return pd.Series(formatted, index=paise.index, dtype=ARROW_STRING_DTYPE)
+    whole = pd.Series(magnitude // 100, index=paise.index).astype(str)
+    frac = pd.Series(magnitude % 100, index=paise.index).astype(str).str.zfill(2)
+    return sign + whole + "." + frac
+
+
+# Bank frames carry exact amounts next to the displayed ones: 'Debit Paise' and
+# 'Credit Paise' (nullable Int64, <NA> where the cell could not be read)
+BANK_PAISE_COLUMNS = {'Debit': 'Debit Paise', 'Credit': 'Credit Paise'}
+BANK_INGEST_COLUMNS = BANK_REQUIRED_COLUMNS + list(BANK_PAISE_COLUMNS.values())
+
+
+def add_amount_paise_columns(df, cols=('Debit', 'Credit')):
+    """
+    Parse amount columns once into their paise columns; the displayed columns become
+    rupee floats derived from them (blank where the cell could not be read).
+    """
+    for col in cols:
+        paise, _, invalid = parse_amounts(df[col])
+        paise = paise.astype('Int64').mask(invalid.to_numpy(dtype=bool))
+        df[BANK_PAISE_COLUMNS[col]] = paise
+        df[col] = paise.astype('float64') / 100
+    return df
+
+
+def split_signed_amount(df, paise, invalid, outflow):
+    """Set Debit/Credit and their paise columns from one signed amount; ``outflow`` rows are withdrawals."""
+    magnitude = paise.abs().astype('Int64').mask(invalid.to_numpy(dtype=bool))
+    outflow = outflow.to_numpy(dtype=bool)
+    for col, side in (('Debit', outflow), ('Credit', ~outflow)):
+        # An unreadable amount has no known direction, so both sides are left blank
+        df[BANK_PAISE_COLUMNS[col]] = magnitude.where(side | magnitude.isna(), 0)
+        df[col] = df[BANK_PAISE_COLUMNS[col]].astype('float64') / 100
+    return df
+
+
+def get_amount_paise(df, col):
+    """Int64 paise for an amount column: its paise column if present, else parsed in one vectorized pass."""
+    paise_col = BANK_PAISE_COLUMNS.get(col)
+    if paise_col in df.columns:
+        return df[paise_col].fillna(0).astype('int64')
+    return parse_amounts(df[col])[0]
+
+
+def get_invalid_amounts(df, col):
+    """Boolean mask of rows whose ``col`` amount could not be read."""
+    paise_col = BANK_PAISE_COLUMNS.get(col)
+    if paise_col in df.columns:
+        return df[paise_col].isna().astype(bool)
+    return parse_amounts(df[col])[2]
+
+
+def edited_rows(df, previous, col):
+    """Rows of the edited frame ``df`` that are new or whose ``col`` differs from ``previous``."""
+    before = previous[col].reindex(df.index)
+    after = df[col]
+    unchanged = (after.astype(object) == before.astype(object)) | (after.isna() & before.isna())
+    return ~df.index.isin(previous.index) | ~unchanged.to_numpy(dtype=bool)
+
+
+def refresh_amount_paise(df, previous):
+    """Re-parse the paise of amounts edited (or added) in the mapping grid; other rows keep theirs."""
+    stale_cols = {col: edited_rows(df, previous, col) for col, paise_col in BANK_PAISE_COLUMNS.items()
+                  if paise_col in df.columns}
+    if not any(stale.any() for stale in stale_cols.values()):
+        return df
+    df = df.copy()
+    for col, stale in stale_cols.items():
+        if stale.any():
+            paise, _, invalid = parse_amounts(df.loc[stale, col])
+            df.loc[stale, BANK_PAISE_COLUMNS[col]] = paise.astype('Int64').mask(invalid.to_numpy(dtype=bool))
+    return df
+
+
+def describe_invalid_amounts(df, limit=5):
+    """Short user-facing summary of rows whose amounts could not be read."""
+    invalid = pd.Series(False, index=df.index)
+    for col in BANK_PAISE_COLUMNS:
+        invalid |= get_invalid_amounts(df, col)
+    rows = df.index[invalid.to_numpy(dtype=bool)]
+    if len(rows) == 0:
+        return ""
+    examples = ", ".join(f"'{df.at[idx, 'Narration']}'" for idx in rows[:limit])
+    more = f" and {len(rows) - limit} more" if len(rows) > limit else ""
+    return (f"{len(rows)} rows have amounts that could not be read; they are left blank and "
+            f"blocked from export until corrected: {examples}{more}.")
+
+
+# Bank statement layouts. 'columns' maps our canonical columns to the headers a bank
+# uses; 'headers' is the bank's full export header row, used for exact detection.
+# Layouts: debit_credit (two amount columns), signed_amount (one column, negative or
+# Dr = withdrawal) and amount_indicator (amount plus a separate Dr/Cr column).
+BUILTIN_BANK_PROFILES = [
+    {
+        'name': 'Xml2Tally Template',
+        'layout': 'debit_credit',
+        'columns': {'Date': ['Date'], 'Narration': ['Narration'], 'Debit': ['Debit'], 'Credit': ['Credit']},
+        'headers': ['Date', 'Narration', 'Debit', 'Credit'],
+        'date_formats': ['%d-%m-%Y', '%d/%m/%Y'],
+    },
+    {
+        'name': 'HDFC Bank',
+        'layout': 'debit_credit',
+        'columns': {'Date': ['Date'], 'Narration': ['Narration'], 'Debit': ['Withdrawal Amt.'],
+                    'Credit': ['Deposit Amt.'], 'Balance': ['Closing Balance']},
+        'headers': ['Date', 'Narration', 'Chq./Ref.No.', 'Value Dt', 'Withdrawal Amt.', 'Deposit Amt.', 'Closing Balance'],
+        'date_formats': ['%d/%m/%y', '%d/%m/%Y'],
+    },
+    {
+        'name': 'ICICI Bank',
+        'layout': 'debit_credit',
+        'columns': {'Date': ['Transaction Date', 'Value Date'], 'Narration': ['Transaction Remarks'],
+                    'Debit': ['Withdrawal Amount (INR )', 'Withdrawal Amount (INR)'],
+                    'Credit': ['Deposit Amount (INR )', 'Deposit Amount (INR)'],
+                    'Balance': ['Balance (INR )', 'Balance (INR)']},
+        'headers': ['S No.', 'Value Date', 'Transaction Date', 'Cheque Number', 'Transaction Remarks',
+                    'Withdrawal Amount (INR )', 'Deposit Amount (INR )', 'Balance (INR )'],
+        'date_formats': ['%d/%m/%Y', '%d-%m-%Y'],
+    },
+    {
+        'name': 'State Bank of India',
+        'layout': 'debit_credit',
+        'columns': {'Date': ['Txn Date'], 'Narration': ['Description'], 'Debit': ['Debit'],
+                    'Credit': ['Credit'], 'Balance': ['Balance']},
+        'headers': ['Txn Date', 'Value Date', 'Description', 'Ref No./Cheque No.', 'Debit', 'Credit', 'Balance'],
+        'date_formats': ['%d %b %Y', '%d-%b-%y'],
+    },
+    {
+        'name': 'Axis Bank',
+        'layout': 'debit_credit',
+        'columns': {'Date': ['Tran Date'], 'Narration': ['PARTICULARS'], 'Debit': ['DR'],
+                    'Credit': ['CR'], 'Balance': ['BAL']},
+        'headers': ['SRL NO', 'Tran Date', 'CHQNO', 'PARTICULARS', 'DR', 'CR', 'BAL', 'SOL'],
+        'date_formats': ['%d-%m-%Y'],
+    },
+    {
+        'name': 'Kotak Mahindra Bank',
+        'layout': 'amount_indicator',
+        'columns': {'Date': ['Date'], 'Narration': ['Description'], 'Amount': ['Amount'],
+                    'Indicator': ['Dr / Cr', 'Dr/Cr'], 'Balance': ['Balance']},
+        'headers': ['Sl. No.', 'Date', 'Description', 'Chq / Ref number', 'Amount', 'Dr / Cr', 'Balance', 'Dr / Cr'],
+        'date_formats': ['%d-%m-%Y', '%d/%m/%Y'],
+    },
+    {
+        'name': 'Signed Amount',
+        'layout': 'signed_amount',
+        'columns': {'Date': ['Date', 'Transaction Date', 'Txn Date'],
+                    'Narration': ['Narration', 'Description', 'Particulars', 'Remarks'],
+                    'Amount': ['Amount', 'Transaction Amount'], 'Balance': ['Balance']},
+        'headers': ['Date', 'Description', 'Amount', 'Balance'],
+    },
+]
+BANK_INDICATOR_DEBIT_VALUES = {'DR', 'D', 'DEBIT', 'WITHDRAWAL'}
+
+
+def bank_header_signature(columns):
+    """Order-insensitive key for a header row; equal for cosmetic header differences."""
+    return frozenset(key for key in (_header_cell_key(c) for c in columns) if key)
+
+
+def compile_bank_profile(profile):
+    """
+    Compile a profile into a vectorized normalizer: one rename to the canonical
+    columns, then a whole-column split of single-amount layouts into Debit/Credit.
+    """
+    alias_keys = {
+        canonical: [_header_cell_key(alias) for alias in aliases]
+        for canonical, aliases in profile['columns'].items()
+    }
+    layout = profile.get('layout', 'debit_credit')
+    debit_values = {v.upper() for v in profile.get('debit_indicators', BANK_INDICATOR_DEBIT_VALUES)}
+    date_formats = list(profile.get('date_formats', []))
+
+    def normalize(df):
+        by_key = {}
+        for col in df.columns:
+            by_key.setdefault(_header_cell_key(col), col)
+        rename = {}
+        for canonical, keys in alias_keys.items():
+            source = next((by_key[k] for k in keys if k in by_key and by_key[k] not in rename), None)
+            if source is not None:
+                rename[source] = canonical
+        # Drop other columns that would collide with a canonical name after renaming
+        clashing = [c for c in df.columns if c in alias_keys and c not in rename]
+        df = df.drop(columns=clashing).rename(columns=rename)
+
+        if layout in ('signed_amount', 'amount_indicator') and 'Amount' in df.columns:
+            paise, dr_cr, invalid = parse_amounts(df['Amount'])
+            if layout == 'amount_indicator' and 'Indicator' in df.columns:
+                outflow = df['Indicator'].astype(str).str.strip().str.upper().str.rstrip('.').isin(debit_values)
+            else:
+                is_cr = dr_cr.eq('Cr').fillna(False).astype(bool)
+                outflow = dr_cr.eq('Dr').fillna(False).astype(bool) | ((paise < 0) & ~is_cr)
+            split_signed_amount(df, paise, invalid, outflow.astype(bool))
+        df.attrs['bank_profile'] = profile['name']
+        df.attrs['date_formats'] = date_formats
+        return df
+
+    return normalize
+
+
+class BankProfileRegistry:
+    """
+    Bank format profiles indexed by header signature. An upload whose header row
+    matches a profile's export headers is resolved with one dict lookup; otherwise
+    the profile whose aliases cover the most required columns wins.
+    """
+
+    def __init__(self, profiles=None):
+        self.profiles = list(BUILTIN_BANK_PROFILES if profiles is None else profiles)
+        self.signature_index = {}
+        self.normalizers = {}
+        # Every profile's headers and aliases also identify the header row of XLSX sheets
+        self.header_tokens = set(KNOWN_HEADER_TOKENS)
+        for profile in self.profiles:
+            self.header_tokens.update(_header_cell_key(alias) for alias in profile.get('headers') or [])
+            self.header_tokens.update(
+                _header_cell_key(alias) for aliases in profile['columns'].values() for alias in aliases)
+            # Later (user) profiles override built-ins with the same signature
+            self.signature_index[bank_header_signature(profile.get('headers') or self._alias_headers(profile))] = profile
+            self.normalizers[profile['name']] = compile_bank_profile(profile)
+
+    @staticmethod
+    def _alias_headers(profile):
+        return [aliases[0] for aliases in profile['columns'].values() if aliases]
+
+    @staticmethod
+    def _covers(profile, keys):
+        """Number of profile columns found in ``keys``, or 0 if a required column is missing."""
+        found = {
+            canonical for canonical, aliases in profile['columns'].items()
+            if any(_header_cell_key(alias) in keys for alias in aliases)
+        }
+        layout = profile.get('layout', 'debit_credit')
+        required = {'Date', 'Narration'} | ({'Amount'} if layout != 'debit_credit' else {'Debit', 'Credit'})
+        if layout == 'amount_indicator':
+            required.add('Indicator')
+        return len(found) if required <= found else 0
+
+    def detect(self, columns):
+        """Return the profile matching these headers, or None."""
+        signature = bank_header_signature(columns)
+        profile = self.signature_index.get(signature)
+        if profile is not None:
+            return profile
+        best, best_score = None, 0
+        for candidate in self.profiles:
+            score = self._covers(candidate, signature)
+            if score > best_score:
+                best, best_score = candidate, score
+        return best
+
+    def normalize(self, df):
+        """Rename/split ``df`` with the detected profile; unchanged if none matches."""
+        profile = self.detect(df.columns)
+        if profile is None:
+            return df
+        return self.normalizers[profile['name']](df)
+
+
+KNOWN_HEADER_TOKENS.update(
+    _header_cell_key(alias)
+    for profile in BUILTIN_BANK_PROFILES
+    for alias in profile['headers']
+)
+
+# Compiled registries by profile-set hash, so chunks and reruns don't recompile profiles
+BANK_PROFILE_REGISTRY_CACHE_SIZE = 32
+_bank_profile_registries = OrderedDict()
+_bank_profile_registries_lock = threading.Lock()
+
+
+def bank_profiles_key(profiles):
+    """Content hash of a list of bank profiles."""
+    return hashlib.sha256(json.dumps(profiles, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def get_bank_profile_registry(profiles=None):
+    """The compiled BankProfileRegistry for ``profiles`` (default: built-ins), built once per profile set."""
+    key = bank_profiles_key(BUILTIN_BANK_PROFILES if profiles is None else list(profiles))
+    with _bank_profile_registries_lock:
+        registry = _bank_profile_registries.get(key)
+        if registry is not None:
+            _bank_profile_registries.move_to_end(key)
+            return registry
+    registry = BankProfileRegistry(profiles)
+    with _bank_profile_registries_lock:
+        _bank_profile_registries[key] = registry
+        while len(_bank_profile_registries) > BANK_PROFILE_REGISTRY_CACHE_SIZE:
+            _bank_profile_registries.popitem(last=False)
+    return registry
+
+
+def normalize_bank_statement(df, profiles=None, registry=None):
+    """
+    Map a known bank layout onto Date/Narration/Debit/Credit, check required columns
+    and type the amount columns. Layouts come from ``profiles`` (default: built-ins);
+    unknown layouts fall back to title-cased headers. A single signed 'Amount' column
+    (negative or Dr = withdrawal) is split into Debit/Credit.
+    """
+    df = (registry or get_bank_profile_registry(profiles)).normalize(df)
+    df.columns = [c if c in BANK_CANONICAL_COLUMNS else str(c).strip().title() for c in df.columns]
+    if 'Debit' not in df.columns and 'Credit' not in df.columns and 'Amount' in df.columns:
+        paise, dr_cr, invalid = parse_amounts(df['Amount'])
+        is_dr = dr_cr.eq('Dr').fillna(False).astype(bool)
+        is_cr = dr_cr.eq('Cr').fillna(False).astype(bool)
+        outflow = is_dr | ((paise < 0) & ~is_cr)
+        split_signed_amount(df, paise, invalid, outflow)
+    for col in BANK_REQUIRED_COLUMNS:
+        if col not in df.columns:
+            raise ValueError(f"Required column '{col}' not found in file. Please use the template.")
+    if BANK_PAISE_COLUMNS['Debit'] not in df.columns:
+        df = add_amount_paise_columns(df)
+    if df['Narration'].dtype == object and ARROW_STRING_DTYPE is not object:
+        df['Narration'] = df['Narration'].astype(ARROW_STRING_DTYPE)
+    return df
+
+
+def iter_upload_chunks(file_obj, filename, chunk_rows=UPLOAD_CHUNK_ROWS, encoding=None, header_tokens=None):
+    """
+    Yield DataFrame chunks of an uploaded CSV or XLSX file (path or buffer) without loading it whole.
+    CSV text is decoded strictly with ``encoding`` (default: sniffed), as read_csv_upload does, so a
+    UTF-8 guess that fails later in the file raises UnicodeDecodeError instead of being mangled.
+    """
+    if hasattr(file_obj, 'seek'):
+        file_obj.seek(0)
+    if filename.lower().endswith(".xlsx"):
+        return iter_xlsx_batches(file_obj, batch_rows=chunk_rows, header_tokens=header_tokens)
+    # The pyarrow engine has no chunked mode, so chunks use the C parser
+    return pd.read_csv(file_obj, encoding=encoding or sniff_upload_encoding(file_obj),
+                       chunksize=chunk_rows, memory_map=isinstance(file_obj, str))
+
+
+def ingest_bank_statement_chunked(file_obj, filename="statement.csv", chunk_rows=UPLOAD_CHUNK_ROWS, on_chunk=None,
+                                  profiles=None):
+    """
+    Stream a large CSV/XLSX bank statement in chunks of ``chunk_rows`` rows.
+    Each chunk is normalized, typed and trimmed to the required columns, and its
+    unique narrations are folded into a {narration: direction} map as it arrives,
+    so the mapper never needs another full pass. ``on_chunk(rows_read)`` is called
+    after every chunk for progress reporting.
+    Returns (df, narration_directions).
+    """
+    try:
+        return _ingest_bank_chunks(file_obj, filename, chunk_rows, on_chunk, profiles)
+    except UnicodeDecodeError:
+        # Same fallback as read_csv_upload, so both paths decode a file identically
+        return _ingest_bank_chunks(file_obj, filename, chunk_rows, on_chunk, profiles, encoding='latin1')
+
+
+def _ingest_bank_chunks(file_obj, filename, chunk_rows, on_chunk, profiles, encoding=None):
+    registry = get_bank_profile_registry(profiles)
+    chunks = []
+    narration_directions = {}
+    rows_read = 0
+    for chunk in iter_upload_chunks(file_obj, filename, chunk_rows, encoding, registry.header_tokens):
+        chunk = normalize_bank_statement(chunk, registry=registry)[BANK_INGEST_COLUMNS]
+        get_narration_directions(chunk, narration_directions)
+        chunks.append(chunk)
+        rows_read += len(chunk)
+        if on_chunk:
+            on_chunk(rows_read)
+    if not chunks:
+        return pd.DataFrame(columns=BANK_INGEST_COLUMNS), narration_directions
+    df = pd.concat(chunks, ignore_index=True)
+    return df, narration_directions
+
+
+STATEMENT_EXTENSIONS = (".csv", ".xlsx")
+# Uncompressed size limits for zip uploads, checked against each member's header before
+# anything is extracted (zipfile never inflates a member past its declared size)
+ZIP_MEMBER_MAX_BYTES = int(os.getenv("ZIP_MEMBER_MAX_BYTES", str(1024 * 1024 * 1024)))
+ZIP_TOTAL_MAX_BYTES = int(os.getenv("ZIP_TOTAL_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
+BATCH_PARSE_WORKERS = min(8, (os.cpu_count() or 2) * 2)
+
+
+class UploadedMember(io.BytesIO):
+    """A statement extracted from a zip upload, shaped like Streamlit's UploadedFile."""
+
+    def __init__(self, name, data):
+        super().__init__(data)
+        self.name = name
+        self.size = len(data)
+
+
+class ZipMemberSource:
+    """
+    A large statement inside an uploaded zip, left compressed until it has to be
+    parsed. Its digest is derived from the archive's, so store hits never extract it.
+    """
+
+    def __init__(self, archive_upload, info):
+        self.archive_upload = archive_upload
+        self.info = info
+        self.name = f"{archive_upload.name}/{info.filename}"
+        self.size = info.file_size
+
+    @property
+    def digest(self):
+        return hashlib.sha256(f"{get_upload_digest(self.archive_upload)}/{self.info.filename}".encode()).hexdigest()
+
+    def spool(self):
+        """Stream the member out of the archive into a SpooledUpload."""
+        self.archive_upload.seek(0)
+        with zipfile.ZipFile(self.archive_upload) as archive, archive.open(self.info) as stream:
+            return spool_upload(stream, self.name)
+
+
+def expand_upload_batch(uploaded_files):
+    """
+    Flatten uploaded CSV/XLSX files and zip archives into one list of statements.
+    Zip members are named "<archive>/<member>"; folders, macOS metadata and
+    other file types are skipped. Members above LARGE_UPLOAD_THRESHOLD_BYTES stay
+    in the archive as ZipMemberSource until load_bank_statement_batch needs them.
+    Raises ValueError when a member or the zip uploads together expand past
+    ZIP_MEMBER_MAX_BYTES / ZIP_TOTAL_MAX_BYTES.
+    """
+    uploaded_files = list(uploaded_files or [])
+    archives = {}
+    expanded_bytes = 0
+    # Sizes come from the zip directory, so limits are enforced before any member is inflated
+    for position, uploaded in enumerate(uploaded_files):
+        if uploaded.name.lower().endswith(".zip"):
+            uploaded.seek(0)
+            with zipfile.ZipFile(uploaded) as archive:
+                archives[position] = _zip_statement_members(archive)
+            for info in archives[position]:
+                expanded_bytes += info.file_size
+                if info.file_size > ZIP_MEMBER_MAX_BYTES:
+                    raise ValueError(f"{uploaded.name}/{info.filename} expands to {info.file_size:,} bytes, "
+                                     f"above the {ZIP_MEMBER_MAX_BYTES:,} byte limit per statement")
+            if expanded_bytes > ZIP_TOTAL_MAX_BYTES:
+                raise ValueError(f"the zip uploads expand to more than {ZIP_TOTAL_MAX_BYTES:,} bytes")
+
+    sources = []
+    for position, uploaded in enumerate(uploaded_files):
+        if position in archives:
+            uploaded.seek(0)
+            with zipfile.ZipFile(uploaded) as archive:
+                for info in archives[position]:
+                    if info.file_size > LARGE_UPLOAD_THRESHOLD_BYTES:
+                        sources.append(ZipMemberSource(uploaded, info))
+                    else:
+                        sources.append(UploadedMember(f"{uploaded.name}/{info.filename}", archive.read(info)))
+        elif uploaded.name.lower().endswith(STATEMENT_EXTENSIONS):
+            sources.append(uploaded)
+    return sources
+
+
+def _zip_statement_members(archive):
+    """CSV/XLSX members of a zip, without folders and hidden or macOS metadata files."""
+    members = []
+    for info in archive.infolist():
+        member = info.filename
+        if info.is_dir() or member.startswith("__MACOSX/") or os.path.basename(member).startswith("."):
+            continue
+        if member.lower().endswith(STATEMENT_EXTENSIONS):
+            members.append(info)
+    return members
+
+
+def parse_bank_statement(source, profiles=None):
+    """
+    Parse and normalize one statement (an upload, zip member or SpooledUpload; large
+    zip members must be spooled first). Safe to run in a worker thread (no Streamlit calls).
+    Returns (df, narration_directions or None, error message or None).
+    """
+    try:
+        if source.size > LARGE_UPLOAD_THRESHOLD_BYTES:
+            df, directions = ingest_bank_statement_chunked(upload_source(source), source.name, profiles=profiles)
+            return df, directions, None
+        registry = get_bank_profile_registry(profiles)
+        df = load_uploaded_file(upload_source(source), source.name, registry.header_tokens)
+        return normalize_bank_statement(df, registry=registry), None, None
+    except Exception as e:
+        return None, None, str(e)
+
+
+def unique_source_names(sources):
+    """Source names with repeats numbered ("statement.csv (2)"), e.g. same-named files from two folders."""
+    names, used = [], set()
+    for source in sources:
+        name, copy = source.name, 1
+        while name in used:
+            copy += 1
+            name = f"{source.name} ({copy})"
+        used.add(name)
+        names.append(name)
+    return names
+
+
+def load_bank_statement_batch(sources, profiles=None, store_kind="bank", max_workers=BATCH_PARSE_WORKERS):
+    """
+    Load a batch of statements: frames already in the upload store are reused and the
+    rest are parsed concurrently in a thread pool (pandas/pyarrow parsing releases the GIL).
+    Large sources are spooled to temp files and parsed from disk; the files are removed
+    before returning.
+    Returns [(source name, df, narration_directions, error)] in upload order; names are
+    unique within the batch (see unique_source_names).
+    """
+    names = unique_source_names(sources)
+    store = get_upload_store()
+    results = [None] * len(sources)
+    store_keys = []
+    pending = []
+    spooled = {}
+    try:
+        for i, source in enumerate(sources):
+            # A large upload seen for the first time is hashed while it is spooled
+            spool = spool_large_upload(source)
+            if spool is not None:
+                spooled[i] = spool
+            store_keys.append(upload_store_key(get_upload_digest(spool or source), store_kind))
+            cached = store.get(store_keys[i])
+            if cached is not None:
+                results[i] = (names[i], cached, None, None)
+            else:
+                pending.append(i)
+
+        for i in pending:
+            if i not in spooled:
+                spool = spool_large_upload(sources[i], force=True)
+                if spool is not None:
+                    spooled[i] = spool
+
+        if pending:
+            with ThreadPoolExecutor(max_workers=max(1, min(len(pending), max_workers))) as pool:
+                parsed = pool.map(lambda i: parse_bank_statement(spooled.get(i, sources[i]), profiles), pending)
+                for i, (df, directions, error) in zip(pending, parsed):
+                    if df is not None:
+                        store.put(store_keys[i], df)
+                    results[i] = (names[i], df, directions, error)
+    finally:
+        for spool in spooled.values():
+            spool.discard()
+    return results
+
+
+def merge_narration_directions(target, other):
+    """Fold one {narration: direction} map into another; conflicting directions become None."""
+    for narration, direction in other.items():
+        if narration in target and target[narration] != direction:
+            target[narration] = None
+        else:
+            target[narration] = direction
+    return target
+
+
+def combine_bank_statements(frames, source_ledgers):
+    """
+    Stack parsed statements into one mapping frame tagged with 'Source File' and
+    'Bank Ledger' (from ``source_ledgers`` by source name).
+    """
+    parts = []
+    for name, part in frames:
+        part['Source File'] = name
+        part['Bank Ledger'] = source_ledgers.get(name)
+        parts.append(part)
+    if len(parts) == 1:
+        return parts[0]
+    return pd.concat(parts, ignore_index=True)
 
 # --- 2. POLICY TEXT TEMPLATES ---
 PRIVACY_POLICY_TEXT = """
@@ -929,6 +2154,63 @@ def init_db(seed_admin=None, admin_password=None):
                 UNIQUE(email, ledger_name)
             );
         '''))
+        s.execute(text('''
+            CREATE TABLE IF NOT EXISTS ledger_group_policy (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                email TEXT,
+                direction TEXT,
+                ledger_group TEXT,
+                FOREIGN KEY (email) REFERENCES users (email),
+                UNIQUE(email, direction, ledger_group)
+            );
+        '''))
+        s.execute(text('''
+            CREATE TABLE IF NOT EXISTS processed_transactions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                email TEXT,
+                bank_ledger TEXT,
+                fingerprint TEXT,
+                processed_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (email) REFERENCES users (email),
+                UNIQUE(email, bank_ledger, fingerprint)
+            );
+        '''))
+        s.execute(text('''
+            CREATE INDEX IF NOT EXISTS idx_processed_transactions_lookup
+            ON processed_transactions (email, bank_ledger, fingerprint);
+        '''))
+        s.execute(text('''
+            CREATE TABLE IF NOT EXISTS bank_format_profiles (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                email TEXT,
+                profile_name TEXT,
+                profile_json TEXT,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (email) REFERENCES users (email),
+                UNIQUE(email, profile_name)
+            );
+        '''))
+        s.execute(text('''
+            CREATE TABLE IF NOT EXISTS export_artifacts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                email TEXT,
+                inputs_key TEXT,
+                content_hash TEXT,
+                file_name TEXT,
+                mime TEXT,
+                kind TEXT,
+                company_name TEXT,
+                bank_ledger TEXT,
+                voucher_count INTEGER,
+                total_paise INTEGER,
+                size_bytes INTEGER,
+                source_digest TEXT,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                last_used_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (email) REFERENCES users (email),
+                UNIQUE(email, inputs_key)
+            );
+        '''))
 
         # Add/Update Admin User
         try:
@@ -1094,6 +2376,9 @@ def load_user_settings(email):
     st.session_state.bank_rules = []
     st.session_state.default_suspense_ledger = "Bank Suspense A/c (Default)"
     st.session_state.learned_mappings = {}
+    st.session_state.ledger_groups = {}
+    st.session_state.direction_group_policy = {k: list(v) for k, v in DEFAULT_DIRECTION_GROUP_POLICY.items()}
+    st.session_state.bank_profiles = []
     
     conn = get_db_conn()
     with conn.session as s:
@@ -1130,6 +2415,26 @@ def load_user_settings(email):
             print(f"Error loading learned mappings: {e}")
             st.session_state.learned_mappings = {}
 
+        # Load Tally ledger groups and the direction -> allowed groups policy
+        try:
+            groups_db = s.execute(text('SELECT ledger_name, ledger_group FROM tally_synced_ledgers WHERE email = :email'), params=dict(email=email)).fetchall()
+            st.session_state.ledger_groups = {r[0]: r[1] for r in groups_db}
+            policy_db = s.execute(text('SELECT direction, ledger_group FROM ledger_group_policy WHERE email = :email'), params=dict(email=email)).fetchall()
+            if policy_db:
+                policy = {}
+                for direction, ledger_group in policy_db:
+                    policy.setdefault(direction, []).append(ledger_group)
+                st.session_state.direction_group_policy = policy
+        except Exception as e:
+            print(f"Error loading ledger group policy: {e}")
+
+        # Load user-defined bank statement format profiles
+        try:
+            profiles_db = s.execute(text('SELECT profile_json FROM bank_format_profiles WHERE email = :email ORDER BY id'), params=dict(email=email)).fetchall()
+            st.session_state.bank_profiles = [json.loads(r[0]) for r in profiles_db]
+        except Exception as e:
+            print(f"Error loading bank format profiles: {e}")
+
         # Load Tally connection settings
         try:
             tally_conn = s.execute(text('SELECT * FROM tally_connection_settings WHERE email = :email'), params=dict(email=email)).fetchone()
@@ -1166,6 +2471,7 @@ def load_user_settings(email):
                     synced_ledgers = get_synced_ledgers(email)
                     if synced_ledgers:
                         st.session_state.ledger_master = [row[0] for row in synced_ledgers]
+                        st.session_state.ledger_groups = {row[0]: row[1] for row in synced_ledgers}
             except Exception as e:
                 print(f"Auto-sync failed: {e}")
 
@@ -1173,12 +2479,503 @@ def load_user_settings(email):
 
 # --- 4. ENHANCED AI MAPPING WITHOUT OPENAI ---
 
+# Payment-rail narration grammar. Indian bank narrations follow rail-specific
+# layouts, e.g. "UPI/<rrn>/<name>/<vpa>@<bank>/...", "NEFT-<utr>-<name>-..."
+# or "IMPS/P2A/<rrn>/<name>/<bank>/XXXX1234". The rail keyword fixes the field
+# separator, so every field can be classified in one pass over the tokens.
+RAIL_HEAD_PATTERN = re.compile(r'\b(UPI|IMPS|MMT|NEFT|RTGS)\b[^/\-:]*([/\-:])')
+CHEQUE_HEAD_PATTERN = re.compile(r'^(?:TO\s+|BY\s+)?(?:CHQ|CHEQUE|CLG|CLEARING)\b')
+CHEQUE_NUMBER_PATTERN = re.compile(r'\b(\d{6})\b')
+CHEQUE_STOP_WORD_PATTERN = re.compile(
+    r'\b(?:NO|PAID|ISSUED|DEP|DEPO|DPST|DEPST|DEPOSIT|DEPOSITED|RETURN|RTN|RET|CLR|TO|BY|CLG)\b'
+)
+VPA_TOKEN_PATTERN = re.compile(r'^[A-Za-z0-9._\-]{2,}@[A-Za-z][A-Za-z0-9]+$')
+IFSC_TOKEN_PATTERN = re.compile(r'^[A-Z]{4}0[A-Z0-9]{6}$')
+ACCOUNT_TAIL_PATTERN = re.compile(r'^(?:A/?C\s*(?:NO\.?)?\s*)?[X*]{2,}\s*(\d{3,6})$')
+REFERENCE_TOKEN_PATTERN = re.compile(r'^[A-Z]{0,6}\d{6,}[A-Z0-9]*$')
+RAIL_REMARK_PATTERN = re.compile(
+    r'^(?:PAYMENT|PAY|PAID|SENT|RECEIVED|COLLECT|REQUEST|UPI|NA|NO\s+REMARKS?|TRANSFER|TRF)\b'
+)
+NAME_HONORIFIC_PATTERN = re.compile(r'^(?:MR|MRS|MS|SHRI|SMT|SRI)\s+')
+M_S_PATTERN = re.compile(r'\bM/S\.?\s*', re.IGNORECASE)
+
+RAIL_BANK_CODES = {
+    'SBIN', 'HDFC', 'ICIC', 'ICICI', 'UTIB', 'AXIS', 'KKBK', 'KOTAK', 'PUNB', 'BARB', 'YESB', 'IDIB', 'CNRB',
+    'UBIN', 'INDB', 'IDFB', 'PYTM', 'AIRP', 'FDRL', 'IOBA', 'MAHB',
+}
+RAIL_NOISE_TOKENS = {
+    'UPI', 'IMPS', 'MMT', 'NEFT', 'RTGS', 'P2A', 'P2M', 'P2P', 'DR', 'CR', 'INB', 'MOB', 'NET', 'RRN', 'UTR',
+} | RAIL_BANK_CODES
+
+
+def normalize_counterparty_name(name):
+    """Uppercase a counterparty name, dropping punctuation and honorifics."""
+    name = re.sub(r'[^A-Z0-9\s]', ' ', str(name).upper())
+    name = re.sub(r'\s+', ' ', name).strip()
+    return NAME_HONORIFIC_PATTERN.sub('', name)
+
+
+def _is_counterparty_name_token(token):
+    """Return True when a narration field looks like a payee/payer name."""
+    if token in RAIL_NOISE_TOKENS or token.endswith(' BANK') or ' BANK ' in token:
+        return False
+    if RAIL_REMARK_PATTERN.match(token):
+        return False
+    letters = sum(ch.isalpha() for ch in token)
+    return letters >= 3 and letters >= sum(ch.isdigit() for ch in token)
+
+
+def parse_payment_narration(narration):
+    """
+    Parse a bank narration using the payment-rail grammar.
+    Returns a dict with rail, reference, vpa, name, account_tail and ifsc
+    (missing fields are None), or None when no rail is recognised.
+    """
+    if narration is None or pd.isna(narration):
+        return None
+
+    # "M/S" would otherwise be split as two fields on the "/" separator
+    narration_str = M_S_PATTERN.sub('MS ', str(narration).strip())
+    upper = narration_str.upper()
+    parsed = {'rail': None, 'reference': None, 'vpa': None, 'name': None, 'account_tail': None, 'ifsc': None}
+
+    head = RAIL_HEAD_PATTERN.search(upper)
+    if head:
+        rail = head.group(1)
+        parsed['rail'] = 'IMPS' if rail == 'MMT' else rail
+        # Keep the original casing for VPAs; everything else is compared uppercased
+        tokens = narration_str[head.end():].split(head.group(2))
+    elif CHEQUE_HEAD_PATTERN.match(upper):
+        parsed['rail'] = 'CHEQUE'
+        cheque_number = CHEQUE_NUMBER_PATTERN.search(upper)
+        if cheque_number:
+            parsed['reference'] = cheque_number.group(1)
+        remainder = CHEQUE_NUMBER_PATTERN.sub(' ', CHEQUE_HEAD_PATTERN.sub(' ', upper))
+        remainder = CHEQUE_STOP_WORD_PATTERN.sub(' ', remainder)
+        tokens = re.split(r'[/\-:]', remainder)
+    else:
+        return None
+
+    # IMPS/MMT may put the remark before the payee ("MMT/IMPS/<rrn>/<remark>/<name>/<ifsc>"),
+    # so there the name is the last name-like field before the payee's bank details
+    last_name_wins = parsed['rail'] == 'IMPS'
+    bank_seen = False
+    for raw_token in tokens:
+        token = raw_token.strip()
+        if not token:
+            continue
+        token_upper = re.sub(r'\s+', ' ', token.upper())
+        is_bank_field = bool(
+            IFSC_TOKEN_PATTERN.match(token_upper) or ACCOUNT_TAIL_PATTERN.match(token_upper)
+            or token_upper in RAIL_BANK_CODES or token_upper.endswith(' BANK')
+        )
+
+        if parsed['vpa'] is None and VPA_TOKEN_PATTERN.match(token):
+            parsed['vpa'] = token.lower()
+        elif parsed['ifsc'] is None and IFSC_TOKEN_PATTERN.match(token_upper):
+            parsed['ifsc'] = token_upper
+        elif parsed['account_tail'] is None and ACCOUNT_TAIL_PATTERN.match(token_upper):
+            parsed['account_tail'] = ACCOUNT_TAIL_PATTERN.match(token_upper).group(1)
+        elif parsed['reference'] is None and REFERENCE_TOKEN_PATTERN.match(token_upper):
+            parsed['reference'] = token_upper
+        elif (parsed['name'] is None or (last_name_wins and not bank_seen)) and \
+                _is_counterparty_name_token(token_upper):
+            name = normalize_counterparty_name(token_upper)
+            if name:
+                parsed['name'] = name
+        bank_seen = bank_seen or is_bank_field
+
+    return parsed
+
+
+def get_counterparty_keys(parsed):
+    """Return learned-index keys for a parsed narration, most specific first."""
+    if not parsed:
+        return []
+    keys = []
+    if parsed.get('vpa'):
+        keys.append(f"VPA:{parsed['vpa']}")
+    if parsed.get('name'):
+        keys.append(f"NAME:{parsed['name']}")
+    return keys
+
+
+def build_counterparty_index(learned_mappings):
+    """
+    Index learned mappings by counterparty (VPA / payee name) so that a payee
+    learned once matches instantly, whatever the reference numbers are.
+    Returns {counterparty_key: {'ledger': str, 'count': int}}.
+    """
+    index = {}
+    for learned_narration, learned_data in learned_mappings.items():
+        index_learned_mapping(index, learned_narration, learned_data)
+    return index
+
+
+def index_learned_mapping(index, learned_narration, learned_data):
+    """Add one learned mapping to a counterparty index, keeping the most-used ledger per key."""
+    for key in get_counterparty_keys(parse_payment_narration(learned_narration)):
+        count = learned_data.get('count', 1) or 1
+        current = index.get(key)
+        if current is None or count > current['count']:
+            index[key] = {'ledger': learned_data['ledger'], 'count': count}
+
+
+# Tally's predefined (reserved) groups. Ledgers parented by user-created groups
+# are never pruned because their primary group is not known from PARENT alone.
+TALLY_RESERVED_GROUPS = [
+    "Bank Accounts", "Bank OD A/c", "Branch / Divisions", "Capital Account", "Cash-in-Hand",
+    "Current Assets", "Current Liabilities", "Deposits (Asset)", "Direct Expenses", "Direct Incomes",
+    "Duties & Taxes", "Fixed Assets", "Indirect Expenses", "Indirect Incomes", "Investments",
+    "Loans & Advances (Asset)", "Loans (Liability)", "Misc. Expenses (ASSET)", "Provisions",
+    "Purchase Accounts", "Reserves & Surplus", "Sales Accounts", "Secured Loans", "Stock-in-Hand",
+    "Sundry Creditors", "Sundry Debtors", "Suspense A/c", "Unsecured Loans",
+]
+
+# Which Tally groups a contra ledger may belong to, per voucher direction.
+# "Payment" is money leaving the bank (debit column), "Receipt" is money coming in.
+DEFAULT_DIRECTION_GROUP_POLICY = {
+    "Payment": [
+        "Sundry Creditors", "Direct Expenses", "Indirect Expenses", "Purchase Accounts", "Duties & Taxes",
+        "Fixed Assets", "Loans & Advances (Asset)", "Deposits (Asset)", "Loans (Liability)", "Secured Loans",
+        "Unsecured Loans", "Capital Account", "Current Liabilities", "Provisions", "Investments",
+        "Bank Accounts", "Bank OD A/c", "Cash-in-Hand", "Suspense A/c",
+    ],
+    "Receipt": [
+        "Sundry Debtors", "Direct Incomes", "Indirect Incomes", "Sales Accounts", "Loans (Liability)",
+        "Secured Loans", "Unsecured Loans", "Loans & Advances (Asset)", "Capital Account", "Duties & Taxes",
+        "Deposits (Asset)", "Investments", "Bank Accounts", "Bank OD A/c", "Cash-in-Hand", "Suspense A/c",
+    ],
+}
+
+RESERVED_GROUP_KEYS = {group.lower() for group in TALLY_RESERVED_GROUPS}
+
+
+def get_transaction_direction(debit, credit):
+    """Return the voucher direction ("Payment"/"Receipt") for a bank statement row."""
+    try:
+        if float(debit) > 0:
+            return "Payment"
+        if float(credit) > 0:
+            return "Receipt"
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+def get_group_key(group):
+    """Normalise a Tally PARENT group to a reserved-group key; custom groups map to None."""
+    group_key = group.strip().lower() if group else None
+    return group_key if group_key in RESERVED_GROUP_KEYS else None
+
+
+LEDGER_NOISE_WORDS = {
+    'account', 'a/c', 'ac', 'ledger', 'bank', 'cash', 'general',
+    'misc', 'miscellaneous', 'expense', 'expenses', 'and', '&'
+}
+
+LEDGER_KEYWORD_SYNONYMS = {
+    'fuel': {'petrol', 'diesel', 'gas', 'cng'},
+    'petrol': {'fuel', 'diesel', 'gas', 'cng'},
+    'diesel': {'fuel', 'petrol', 'gas', 'cng'},
+    'rent': {'lease'},
+    'salary': {'payroll', 'wages', 'wage'},
+    'travel': {'transport', 'conveyance'},
+    'vendor': {'supplier', 'contractor'},
+    'client': {'customer', 'debtor'},
+    'gst': {'tax'},
+    'tds': {'tax'},
+}
+
+
+def expand_ledger_keywords(clean_ledger):
+    """Return the searchable keyword set (with synonyms) for a preprocessed ledger name."""
+    ledger_words = [word for word in clean_ledger.lower().split() if word and word not in LEDGER_NOISE_WORDS]
+    expanded_keywords = set(ledger_words)
+    for word in ledger_words:
+        expanded_keywords.update(LEDGER_KEYWORD_SYNONYMS.get(word, set()))
+    return expanded_keywords
+
+
+# Legal-form and status words ignored when deciding whether two ledgers are
+# near-duplicates ("ABC Ltd", "ABC Limited" and "ABC Ltd (Old)" share a cluster).
+LEDGER_CLUSTER_NOISE_PATTERN = re.compile(
+    r'\b(?:PVT|PRIVATE|LTD|LIMITED|LLP|INC|CORP|CORPORATION|CO|COMPANY|THE|M S|MS|OLD|NEW|INACTIVE|CLOSED|DORMANT)\b'
+)
+STALE_LEDGER_PATTERN = re.compile(r'\b(?:OLD|INACTIVE|CLOSED|DORMANT|DO NOT USE|DISCONTINUED)\b', re.IGNORECASE)
+
+
+def ledger_cluster_key(clean_ledger):
+    """Key shared by near-duplicate ledgers, or None when the name has no distinctive words."""
+    key = re.sub(r'\s+', '', LEDGER_CLUSTER_NOISE_PATTERN.sub(' ', clean_ledger))
+    return sys.intern(key) if key else None
+
+
+class LedgerEntry:
+    """A single ledger in a LedgerCatalog. ``ledger_id`` is its slot in the catalog array."""
+    __slots__ = ('ledger_id', 'name', 'clean', 'keywords', 'group_key', 'cluster_key', 'stale', 'active')
+
+    def __init__(self, ledger_id, name, clean, keywords, group_key=None):
+        self.ledger_id = ledger_id
+        self.name = name
+        self.clean = clean
+        self.keywords = keywords
+        self.group_key = group_key
+        self.cluster_key = ledger_cluster_key(clean)
+        self.stale = bool(STALE_LEDGER_PATTERN.search(name))
+        self.active = True
+
+
+# Ledgers are indexed for substring lookups by the first characters of their normalized
+# name, so "AMAZON" is still found inside "AMAZONPAY ORDER 123"
+SUBSTRING_KEY_LENGTH = 3
+
+
+def ledger_substring_key(clean_name):
+    """Substring-index key of a normalized ledger name (None for names shorter than the key)."""
+    return clean_name[:SUBSTRING_KEY_LENGTH] if len(clean_name) >= SUBSTRING_KEY_LENGTH else None
+
+
+class LedgerCatalog:
+    """
+    Versioned, array-backed ledger catalog shared by every mapping strategy.
+
+    Ledgers get stable integer ids (their slot in ``entries``; deleted slots are
+    kept as tombstones) and interned normalized names. Add, rename and delete
+    deltas update the keyword, substring, group and embedding indexes in place,
+    and ``version`` increases on every change so consumers can cache derived
+    data by version instead of comparing ledger lists.
+    """
+
+    def __init__(self, normalize):
+        self.normalize = normalize
+        self.entries = []
+        self.name_to_id = {}
+        self.ordered_ids = []
+        self.keyword_index = {}
+        self.substring_index = {}
+        self.group_index = {}
+        self.cluster_index = {}
+        self.encode = None
+        self.embeddings = None
+        self.version = 0
+        self._rank = None
+        self._rank_version = -1
+
+    def __len__(self):
+        return len(self.ordered_ids)
+
+    def __contains__(self, name):
+        return name in self.name_to_id
+
+    def entry(self, name):
+        ledger_id = self.name_to_id.get(name)
+        return self.entries[ledger_id] if ledger_id is not None else None
+
+    def clean_name(self, name):
+        """Normalized name for a ledger, computed on the fly if it is not catalogued."""
+        entry = self.entry(name)
+        return entry.clean if entry is not None else self.normalize(name)
+
+    def ids_for(self, names):
+        return [self.name_to_id[name] for name in names if name in self.name_to_id]
+
+    def rank(self):
+        """Position of each active id in ledger master order (cached per version)."""
+        if self._rank_version != self.version:
+            self._rank = {ledger_id: pos for pos, ledger_id in enumerate(self.ordered_ids)}
+            self._rank_version = self.version
+        return self._rank
+
+    # --- Index maintenance ---
+
+    def _index_entry(self, entry):
+        for keyword in entry.keywords:
+            self.keyword_index.setdefault(keyword, set()).add(entry.ledger_id)
+        if entry.clean:
+            self.substring_index.setdefault(ledger_substring_key(entry.clean), set()).add(entry.ledger_id)
+        self.group_index.setdefault(entry.group_key, set()).add(entry.ledger_id)
+        if entry.cluster_key:
+            self.cluster_index.setdefault(entry.cluster_key, set()).add(entry.ledger_id)
+
+    def _unindex_entry(self, entry):
+        for keyword in entry.keywords:
+            self.keyword_index.get(keyword, set()).discard(entry.ledger_id)
+        if entry.clean:
+            self.substring_index.get(ledger_substring_key(entry.clean), set()).discard(entry.ledger_id)
+        self.group_index.get(entry.group_key, set()).discard(entry.ledger_id)
+        if entry.cluster_key:
+            self.cluster_index.get(entry.cluster_key, set()).discard(entry.ledger_id)
+
+    def _new_entry(self, name, group=None):
+        clean = sys.intern(self.normalize(name))
+        entry = LedgerEntry(len(self.entries), name, clean, expand_ledger_keywords(clean), get_group_key(group))
+        self.entries.append(entry)
+        self.name_to_id[name] = entry.ledger_id
+        self._index_entry(entry)
+        return entry
+
+    def _encode_new_rows(self, entries):
+        """Append embedding rows for newly added entries (rows always line up with ids)."""
+        if self.encode is None or not entries:
+            return
+        vectors = self.encode([entry.clean for entry in entries])
+        self.embeddings = vectors if self.embeddings is None else torch.cat([self.embeddings, vectors])
+
+    # --- Deltas ---
+
+    def add(self, name, group=None):
+        """Add a ledger (no-op if already present) and return its id."""
+        if name in self.name_to_id:
+            return self.name_to_id[name]
+        entry = self._new_entry(name, group)
+        self.ordered_ids.append(entry.ledger_id)
+        self._encode_new_rows([entry])
+        self.version += 1
+        return entry.ledger_id
+
+    def delete(self, name):
+        """Remove a ledger; its id is retired and never reused."""
+        ledger_id = self.name_to_id.pop(name, None)
+        if ledger_id is None:
+            return False
+        entry = self.entries[ledger_id]
+        self._unindex_entry(entry)
+        entry.active = False
+        self.ordered_ids.remove(ledger_id)
+        self.version += 1
+        return True
+
+    def rename(self, old_name, new_name):
+        """Rename a ledger in place, keeping its id and re-indexing only that entry."""
+        ledger_id = self.name_to_id.get(old_name)
+        if ledger_id is None or new_name in self.name_to_id:
+            return False
+        entry = self.entries[ledger_id]
+        self._unindex_entry(entry)
+        del self.name_to_id[old_name]
+        entry.name = new_name
+        entry.clean = sys.intern(self.normalize(new_name))
+        entry.keywords = expand_ledger_keywords(entry.clean)
+        entry.cluster_key = ledger_cluster_key(entry.clean)
+        entry.stale = bool(STALE_LEDGER_PATTERN.search(new_name))
+        self.name_to_id[new_name] = ledger_id
+        self._index_entry(entry)
+        if self.encode is not None and self.embeddings is not None:
+            # Encoder output may be an inference tensor, so splice rather than assign in place
+            vector = self.encode([entry.clean])
+            self.embeddings = torch.cat([self.embeddings[:ledger_id], vector, self.embeddings[ledger_id + 1:]])
+        self.version += 1
+        return True
+
+    def set_group(self, name, group):
+        entry = self.entry(name)
+        group_key = get_group_key(group)
+        if entry is None or entry.group_key == group_key:
+            return False
+        self._unindex_entry(entry)
+        entry.group_key = group_key
+        self._index_entry(entry)
+        self.version += 1
+        return True
+
+    def sync(self, ledger_master, ledger_groups=None):
+        """
+        Apply the delta between the catalog and ``ledger_master``: only added and
+        removed ledgers are (re)indexed and encoded. Returns True if anything changed.
+        """
+        target_names = list(dict.fromkeys(ledger_master))
+        target_set = set(target_names)
+        start_version = self.version
+
+        for name in [name for name in self.name_to_id if name not in target_set]:
+            self.delete(name)
+
+        added = [self._new_entry(name) for name in target_names if name not in self.name_to_id]
+        self._encode_new_rows(added)
+
+        ordered_ids = [self.name_to_id[name] for name in target_names]
+        if added or ordered_ids != self.ordered_ids:
+            self.ordered_ids = ordered_ids
+            self.version += 1
+
+        if ledger_groups is not None:
+            self.sync_groups(ledger_groups)
+
+        return self.version != start_version
+
+    def sync_groups(self, ledger_groups):
+        """Apply Tally PARENT groups; only ledgers whose group changed are re-indexed."""
+        for name, group in ledger_groups.items():
+            if name in self.name_to_id:
+                self.set_group(name, group)
+
+    def attach_encoder(self, encode):
+        """Attach an embedding encoder and embed every catalogued ledger once."""
+        self.encode = encode
+        self.embeddings = encode([entry.clean for entry in self.entries]) if self.entries else None
+        self.version += 1
+
+    # --- Queries ---
+
+    def candidate_ids(self, allowed_group_keys):
+        """Active ids in ledger master order whose group is allowed (custom groups always are)."""
+        allowed_ids = set(self.group_index.get(None, ()))
+        for group_key in allowed_group_keys:
+            allowed_ids.update(self.group_index.get(group_key, ()))
+        return [ledger_id for ledger_id in self.ordered_ids if ledger_id in allowed_ids]
+
+    def cluster_candidates(self, ledger_ids):
+        """
+        Group ids into near-duplicate clusters: [(representative_id, member_ids), ...]
+        in order of first appearance. Members are ordered active-first, then by
+        ledger master order, so the representative is the preferred ledger.
+        """
+        rank = self.rank()
+        clusters = {}
+        for ledger_id in ledger_ids:
+            cluster_key = self.entries[ledger_id].cluster_key or ledger_id
+            clusters.setdefault(cluster_key, []).append(ledger_id)
+        result = []
+        for members in clusters.values():
+            if len(members) > 1:
+                members.sort(key=lambda i: (self.entries[i].stale, rank.get(i, 0)))
+            result.append((members[0], members))
+        return result
+
+    def duplicate_clusters(self):
+        """Clusters with more than one active ledger, for master clean-up."""
+        rank = self.rank()
+        clusters = []
+        for ledger_ids in self.cluster_index.values():
+            if len(ledger_ids) > 1:
+                members = sorted(ledger_ids, key=lambda i: (self.entries[i].stale, rank.get(i, 0)))
+                clusters.append([self.entries[i].name for i in members])
+        return sorted(clusters, key=lambda names: names[0].lower())
+
+    def substring_matches(self, clean_narration):
+        """Ids of ledgers whose normalized name occurs in the narration, in ledger master order."""
+        if not clean_narration:
+            return []
+        # A ledger can only occur in the narration if its leading n-gram does
+        ledger_ids = set(self.substring_index.get(None, ()))
+        for start in range(len(clean_narration) - SUBSTRING_KEY_LENGTH + 1):
+            ledger_ids.update(self.substring_index.get(clean_narration[start:start + SUBSTRING_KEY_LENGTH], ()))
+        rank = self.rank()
+        matches = [i for i in ledger_ids if self.entries[i].clean in clean_narration]
+        return sorted(matches, key=rank.__getitem__)
+
+
 class EnhancedLedgerMapper:
     def __init__(self):
         self.model = None
-        self.ledger_embeddings = None
-        self.ledger_master = None
-        self.ledger_keyword_index = None
+        self.catalog = LedgerCatalog(self.preprocess_narration)
+        self.catalog_source = None
+        self.catalog_groups_source = None
+        self.candidate_cache = {}
+        self.candidate_cache_version = None
+        self.counterparty_index = None
+        self.counterparty_index_source = None
         self.initialized = False
         
     def initialize_model(self):
@@ -1370,54 +3167,124 @@ class EnhancedLedgerMapper:
 
         return narration_str
 
-    def build_ledger_keyword_index(self, ledger_master):
-        """Prepare searchable keyword sets from ledger names"""
-        noise_words = {
-            'account', 'a/c', 'ac', 'ledger', 'bank', 'cash', 'general',
-            'misc', 'miscellaneous', 'expense', 'expenses', 'and', '&'
-        }
-
-        keyword_synonyms = {
-            'fuel': {'petrol', 'diesel', 'gas', 'cng'},
-            'petrol': {'fuel', 'diesel', 'gas', 'cng'},
-            'diesel': {'fuel', 'petrol', 'gas', 'cng'},
-            'rent': {'lease'},
-            'salary': {'payroll', 'wages', 'wage'},
-            'travel': {'transport', 'conveyance'},
-            'vendor': {'supplier', 'contractor'},
-            'client': {'customer', 'debtor'},
-            'gst': {'tax'},
-            'tds': {'tax'},
-        }
-
-        ledger_index = []
+    @staticmethod
+    def _catalog_source(value, items):
+        # Hold a reference so the identity check stays valid for as long as the object lives;
+        # the content hash catches in-place edits (renames, group changes) that keep the length
+        return (value, len(value), hash(tuple(items)))
 
-        for ledger in ledger_master:
-            clean_ledger = self.preprocess_narration(ledger)
-            ledger_words = [word for word in clean_ledger.lower().split() if word and word not in noise_words]
-
-            expanded_keywords = set(ledger_words)
-            for word in ledger_words:
-                expanded_keywords.update(keyword_synonyms.get(word, set()))
-
-            ledger_index.append({
-                'ledger': ledger,
-                'clean': clean_ledger,
-                'keywords': expanded_keywords
-            })
-
-        return ledger_index
+    @staticmethod
+    def _catalog_source_is_current(source, value, items, check_content):
+        if source is None or source[0] is not value or source[1] != len(value):
+            return False
+        return not check_content or source[2] == hash(tuple(items))
 
-    def ensure_ledger_index(self, ledger_master):
-        """Ensure ledger keyword index is prepared for the current ledger master."""
-        if not ledger_master:
+    def ensure_catalog(self, ledger_master, ledger_groups=None, check_content=True):
+        """
+        Bring the ledger catalog in line with the ledger master (and groups) by applying
+        deltas. Per-narration callers pass ``check_content=False`` to skip re-hashing the
+        lists; batch entry points check content once before their loop.
+        """
+        if ledger_master and not self._catalog_source_is_current(
+                self.catalog_source, ledger_master, ledger_master, check_content):
+            self.catalog.sync(ledger_master)
+            self.catalog_source = self._catalog_source(ledger_master, ledger_master)
+        if ledger_groups is not None and not self._catalog_source_is_current(
+                self.catalog_groups_source, ledger_groups, ledger_groups.items(), check_content):
+            self.catalog.sync_groups(ledger_groups)
+            self.catalog_groups_source = self._catalog_source(ledger_groups, ledger_groups.items())
+        self.refresh_candidate_cache()
+        return self.catalog
+
+    def refresh_candidate_cache(self):
+        """Drop cached candidate lists and embedding views when the catalog version moves."""
+        if self.candidate_cache_version != self.catalog.version:
+            self.candidate_cache = {}
+            self.candidate_cache_version = self.catalog.version
+
+    def candidate_ledgers(self, ledger_master, direction=None, ledger_groups=None, group_policy=None):
+        """Prune the ledger master to the Tally groups allowed for a transaction direction."""
+        if not direction or not ledger_groups or not ledger_master:
+            return ledger_master
+
+        allowed_groups = (group_policy or DEFAULT_DIRECTION_GROUP_POLICY).get(direction)
+        if not allowed_groups:
+            return ledger_master
+
+        catalog = self.ensure_catalog(ledger_master, ledger_groups, check_content=False)
+        cache_key = (direction, tuple(allowed_groups))
+        if cache_key not in self.candidate_cache:
+            allowed_keys = {get_group_key(group) for group in allowed_groups} - {None}
+            candidate_ids = catalog.candidate_ids(allowed_keys)
+            candidates = [catalog.entries[ledger_id].name for ledger_id in candidate_ids]
+            if not candidates:
+                candidates, candidate_ids = ledger_master, catalog.ordered_ids
+            self.candidate_cache[cache_key] = (candidates, candidate_ids)
+            self.candidate_cache[id(candidates)] = (candidates, candidate_ids)
+        return self.candidate_cache[cache_key][0]
+
+    def candidate_ids(self, candidates):
+        """Catalog ids for a candidate list (cached for lists produced by candidate_ledgers)."""
+        self.refresh_candidate_cache()
+        if candidates is None or (self.catalog_source and candidates is self.catalog_source[0]):
+            return self.catalog.ordered_ids
+        cached = self.candidate_cache.get(id(candidates))
+        if cached is not None and cached[0] is candidates:
+            return cached[1]
+        return self.catalog.ids_for(candidates)
+
+    def candidate_clusters(self, candidates):
+        """Near-duplicate clusters over a candidate list, cached per catalog version."""
+        ids = self.candidate_ids(candidates)
+        cached = self.candidate_cache.get(('clusters', id(ids)))
+        if cached is None or cached[0] is not ids:
+            cached = (ids, self.catalog.cluster_candidates(ids))
+            self.candidate_cache[('clusters', id(ids))] = cached
+        return cached[1]
+
+    def candidate_id_set(self, candidates):
+        """Set form of candidate_ids, cached per candidate list."""
+        ids = self.candidate_ids(candidates)
+        cached = self.candidate_cache.get(('set', id(ids)))
+        if cached is None or cached[0] is not ids:
+            cached = (ids, set(ids))
+            self.candidate_cache[('set', id(ids))] = cached
+        return cached[1]
+
+    def _counterparty_index_is_current(self, learned_mappings):
+        source = self.counterparty_index_source
+        return (self.counterparty_index is not None and source[0] is learned_mappings
+                and source[1] == len(learned_mappings))
+
+    def ensure_counterparty_index(self, learned_mappings):
+        """Ensure the counterparty-keyed learned index matches the current learned mappings."""
+        # In-place changes go through record_learned_mapping; a new or resized dict is rebuilt
+        if not self._counterparty_index_is_current(learned_mappings):
+            self.counterparty_index = build_counterparty_index(learned_mappings)
+            self.counterparty_index_source = (learned_mappings, len(learned_mappings))
+        return self.counterparty_index
+
+    def record_learned_mapping(self, learned_mappings, narration):
+        """Fold one added or re-counted entry of ``learned_mappings`` into the counterparty index."""
+        if self.counterparty_index is None or self.counterparty_index_source[0] is not learned_mappings:
+            return
+        index_learned_mapping(self.counterparty_index, narration, learned_mappings[narration])
+        self.counterparty_index_source = (learned_mappings, len(learned_mappings))
+
+    def counterparty_learned_match(self, narration, learned_mappings):
+        """Look up a learned ledger by the narration's counterparty (VPA or payee name)."""
+        if not learned_mappings:
+            return None
+        keys = get_counterparty_keys(parse_payment_narration(narration))
+        if not keys:
             return None
-        if self.ledger_master != ledger_master or self.ledger_keyword_index is None:
-            self.ledger_keyword_index = self.build_ledger_keyword_index(ledger_master)
-            self.ledger_master = ledger_master
-        return self.ledger_keyword_index
+        counterparty_index = self.ensure_counterparty_index(learned_mappings)
+        for key in keys:
+            if key in counterparty_index:
+                return counterparty_index[key]['ledger']
+        return None
 
-    def ledger_name_focus_match(self, narration, ledger_master):
+    def ledger_name_focus_match(self, narration, ledger_master, candidates=None):
         """Prioritize matches that align closely with ledger names"""
         clean_narration = self.preprocess_narration(narration)
         narration_words = set(clean_narration.lower().split()) if clean_narration else set()
@@ -1425,50 +3292,59 @@ class EnhancedLedgerMapper:
         if not narration_words or not ledger_master:
             return None, 0
 
-        ledger_index = self.ensure_ledger_index(ledger_master)
-        if not ledger_index:
-            return None, 0
-        best_ledger = None
+        catalog = self.ensure_catalog(ledger_master, check_content=False)
         best_score = 0
+        best_members = None
+
+        # Score cluster representatives first; expand into a cluster only when it wins
+        for representative_id, members in self.candidate_clusters(candidates):
+            score = self.ledger_focus_score(clean_narration, narration_words, catalog.entries[representative_id])
+            if score > best_score:
+                best_score = score
+                best_members = members
+
+        if best_members:
+            best_ledger = catalog.entries[best_members[0]].name
+            for member_id in best_members[1:]:
+                score = self.ledger_focus_score(clean_narration, narration_words, catalog.entries[member_id])
+                if score > best_score:
+                    best_score = score
+                    best_ledger = catalog.entries[member_id].name
+            return best_ledger, min(95, best_score)
 
-        for entry in ledger_index:
-            overlap = narration_words.intersection(entry['keywords'])
-            overlap_score = len(overlap) * 22  # Boost for strong keyword overlap
-
-            name_similarity = self.calculate_string_similarity(clean_narration, entry['clean'])
-            similarity_score = name_similarity * 60
-
-            partial_bonus = 20 if entry['clean'] and entry['clean'] in clean_narration else 0
+        return None, 0
 
-            combined_score = overlap_score + similarity_score + partial_bonus
+    def ledger_focus_score(self, clean_narration, narration_words, entry):
+        """Ledger-name focus score for one catalog entry (0 when it does not qualify)."""
+        overlap = narration_words.intersection(entry.keywords)
+        overlap_score = len(overlap) * 22  # Boost for strong keyword overlap
 
-            if combined_score > best_score and (overlap or name_similarity >= 0.55):
-                best_score = combined_score
-                best_ledger = entry['ledger']
+        name_similarity = self.calculate_string_similarity(clean_narration, entry.clean)
+        similarity_score = name_similarity * 60
 
-        if best_ledger:
-            return best_ledger, min(95, best_score)
+        partial_bonus = 20 if entry.clean and entry.clean in clean_narration else 0
 
-        return None, 0
+        if not (overlap or name_similarity >= 0.55):
+            return 0
+        return overlap_score + similarity_score + partial_bonus
     
     def compute_ledger_embeddings(self, ledger_master):
-        """Compute embeddings for the ledger master"""
+        """Ensure catalog embeddings exist; only ledgers added since the last call are encoded."""
         if not self.initialized or not ledger_master:
             return None
             
         try:
-            processed_ledgers = [self.preprocess_narration(ledger) for ledger in ledger_master]
-            self.ledger_embeddings = self.model.encode(processed_ledgers, convert_to_tensor=True)
-            self.ledger_master = ledger_master
-            self.ledger_keyword_index = self.build_ledger_keyword_index(ledger_master)
+            catalog = self.ensure_catalog(ledger_master)
+            if catalog.encode is None:
+                catalog.attach_encoder(lambda texts: self.model.encode(texts, convert_to_tensor=True))
             return True
         except Exception as e:
             print(f"Error computing ledger embeddings: {e}")
             return False
     
-    def semantic_similarity_match(self, narration, threshold=0.4):
+    def semantic_similarity_match(self, narration, threshold=0.4, candidates=None):
         """Enhanced semantic similarity matching focusing on names"""
-        if not self.initialized or self.ledger_embeddings is None:
+        if not self.initialized or self.catalog.embeddings is None:
             return None, 0
             
         try:
@@ -1483,14 +3359,25 @@ class EnhancedLedgerMapper:
                 return None, 0
             
             narration_embedding = self.model.encode([clean_narration], convert_to_tensor=True)
-            
-            cosine_scores = util.cos_sim(narration_embedding, self.ledger_embeddings)[0]
+
+            # Score only the active (and, when pruned, candidate) rows of the embedding matrix
+            rows = self.candidate_ids(candidates)
+            if not rows:
+                return None, 0
+            view_key = ('embeddings', id(rows))
+            cached_view = self.candidate_cache.get(view_key)
+            if cached_view is None or cached_view[0] is not rows:
+                cached_view = (rows, self.catalog.embeddings[rows])
+                self.candidate_cache[view_key] = cached_view
+
+            cosine_scores = util.cos_sim(narration_embedding, cached_view[1])[0]
             
             best_score, best_idx = torch.max(cosine_scores, dim=0)
             best_score = best_score.item()
+            best_ledger = self.catalog.entries[rows[best_idx.item()]].name
             
             if best_score >= threshold:
-                return self.ledger_master[best_idx], best_score * 100
+                return best_ledger, best_score * 100
             else:
                 return None, best_score * 100
                 
@@ -1498,6 +3385,19 @@ class EnhancedLedgerMapper:
             print(f"Semantic matching error: {e}")
             return None, 0
     
+    def name_match_score(self, extracted_name, clean_ledger):
+        """Score an extracted counterparty name against a ledger name (0 when no match)."""
+        if not clean_ledger:
+            return 0
+        # Check if extracted name matches ledger name
+        name_similarity = self.calculate_string_similarity(extracted_name, clean_ledger)
+        if name_similarity > 0.6:  # Good name match
+            return min(95, name_similarity * 100)
+        # Check for substring match
+        if extracted_name in clean_ledger or clean_ledger in extracted_name:
+            return 90
+        return 0
+
     def keyword_based_match(self, narration, ledger_master):
         """Enhanced keyword-based matching with focus on names"""
         if not narration or not ledger_master:
@@ -1507,19 +3407,22 @@ class EnhancedLedgerMapper:
         clean_narration = self.preprocess_narration(narration_str)
         extracted_name, is_person_transaction = self.identify_person_or_company_name(narration)
         category = self.categorize_transaction(narration)
+        if self.catalog_source is None:
+            self.ensure_catalog(ledger_master)
+        catalog = self.catalog
         
-        # Strategy 1: Direct name matching (HIGHEST PRIORITY)
+        # Strategy 1: Direct name matching (HIGHEST PRIORITY), over cluster representatives
         if extracted_name and is_person_transaction:
-            for ledger in ledger_master:
-                clean_ledger = self.preprocess_narration(ledger)
-                # Check if extracted name matches ledger name
-                name_similarity = self.calculate_string_similarity(extracted_name, clean_ledger)
-                if name_similarity > 0.6:  # Good name match
-                    return ledger, min(95, name_similarity * 100)
-                
-                # Check for substring match
-                if extracted_name in clean_ledger or clean_ledger in extracted_name:
-                    return ledger, 90
+            for representative_id, members in self.candidate_clusters(ledger_master):
+                best_score = self.name_match_score(extracted_name, catalog.entries[representative_id].clean)
+                if not best_score:
+                    continue
+                best_id = representative_id
+                for member_id in members[1:]:
+                    score = self.name_match_score(extracted_name, catalog.entries[member_id].clean)
+                    if score > best_score:
+                        best_id, best_score = member_id, score
+                return catalog.entries[best_id].name, best_score
         
         # Strategy 2: Category-based matching
         category_keywords = {
@@ -1542,11 +3445,13 @@ class EnhancedLedgerMapper:
                     if keyword in ledger.lower():
                         return ledger, 80
         
-        # Strategy 3: Direct substring match
-        for ledger in ledger_master:
-            clean_ledger = self.preprocess_narration(ledger)
-            if clean_ledger and clean_ledger in clean_narration:
-                return ledger, 85
+        # Strategy 3: Direct substring match (first-word index instead of scanning every ledger)
+        substring_ids = catalog.substring_matches(clean_narration)
+        if substring_ids:
+            allowed_ids = self.candidate_id_set(ledger_master)
+            for ledger_id in substring_ids:
+                if ledger_id in allowed_ids:
+                    return catalog.entries[ledger_id].name, 85
         
         # Strategy 4: Word overlap matching
         narration_words = set(clean_narration.split())
@@ -1554,7 +3459,7 @@ class EnhancedLedgerMapper:
         best_ledger = None
         
         for ledger in ledger_master:
-            clean_ledger = self.preprocess_narration(ledger)
+            clean_ledger = catalog.clean_name(ledger)
             if not clean_ledger:
                 continue
                 
@@ -1576,9 +3481,13 @@ class EnhancedLedgerMapper:
         
         return None, 0
 
-    def multi_strategy_match(self, narration, ledger_master, rules_config, suspense_ledger, learned_mappings):
+    def multi_strategy_match(self, narration, ledger_master, rules_config, suspense_ledger, learned_mappings,
+                             direction=None, ledger_groups=None, group_policy=None):
         """Comprehensive multi-strategy matching with focus on names"""
         narration_str = str(narration)
+        self.ensure_catalog(ledger_master, ledger_groups, check_content=False)
+        # Rules and learned mappings are explicit user decisions; only scored strategies are pruned
+        candidates = self.candidate_ledgers(ledger_master, direction, ledger_groups, group_policy)
         extracted_name, is_person_transaction = self.identify_person_or_company_name(narration)
         
         # Strategy 1: Exact learned mapping
@@ -1590,7 +3499,12 @@ class EnhancedLedgerMapper:
             keyword = rule.get('Narration Keyword', '').lower()
             if keyword and keyword in narration_str.lower():
                 return rule.get('Mapped Ledger'), 90, "rule"
-        
+
+        # Strategy 2b: Learned counterparty (same payee VPA/name, any reference numbers)
+        counterparty_ledger = self.counterparty_learned_match(narration_str, learned_mappings)
+        if counterparty_ledger:
+            return counterparty_ledger, 90, "learned_counterparty"
+
         # Strategy 3: Similar learned mappings with enhanced similarity
         best_learned_score = 0
         best_learned_ledger = None
@@ -1607,32 +3521,32 @@ class EnhancedLedgerMapper:
             return best_learned_ledger, min(85, best_learned_score), "learned_similar"
 
         # Strategy 4: Enhanced keyword matching with name focus
-        keyword_match, keyword_score = self.keyword_based_match(narration_str, ledger_master)
+        keyword_match, keyword_score = self.keyword_based_match(narration_str, candidates)
         if keyword_match and keyword_score >= 50:
             return keyword_match, keyword_score, "keyword_match"
 
         # Strategy 5: Match based on ledger-name keywords and overlaps
-        ledger_focus_match, ledger_focus_score = self.ledger_name_focus_match(narration_str, ledger_master)
+        ledger_focus_match, ledger_focus_score = self.ledger_name_focus_match(narration_str, ledger_master, candidates)
         if ledger_focus_match and ledger_focus_score >= 55:
             return ledger_focus_match, ledger_focus_score, "ledger_name_focus"
 
         # Strategy 6: Semantic AI matching
         if self.initialized:
-            semantic_match, semantic_score = self.semantic_similarity_match(narration_str, threshold=0.3)
+            semantic_match, semantic_score = self.semantic_similarity_match(narration_str, threshold=0.3, candidates=candidates)
             if semantic_match and semantic_score >= 35:
                 return semantic_match, semantic_score, "semantic_ai"
 
         # Strategy 7: Category-based fallback with name suggestion
         category = self.categorize_transaction(narration_str)
         category_ledgers = {
-            'salary': [ledger for ledger in ledger_master if any(word in ledger.lower() for word in ['salary', 'employee', 'staff'])],
-            'food': [ledger for ledger in ledger_master if any(word in ledger.lower() for word in ['food', 'meal', 'restaurant'])],
-            'travel': [ledger for ledger in ledger_master if any(word in ledger.lower() for word in ['travel', 'transport', 'fuel', 'conveyance'])],
-            'shopping': [ledger for ledger in ledger_master if any(word in ledger.lower() for word in ['purchase', 'expense', 'general', 'supplies'])],
-            'utilities': [ledger for ledger in ledger_master if any(word in ledger.lower() for word in ['electricity', 'water', 'utility', 'telephone'])],
-            'vendor': [ledger for ledger in ledger_master if any(word in ledger.lower() for word in ['vendor', 'supplier', 'contractor'])],
-            'client': [ledger for ledger in ledger_master if any(word in ledger.lower() for word in ['client', 'customer', 'debtor'])],
-            'income': [ledger for ledger in ledger_master if any(word in ledger.lower() for word in ['salary', 'income', 'revenue'])]
+            'salary': [ledger for ledger in candidates if any(word in ledger.lower() for word in ['salary', 'employee', 'staff'])],
+            'food': [ledger for ledger in candidates if any(word in ledger.lower() for word in ['food', 'meal', 'restaurant'])],
+            'travel': [ledger for ledger in candidates if any(word in ledger.lower() for word in ['travel', 'transport', 'fuel', 'conveyance'])],
+            'shopping': [ledger for ledger in candidates if any(word in ledger.lower() for word in ['purchase', 'expense', 'general', 'supplies'])],
+            'utilities': [ledger for ledger in candidates if any(word in ledger.lower() for word in ['electricity', 'water', 'utility', 'telephone'])],
+            'vendor': [ledger for ledger in candidates if any(word in ledger.lower() for word in ['vendor', 'supplier', 'contractor'])],
+            'client': [ledger for ledger in candidates if any(word in ledger.lower() for word in ['client', 'customer', 'debtor'])],
+            'income': [ledger for ledger in candidates if any(word in ledger.lower() for word in ['salary', 'income', 'revenue'])]
         }
         
         if category in category_ledgers and category_ledgers[category]:
@@ -1641,15 +3555,17 @@ class EnhancedLedgerMapper:
         # Final fallback: If we extracted a name but couldn't match, create a suggestion
         if extracted_name and is_person_transaction:
             # Look for any ledger that might be related to the extracted name
-            for ledger in ledger_master:
+            for ledger in candidates:
                 if extracted_name.lower() in ledger.lower():
                     return ledger, 55, "name_fallback"
 
         # Ultimate fallback
         return suspense_ledger, 0, "default"
 
-# Global instance of the enhanced mapper
-ledger_mapper = EnhancedLedgerMapper()
+# One mapper per browser session, so its ledger catalog and indexes survive reruns
+if "ledger_mapper" not in st.session_state:
+    st.session_state.ledger_mapper = EnhancedLedgerMapper()
+ledger_mapper = st.session_state.ledger_mapper
 
 def initialize_ai_model():
     """Initialize the AI model on app start"""
@@ -1657,17 +3573,22 @@ def initialize_ai_model():
         return ledger_mapper.initialize_model()
     return ledger_mapper.initialized
 
-def get_smart_suggestions(narrations_list, ledger_master, rules_config, suspense_ledger, learned_mappings):
+def get_smart_suggestions(narrations_list, ledger_master, rules_config, suspense_ledger, learned_mappings,
+                          narration_directions=None, ledger_groups=None, group_policy=None):
     """
-    Enhanced smart suggestions with focus on names at end of narration
+    Enhanced smart suggestions with focus on names at end of narration.
+    When narration_directions ({narration: "Payment"/"Receipt"}) and ledger_groups
+    ({ledger: Tally group}) are given, candidates are pruned by the group policy.
     """
     best_matches = {}
     confidence_scores = {}
     match_types = {}
     
     initialize_ai_model()
+    if ledger_master:
+        ledger_mapper.ensure_catalog(ledger_master, ledger_groups)
     
-    if ledger_mapper.initialized and (ledger_mapper.ledger_master != ledger_master or ledger_mapper.ledger_embeddings is None):
+    if ledger_mapper.initialized:
         ledger_mapper.compute_ledger_embeddings(ledger_master)
     
     # Filter out NaN values before processing to avoid dictionary key issues
@@ -1679,7 +3600,10 @@ def get_smart_suggestions(narrations_list, ledger_master, rules_config, suspense
 
         # Use the comprehensive multi-strategy matching with name focus
         suggested_ledger, confidence, match_type = ledger_mapper.multi_strategy_match(
-            narration_str, ledger_master, rules_config, suspense_ledger, learned_mappings
+            narration_str, ledger_master, rules_config, suspense_ledger, learned_mappings,
+            direction=(narration_directions or {}).get(narration_str),
+            ledger_groups=ledger_groups,
+            group_policy=group_policy
         )
 
         # Use string representation as key to ensure consistency
@@ -1732,13 +3656,126 @@ def update_learned_mappings(email, narration, mapped_ledger, similarity_score=0)
             else:
                 st.session_state.learned_mappings[narration]['count'] += 1
                 st.session_state.learned_mappings[narration]['score'] = min(new_score, 95) if existing else base_score
+
+            if 'ledger_mapper' in st.session_state:
+                st.session_state.ledger_mapper.record_learned_mapping(st.session_state.learned_mappings, narration)
                 
         except Exception as e:
             print(f"Error updating learned mappings: {e}")
 
+def compute_transaction_fingerprints(df, date_format=None):
+    """
+    Stable per-row fingerprints of bank transactions: a hash of Tally date, amount in
+    paise, direction and canonical narration, plus an occurrence number so identical
+    transactions within one statement stay distinct. Occurrences are counted per
+    'Source File', so a transaction in two overlapping statements of one batch gets
+    the same fingerprint in both. Computed with vectorized hashing.
+    """
+    if df.empty:
+        return pd.Series([], index=df.index, dtype=object)
+    debit = get_amount_paise(df, 'Debit')
+    credit = get_amount_paise(df, 'Credit')
+    direction = pd.Series('', index=df.index).mask(credit > 0, 'R').mask(debit > 0, 'P')
+    canonical = (
+        df['Narration'].astype(object).fillna('').astype(str)
+        .str.upper().str.replace(r'\s+', ' ', regex=True).str.strip()
+    )
+    key = pd.DataFrame({
+        'date': get_tally_dates(df, date_format).astype(object).fillna('').astype(str),
+        'amount': debit.where(debit > 0, credit),
+        'direction': direction,
+        'narration': canonical,
+    })
+    hashed = pd.util.hash_pandas_object(key, index=False)
+    if 'Source File' in df.columns:
+        occurrence = hashed.groupby([df['Source File'].astype(object).fillna(''), hashed]).cumcount()
+    else:
+        occurrence = hashed.groupby(hashed).cumcount()
+    hashed = pd.util.hash_pandas_object(pd.DataFrame({'hash': hashed, 'occurrence': occurrence}), index=False)
+    return hashed.map('{:016x}'.format).astype(object)
+
+
+def _row_bank_ledgers(df, default_bank_ledger):
+    if 'Bank Ledger' in df.columns:
+        return df['Bank Ledger'].astype(object).fillna(default_bank_ledger).astype(str)
+    return pd.Series(str(default_bank_ledger), index=df.index)
+
+
+def find_processed_transactions(email, df, default_bank_ledger):
+    """Boolean mask of rows whose fingerprint was already exported or pushed for their bank ledger."""
+    if df.empty or 'Fingerprint' not in df.columns:
+        return pd.Series(False, index=df.index)
+    ledgers = _row_bank_ledgers(df, default_bank_ledger)
+    known = set()
+    try:
+        conn = get_db_conn()
+        with conn.session as s:
+            for ledger in ledgers.unique():
+                rows = s.execute(text(
+                    'SELECT fingerprint FROM processed_transactions WHERE email = :email AND bank_ledger = :ledger'
+                ), params=dict(email=email, ledger=ledger)).fetchall()
+                known.update(f"{ledger}\x1f{r[0]}" for r in rows)
+    except Exception as e:
+        print(f"Error loading processed transactions: {e}")
+    if not known:
+        return pd.Series(False, index=df.index)
+    return (ledgers + '\x1f' + df['Fingerprint'].astype(object).fillna('').astype(str)).isin(known)
+
+
+def find_repeated_transactions(df, default_bank_ledger):
+    """
+    Rows whose transaction already appears earlier in the batch for the same bank
+    account, i.e. the overlap between statements uploaded together.
+    """
+    keys = pd.DataFrame({'ledger': _row_bank_ledgers(df, default_bank_ledger).to_numpy(),
+                         'fingerprint': df['Fingerprint'].to_numpy()}, index=df.index)
+    return keys.duplicated()
+
+
+def record_processed_transactions(email, df, default_bank_ledger, date_format=None):
+    """Remember the fingerprints of exported or pushed rows so re-uploads can skip them."""
+    if df.empty:
+        return
+    fingerprints = df['Fingerprint'] if 'Fingerprint' in df.columns else pd.Series(None, index=df.index, dtype=object)
+    missing = fingerprints.isna()
+    if missing.any():
+        # Rows added by hand in the editor have no upload-time fingerprint
+        fingerprints = fingerprints.astype(object).copy()
+        fingerprints[missing] = compute_transaction_fingerprints(df[missing], date_format)
+    ledgers = _row_bank_ledgers(df, default_bank_ledger)
+    try:
+        conn = get_db_conn()
+        with conn.session as s:
+            s.execute(text('''
+                INSERT OR IGNORE INTO processed_transactions (email, bank_ledger, fingerprint)
+                VALUES (:email, :ledger, :fingerprint)
+            '''), [dict(email=email, ledger=ledger, fingerprint=fp) for ledger, fp in zip(ledgers, fingerprints)])
+            s.commit()
+    except Exception as e:
+        print(f"Error recording processed transactions: {e}")
+
 # --- AUTO MAPPING FUNCTIONS ---
 
-def auto_map_ledgers_based_on_rules(narrations_list, ledger_master, rules_config, suspense_ledger, learned_mappings):
+def get_narration_directions(df, directions=None):
+    """
+    Map each bank narration to its voucher direction; narrations seen both ways map to None.
+    Pass an existing ``directions`` dict to fold in another chunk of rows.
+    """
+    if directions is None:
+        directions = {}
+    for narration, debit, credit in zip(df['Narration'], df['Debit'], df['Credit']):
+        if pd.isna(narration):
+            continue
+        narration_str = str(narration)
+        direction = get_transaction_direction(debit, credit)
+        if narration_str in directions and directions[narration_str] != direction:
+            directions[narration_str] = None
+        else:
+            directions[narration_str] = direction
+    return directions
+
+def auto_map_ledgers_based_on_rules(narrations_list, ledger_master, rules_config, suspense_ledger, learned_mappings,
+                                    narration_directions=None, ledger_groups=None, group_policy=None):
     """
     Automatically map ledgers based on smart rules and learned mappings
     Returns dictionary of {narration: mapped_ledger}
@@ -1747,7 +3784,9 @@ def auto_map_ledgers_based_on_rules(narrations_list, ledger_master, rules_config
 
     # Ensure AI model and embeddings are ready for enhanced matching
     initialize_ai_model()
-    if ledger_mapper.initialized and (ledger_mapper.ledger_master != ledger_master or ledger_mapper.ledger_embeddings is None):
+    if ledger_master:
+        ledger_mapper.ensure_catalog(ledger_master, ledger_groups)
+    if ledger_mapper.initialized:
         ledger_mapper.compute_ledger_embeddings(ledger_master)
 
     # Filter out NaN values before processing to avoid dictionary key issues
@@ -1772,7 +3811,13 @@ def auto_map_ledgers_based_on_rules(narrations_list, ledger_master, rules_config
         
         if matched_by_rule:
             continue
-            
+
+        # Strategy 2b: Learned counterparty (same payee, different reference numbers)
+        counterparty_ledger = ledger_mapper.counterparty_learned_match(narration_str, learned_mappings)
+        if counterparty_ledger:
+            auto_mappings[narration_str] = counterparty_ledger
+            continue
+
         # Strategy 3: Similar learned mappings
         best_similarity = 0
         best_learned_ledger = None
@@ -1795,7 +3840,10 @@ def auto_map_ledgers_based_on_rules(narrations_list, ledger_master, rules_config
                     ledger_master,
                     rules_config,
                     suspense_ledger,
-                    learned_mappings
+                    learned_mappings,
+                    direction=(narration_directions or {}).get(narration_str),
+                    ledger_groups=ledger_groups,
+                    group_policy=group_policy
                 )
 
                 if ai_ledger and ai_ledger != suspense_ledger:
@@ -1811,8 +3859,187 @@ def auto_map_ledgers_based_on_rules(narrations_list, ledger_master, rules_config
 
 # --- 5. TALLY XML GENERATION FUNCTIONS ---
 
-def create_tally_xml(df, fixed_ledger_config, dynamic_ledger_config, company_name, voucher_type, journal_mappings):
-    xml_template = """<ENVELOPE>
+# Explicit date formats tried on a sample of each file, day-first formats before ISO
+DATE_FORMAT_CANDIDATES = [
+    '%d-%m-%Y', '%d/%m/%Y', '%d.%m.%Y', '%d-%m-%y', '%d/%m/%y', '%d.%m.%y',
+    '%d-%b-%y', '%d-%b-%Y', '%d %b %Y', '%d %b %y', '%d/%b/%Y', '%d/%b/%y', '%d %B %Y', '%d-%B-%Y',
+    '%Y-%m-%d', '%Y/%m/%d', '%Y-%m-%d %H:%M:%S', '%d-%m-%Y %H:%M:%S', '%d/%m/%Y %H:%M:%S',
+    '%d/%m/%Y %H:%M', '%Y%m%d',
+]
+EXCEL_SERIAL_FORMAT = 'excel-serial'
+DATETIME_FORMAT = 'datetime'
+# Excel serial day numbers for roughly 1954-2119
+EXCEL_SERIAL_RANGE = (20000, 80000)
+DATE_SAMPLE_SIZE = 200
+
+
+def infer_date_format(values, sample_size=DATE_SAMPLE_SIZE, preferred_formats=None):
+    """
+    Infer one explicit date format for a whole column from a sample of its values.
+    ``preferred_formats`` (e.g. from a bank profile) win ties with the generic candidates.
+    Returns a strftime format, EXCEL_SERIAL_FORMAT, DATETIME_FORMAT, or None.
+    """
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return DATETIME_FORMAT
+    sample = values.dropna()
+    if sample.empty:
+        return None
+    if len(sample) > sample_size:
+        sample = sample.sample(sample_size, random_state=0)
+    if pd.api.types.is_numeric_dtype(sample):
+        return EXCEL_SERIAL_FORMAT
+    if sample.map(lambda v: isinstance(v, (datetime, date))).mean() > 0.5:
+        return DATETIME_FORMAT
+
+    text_sample = sample.astype(str).str.strip()
+    best_format, best_hits = None, 0
+    for fmt in list(preferred_formats or []) + DATE_FORMAT_CANDIDATES:
+        hits = pd.to_datetime(text_sample, format=fmt, errors='coerce').notna().sum()
+        if hits > best_hits:
+            best_format, best_hits = fmt, hits
+    serial_hits = pd.to_numeric(text_sample, errors='coerce').between(*EXCEL_SERIAL_RANGE).sum()
+    if serial_hits > best_hits:
+        return EXCEL_SERIAL_FORMAT
+    return best_format
+
+
+def normalize_dates(values, date_format=None, preferred_formats=None):
+    """
+    Convert a date column to Tally's YYYYMMDD strings in vectorized calls.
+    ``date_format`` is inferred from the column when not given. Excel serials and
+    datetime cells mixed into a text column are converted too; anything else that
+    doesn't match the format becomes NaN.
+    Returns (tally_dates, date_format, unparsed_index).
+    """
+    if date_format is None:
+        date_format = infer_date_format(values, preferred_formats=preferred_formats)
+
+    if date_format == DATETIME_FORMAT:
+        parsed = pd.to_datetime(values, errors='coerce')
+    elif date_format == EXCEL_SERIAL_FORMAT:
+        serials = pd.to_numeric(values, errors='coerce')
+        parsed = pd.to_datetime(serials.where(serials.between(*EXCEL_SERIAL_RANGE)), unit='D', origin='1899-12-30')
+    elif date_format:
+        parsed = pd.to_datetime(values.astype(str).str.strip(), format=date_format, errors='coerce')
+    else:
+        parsed = pd.Series(pd.NaT, index=values.index, dtype='datetime64[ns]')
+
+    missing = parsed.isna() & values.notna()
+    if missing.any() and date_format != DATETIME_FORMAT:
+        leftovers = values[missing]
+        # Datetime cells (XLSX) and serial numbers mixed into an otherwise text column
+        is_datetime_cell = leftovers.map(lambda v: isinstance(v, (datetime, date)))
+        if is_datetime_cell.any():
+            parsed.loc[is_datetime_cell[is_datetime_cell].index] = pd.to_datetime(leftovers[is_datetime_cell])
+        serials = pd.to_numeric(leftovers[~is_datetime_cell], errors='coerce')
+        serials = serials[serials.between(*EXCEL_SERIAL_RANGE)]
+        if not serials.empty:
+            parsed.loc[serials.index] = pd.to_datetime(serials, unit='D', origin='1899-12-30')
+        missing = parsed.isna() & values.notna()
+
+    tally_dates = parsed.dt.strftime('%Y%m%d')
+    return tally_dates, date_format, values.index[missing | values.isna()]
+
+
+def add_tally_date_column(df, date_format=None):
+    """
+    Precompute the 'Tally Date' column once per upload.
+    Returns (date_format, unparsed_index) so callers can cache the format and report bad rows.
+    """
+    tally_dates, date_format, unparsed = normalize_dates(df['Date'], date_format)
+    df['Tally Date'] = tally_dates
+    return date_format, unparsed
+
+
+def get_tally_dates(df, date_format=None):
+    """
+    The precomputed 'Tally Date' column, or one vectorized conversion of 'Date'.
+    ``date_format`` may map 'Source File' values to their own formats for multi-file batches.
+    """
+    if 'Tally Date' in df.columns:
+        return df['Tally Date']
+    if isinstance(date_format, dict):
+        if 'Source File' not in df.columns or df.empty:
+            return normalize_dates(df['Date'])[0]
+        # Rows added by hand have no source; a single-file batch still has one known format
+        default_format = next(iter(date_format.values())) if len(date_format) == 1 else None
+        parts = [
+            normalize_dates(group['Date'], date_format.get(source, default_format))[0]
+            for source, group in df.groupby(df['Source File'].fillna(''), sort=False)
+        ]
+        return pd.concat(parts).reindex(df.index)
+    return normalize_dates(df['Date'], date_format)[0]
+
+
+def refresh_tally_dates(df, previous, date_format=None):
+    """
+    Carry the 'Tally Date' column of ``previous`` over to its edited copy ``df``:
+    only rows whose Date changed, and rows added in the grid, are converted again.
+    """
+    if 'Tally Date' not in df.columns:
+        return df
+    stale = edited_rows(df, previous, 'Date')
+    if stale.any():
+        df = df.copy()
+        df.loc[stale, 'Tally Date'] = get_tally_dates(df.loc[stale].drop(columns='Tally Date'), date_format)
+    return df
+
+
+def describe_unparsed_dates(df, unparsed, limit=5):
+    """Short user-facing summary of rows whose dates did not parse."""
+    if len(unparsed) == 0:
+        return ""
+    examples = ", ".join(
+        f"'{df.at[idx, 'Date']}'" if pd.notna(df.at[idx, 'Date']) else "(blank)" for idx in unparsed[:limit]
+    )
+    more = f" and {len(unparsed) - limit} more" if len(unparsed) > limit else ""
+    return f"{len(unparsed)} rows have dates that could not be read and will be skipped: {examples}{more}."
+
+
+def concat_string_columns(index, *parts):
+    """
+    Element-wise concatenation of string columns (Series/arrays) and literal strings,
+    done as one Arrow kernel call when pyarrow is available so large exports don't
+    materialize an intermediate column per ``+``.
+    """
+    if PYARROW_AVAILABLE:
+        arrays = [
+            pa.scalar(part, pa.large_string()) if isinstance(part, str)
+            else pa.array(part, from_pandas=True).cast(pa.large_string())
+            for part in parts
+        ]
+        joined = pc.binary_join_element_wise(*arrays, pa.scalar("", pa.large_string()))
+        return pd.Series(joined, index=index, dtype=ARROW_STRING_DTYPE)
+    result = pd.Series("", index=index, dtype=object)
+    for part in parts:
+        result = result + (part if isinstance(part, str) else np.asarray(part, dtype=object))
+    return result
+
+
+def stringify_column(values):
+    """str() of every cell as Arrow-backed strings; missing cells become 'nan'/'None' just as str() renders them."""
+    text = values.astype(ARROW_STRING_DTYPE)
+    missing = values.isna()
+    if missing.any():
+        text = text.astype(object)
+        text[missing] = values[missing].map(str)
+        text = text.astype(ARROW_STRING_DTYPE)
+    return text
+
+
+def escape_xml_column(values):
+    """
+    html.escape over a whole column. Cells are stringified like str() first, so
+    missing values come out as 'nan'/'None' exactly as the row-wise builders wrote them.
+    """
+    text = stringify_column(values)
+    for char, entity in (("&", "&amp;"), ("<", "&lt;"), (">", "&gt;"), ('"', "&quot;"), ("'", "&#x27;")):
+        text = text.str.replace(char, entity, regex=False)
+    return text
+
+
+# Tally import envelope, split around the vouchers so documents can be streamed
+TALLY_ENVELOPE_HEAD = """<ENVELOPE>
  <HEADER>
   <TALLYREQUEST>Import Data</TALLYREQUEST>
  </HEADER>
@@ -1825,125 +4052,550 @@ def create_tally_xml(df, fixed_ledger_config, dynamic_ledger_config, company_nam
     </STATICVARIABLES>
    </REQUESTDESC>
    <REQUESTDATA>
-{tally_messages}
+"""
+TALLY_ENVELOPE_TAIL = """
    </REQUESTDATA>
   </IMPORTDATA>
  </BODY>
 </ENVELOPE>"""
-    tally_message_template = """
-    <TALLYMESSAGE xmlns:UDF="TallyUDF">
-     <VOUCHER VCHTYPE="{voucher_type}" ACTION="Create">
-      <DATE>{date}</DATE>
-      <VOUCHERTYPENAME>{voucher_type}</VOUCHERTYPENAME>
-      <VOUCHERNUMBER>{voucher_number}</VOUCHERNUMBER>
-      <NARRATION>{narration}</NARRATION>
-      <PERSISTEDVIEW>Accounting Voucher View</PERSISTEDVIEW>
-      {ledger_entries}
-     </VOUCHER>
-    </TALLYMESSAGE>"""
-    ledger_line_template = """
-      <ALLLEDGERENTRIES.LIST>
-       <LEDGERNAME>{ledger_name}</LEDGERNAME>
-       <ISDEEMEDPOSITIVE>{is_positive}</ISDEEMEDPOSITIVE>
-       <AMOUNT>{amount}</AMOUNT>
-      </ALLLEDGERENTRIES.LIST>"""
-    all_tally_messages = []
-    
-    mapping_dicts = {}
-    for col_name, mapping_df in journal_mappings.items():
-        mapping_dicts[col_name] = pd.Series(mapping_df['Mapped Ledger'].values, index=mapping_df['CSV Value']).to_dict()
+XML_CHUNK_ROWS = 20_000
+
+
+def new_export_file():
+    """
+    Anonymous temp file for a generated export. Unbuffered (a raw FileIO), which is
+    the file type both st.download_button and requests accept directly.
+    """
+    return tempfile.TemporaryFile(buffering=0)
+
+
+def tally_envelope_head(company_name):
+    # Company name is XML-escaped before going into the envelope
+    return TALLY_ENVELOPE_HEAD.format(company_name=escape(str(company_name))).encode('utf-8')
+
+
+def empty_voucher_frame():
+    return pd.DataFrame({'date': pd.Series(dtype=object), 'paise': pd.Series(dtype='int64'),
+                         'xml': pd.Series(dtype=object)})
+
+
+# Every voucher carries a REMOTEID (and the same GUID) derived from its source row, so
+# re-sending a document makes Tally alter the vouchers it already has instead of
+# creating duplicates. The ids are precomputed over the whole frame into this column.
+VOUCHER_ID_COLUMN = 'Tally Remote ID'
+VOUCHER_ID_HASH_KEY = b"xml2tally-vchid1"
+
+
+def voucher_remote_ids(keys):
+    """
+    'X2T-' and 32 hex digits per row of ``keys``: a keyed 128-bit BLAKE2b digest
+    of its values plus an occurrence number, so identical rows stay distinct.
+    """
+    if keys.empty:
+        return pd.Series([], index=keys.index, dtype=object)
+    row_keys = keys.iloc[:, 0].astype(str)
+    for col in keys.columns[1:]:
+        row_keys = row_keys + "\x1f" + keys[col].astype(str)
+    row_keys = row_keys + "\x1f" + row_keys.groupby(row_keys).cumcount().astype(str)
+    return pd.Series(
+        ["X2T-" + hashlib.blake2b(row.encode(), digest_size=16, key=VOUCHER_ID_HASH_KEY).hexdigest()
+         for row in row_keys],
+        index=keys.index, dtype=object,
+    )
+
+
+def journal_voucher_ids(df):
+    """
+    Remote ids of journal rows, from the text of every source column (mappings do not
+    change them). Repeated rows are numbered in order, so compute them once over the
+    whole upload and keep them in VOUCHER_ID_COLUMN.
+    """
+    columns = [col for col in df.columns if col not in ('Tally Date', VOUCHER_ID_COLUMN)]
+    keys = pd.DataFrame({i: stringify_column(df[col]).to_numpy() for i, col in enumerate(columns)}, index=df.index)
+    return voucher_remote_ids(keys)
+
+
+def bank_voucher_ids(df, bank_ledger, date_format=None):
+    """Remote ids of bank rows, from each row's bank ledger and transaction fingerprint."""
+    fingerprints = df['Fingerprint'] if 'Fingerprint' in df.columns else pd.Series(None, index=df.index, dtype=object)
+    missing = fingerprints.isna()
+    if missing.any():
+        # Rows added by hand in the editor have no upload-time fingerprint
+        fingerprints = fingerprints.astype(object).copy()
+        fingerprints[missing] = compute_transaction_fingerprints(df[missing], date_format)
+    keys = pd.DataFrame({'ledger': _row_bank_ledgers(df, bank_ledger).to_numpy(),
+                         'fingerprint': fingerprints.astype(str).to_numpy()}, index=df.index)
+    return voucher_remote_ids(keys)
+
+
+class TallyXmlStream:
+    """
+    A Tally import document produced lazily as UTF-8 byte chunks: the envelope
+    header, one chunk per batch of vouchers (frames from build_bank_vouchers /
+    build_journal_vouchers), then the footer. ``voucher_count`` and
+    ``total_paise`` (debit-side total) grow as batches are yielded. Single use:
+    iterate it once (or call one of getvalue/write_to/to_file).
+    """
+
+    def __init__(self, company_name, voucher_batches):
+        self.company_name = company_name
+        self.voucher_batches = voucher_batches
+        self.voucher_count = 0
+        self.total_paise = 0
+
+    def __iter__(self):
+        yield tally_envelope_head(self.company_name)
+        separator = b""
+        for batch in self.voucher_batches:
+            if batch.empty:
+                continue
+            self.voucher_count += len(batch)
+            self.total_paise += int(batch['paise'].sum())
+            yield separator + "\n".join(batch['xml'].tolist()).encode('utf-8')
+            separator = b"\n"
+        yield TALLY_ENVELOPE_TAIL.encode('utf-8')
+
+    def getvalue(self):
+        """The whole document as one string (small exports and tests)."""
+        return b"".join(self).decode('utf-8')
+
+    def write_to(self, file_obj):
+        for chunk in self:
+            file_obj.write(chunk)
+        return self.voucher_count
+
+    def to_file(self):
+        """Write the document to an anonymous temp file and return it rewound for reading."""
+        file_obj = new_export_file()
+        self.write_to(file_obj)
+        file_obj.seek(0)
+        return file_obj
+
+
+def count_voucher_batches(voucher_batches, totals):
+    """Pass voucher frames through, adding their count and debit-side paise to ``totals``."""
+    for batch in voucher_batches:
+        totals['vouchers'] = totals.get('vouchers', 0) + len(batch)
+        totals['paise'] = totals.get('paise', 0) + int(batch['paise'].sum())
+        yield batch
+
+
+def iter_row_chunks(df, chunk_rows=XML_CHUNK_ROWS):
+    for start in range(0, len(df), chunk_rows):
+        yield df.iloc[start:start + chunk_rows]
+
+
+def with_tally_dates(df, date_format=None):
+    """``df`` with its 'Tally Date' column resolved once, so every chunk shares one inferred format."""
+    if 'Tally Date' in df.columns:
+        return df
+    return df.assign(**{'Tally Date': get_tally_dates(df, date_format)})
+
+
+# Manual-import exports can be cut into several envelopes, zipped with a manifest
+XML_SPLIT_MODES = {
+    'vouchers': "Vouchers per file",
+    'bytes': "File size (MB)",
+    'month': "Calendar month",
+}
+XML_PART_DEFAULT_LIMITS = {'vouchers': 5000, 'bytes': 20}
+XML_MANIFEST_NAME = "manifest.json"
+
+
+def write_split_tally_xml(archive, company_name, voucher_batches, split_by, limit=None, base_name="Vouchers"):
+    """
+    Write vouchers into ``archive`` (an open ZipFile) as several complete Tally
+    envelopes: at most ``limit`` vouchers each ('vouchers'), at most ``limit`` bytes
+    each ('bytes'; a single larger voucher still gets its own part) or one per
+    calendar month ('month'). Parts are streamed into the archive as vouchers arrive;
+    month parts are staged in temp files because months may interleave.
+    Returns the manifest entries: per part its file, voucher count, first/last
+    voucher number (position in the export), date range, uncompressed bytes and
+    debit-side total in paise.
+    """
+    if split_by not in XML_SPLIT_MODES:
+        raise ValueError(f"Unknown XML split mode '{split_by}'")
+    limit = limit or XML_PART_DEFAULT_LIMITS.get(split_by)
+    head = tally_envelope_head(company_name)
+    tail = TALLY_ENVELOPE_TAIL.encode('utf-8')
+    manifest = []
+    open_parts = {}  # part key -> (manifest entry, writable)
+
+    def open_part(key):
+        name = f"{base_name}_{key}.xml" if split_by == 'month' else f"{base_name}_part{len(manifest) + 1:03d}.xml"
+        entry = {'file': name, 'vouchers': 0, 'first_voucher': None, 'last_voucher': None,
+                 'first_date': None, 'last_date': None, 'bytes': len(head), 'total_paise': 0}
+        handle = new_export_file() if split_by == 'month' else archive.open(name, "w")
+        handle.write(head)
+        manifest.append(entry)
+        open_parts[key] = (entry, handle)
+        return entry, handle
+
+    def close_part(key):
+        entry, handle = open_parts.pop(key)
+        handle.write(tail)
+        entry['bytes'] += len(tail)
+        if split_by == 'month':
+            handle.seek(0)
+            with archive.open(entry['file'], "w") as member:
+                shutil.copyfileobj(handle, member)
+        handle.close()
+
+    sequence = 0
+    current_key = None
+    for batch in voucher_batches:
+        for xml, tally_date, paise in zip(batch['xml'].tolist(), batch['date'].tolist(), batch['paise'].tolist()):
+            sequence += 1
+            data = xml.encode('utf-8')
+            if split_by == 'month':
+                key = f"{tally_date[:4]}-{tally_date[4:6]}"
+                entry, handle = open_parts.get(key) or open_part(key)
+            else:
+                if current_key is not None:
+                    entry, handle = open_parts[current_key]
+                    full = entry['vouchers'] >= limit if split_by == 'vouchers' else (
+                        entry['bytes'] + len(data) + 1 + len(tail) > limit * 1024 * 1024)
+                    if full:
+                        close_part(current_key)
+                        current_key = None
+                if current_key is None:
+                    current_key = sequence
+                    open_part(current_key)
+                entry, handle = open_parts[current_key]
+            if entry['vouchers']:
+                handle.write(b"\n")
+                entry['bytes'] += 1
+            handle.write(data)
+            entry['bytes'] += len(data)
+            entry['vouchers'] += 1
+            entry['first_voucher'] = entry['first_voucher'] or sequence
+            entry['last_voucher'] = sequence
+            entry['first_date'] = min(entry['first_date'] or tally_date, tally_date)
+            entry['last_date'] = max(entry['last_date'] or tally_date, tally_date)
+            entry['total_paise'] += int(paise)
+
+    if not manifest:
+        # Nothing to export still yields one (empty) importable envelope
+        open_part('empty' if split_by == 'month' else 1)
+    for key in list(open_parts):
+        close_part(key)
+    return manifest
+
+
+def write_xml_manifest(archive, manifest, split_by, limit=None):
+    """Add manifest.json (parts plus export-wide totals, amounts in rupees) to a split export archive."""
+    parts = [{**{k: v for k, v in entry.items() if k != 'total_paise'}, 'total': format_paise(entry['total_paise'])}
+             for entry in manifest]
+    archive.writestr(XML_MANIFEST_NAME, json.dumps({
+        'split_by': split_by,
+        'limit': limit or XML_PART_DEFAULT_LIMITS.get(split_by),
+        'parts': parts,
+        'vouchers': sum(entry['vouchers'] for entry in manifest),
+        'total': format_paise(sum(entry['total_paise'] for entry in manifest)),
+    }, indent=2))
+
+
+def build_split_xml_export(voucher_batches_by_name, company_name, split_by, limit=None):
+    """
+    Zip export of one or more voucher streams ({base file name: voucher batches}),
+    each cut into parts by ``split_by``, plus a manifest. Returns the rewound temp file.
+    """
+    export_file = new_export_file()
+    manifest = []
+    with zipfile.ZipFile(export_file, "w", zipfile.ZIP_DEFLATED) as archive:
+        for base_name, voucher_batches in voucher_batches_by_name.items():
+            manifest.extend(write_split_tally_xml(archive, company_name, voucher_batches, split_by, limit, base_name))
+        write_xml_manifest(archive, manifest, split_by, limit)
+    export_file.seek(0)
+    return export_file
+
+
+# Large exports can be rendered by a pool of worker processes. Off unless XML_PARALLEL
+# is set: the pool forks the multi-threaded server process, and app.py is the
+# Streamlit script itself, so spawn/forkserver workers could not import it cheaply.
+XML_PARALLEL_ENABLED = os.getenv("XML_PARALLEL", "false").lower() in {"1", "true", "yes", "on"}
+XML_PARALLEL_MIN_ROWS = int(os.getenv("XML_PARALLEL_MIN_ROWS", "200000"))
+XML_PARALLEL_WORKERS = int(os.getenv("XML_PARALLEL_WORKERS", "0")) or min(8, os.cpu_count() or 1)
+# Process pools allowed at once across all sessions; further exports render serially
+XML_PARALLEL_MAX_POOLS = int(os.getenv("XML_PARALLEL_MAX_POOLS", "1"))
+_xml_pool_slots = threading.BoundedSemaphore(max(1, XML_PARALLEL_MAX_POOLS))
 
-    for index, row in df.iterrows():
-        try:
-            date_obj = pd.to_datetime(row['Date'], dayfirst=True)
-            tally_date = date_obj.strftime('%Y%m%d')
-            # Store tuples of (xml_string, transaction_type) for sorting
-            ledger_entries_list = []
-
-            # Handle voucher number - replace NaN with empty string
-            voucher_number = str(row['Voucher Number']) if pd.notna(row['Voucher Number']) else ""
-
-            for ledger in fixed_ledger_config:
-                if ledger['CSV Column Name'] in row and pd.notna(row[ledger['CSV Column Name']]):
-                    amount_val = round(float(row[ledger['CSV Column Name']]), 2)
-                    if amount_val == 0: continue
-                    is_positive_flag = "No" if ledger['Type (Debit/Credit)'] == 'Credit' else "Yes"
-                    amount_for_xml = amount_val if ledger['Type (Debit/Credit)'] == 'Credit' else amount_val * -1
-                    # XML escape ledger name
-                    ledger_name_safe = escape(str(ledger['Tally Ledger Name']))
-                    ledger_xml = ledger_line_template.format(
-                        ledger_name=ledger_name_safe,
-                        is_positive=is_positive_flag,
-                        amount=amount_for_xml
-                    )
-                    # Store as tuple (xml, type) for sorting
-                    ledger_entries_list.append((ledger_xml, ledger['Type (Debit/Credit)']))
 
-            for dyn_ledger in dynamic_ledger_config:
-                name_col = dyn_ledger['CSV Column for Ledger Name']
-                amount_col = dyn_ledger['CSV Column for Amount']
-                trans_type = dyn_ledger['Transaction Type']
+def _render_xml_partition(builder, chunk, args):
+    """Worker: build the vouchers of one row range; errors are returned, not shown."""
+    errors = []
+    vouchers = builder(chunk, *args, on_error=errors.append)
+    return vouchers, errors
 
-                # Check if columns exist in the row
-                if name_col not in row.index or amount_col not in row.index:
-                    continue
 
-                csv_value_as_ledger = row[name_col]
+def fork_is_default_start_method():
+    """Whether worker processes are forked by default here (not on Windows, macOS or Python 3.14+ Linux)."""
+    return multiprocessing.get_context().get_start_method() == "fork"
 
-                # Skip if amount column has NaN or invalid value
-                if pd.isna(row[amount_col]):
-                    continue
 
-                amount_from_col = round(float(row[amount_col]), 2)
+def use_parallel_xml(df, parallel=None):
+    """
+    Whether to render ``df`` in a process pool: forced by ``parallel``, else by the
+    XML_PARALLEL opt-in and size. Never where fork is not the default start method.
+    """
+    if not fork_is_default_start_method():
+        return False
+    if parallel is not None:
+        return parallel
+    return XML_PARALLEL_ENABLED and len(df) >= XML_PARALLEL_MIN_ROWS and XML_PARALLEL_WORKERS > 1
+
 
-                if pd.notna(csv_value_as_ledger) and str(csv_value_as_ledger).strip() != "" and amount_from_col != 0:
+def parallel_voucher_batches(builder, df, args, chunk_rows=XML_CHUNK_ROWS, max_workers=XML_PARALLEL_WORKERS):
+    """
+    Render ``builder(chunk, *args)`` for consecutive row ranges of ``df`` in forked
+    worker processes and yield the voucher frames in row order, reporting each
+    range's row errors as it is yielded. Each task carries its own pickled row range,
+    and at most two ranges per worker are in flight, so finished output never piles
+    up ahead of a slow consumer. Output is identical to rendering the ranges
+    serially, which is what happens when another session already holds every pool
+    slot.
+    """
+    if not _xml_pool_slots.acquire(blocking=False):
+        for chunk in iter_row_chunks(df, chunk_rows):
+            yield builder(chunk, *args)
+        return
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("fork")) as pool:
+            pending = deque()
+            remaining = iter_row_chunks(df, chunk_rows)
+            for chunk in itertools.islice(remaining, max_workers * 2):
+                pending.append(pool.submit(_render_xml_partition, builder, chunk, args))
+            while pending:
+                vouchers, errors = pending.popleft().result()
+                for chunk in itertools.islice(remaining, 1):
+                    pending.append(pool.submit(_render_xml_partition, builder, chunk, args))
+                for message in errors:
+                    st.error(message)
+                yield vouchers
+    finally:
+        _xml_pool_slots.release()
+
+
+def journal_voucher_batches(df, fixed_ledger_config, dynamic_ledger_config, voucher_type, journal_mappings,
+                            date_format=None, chunk_rows=XML_CHUNK_ROWS, parallel=None):
+    """Journal vouchers as frames of ``chunk_rows`` journal rows each, rendered in parallel for large journals."""
+    df = with_tally_dates(df, date_format)
+    if VOUCHER_ID_COLUMN not in df.columns:
+        df = df.assign(**{VOUCHER_ID_COLUMN: journal_voucher_ids(df)})
+    args = (fixed_ledger_config, dynamic_ledger_config, voucher_type, journal_mappings)
+    if use_parallel_xml(df, parallel):
+        return parallel_voucher_batches(build_journal_vouchers, df, args, chunk_rows)
+    return (build_journal_vouchers(chunk, *args) for chunk in iter_row_chunks(df, chunk_rows))
+
+
+def bank_voucher_batches(df, bank_ledger, date_format=None, chunk_rows=XML_CHUNK_ROWS, parallel=None):
+    """Bank vouchers as frames of ``chunk_rows`` statement rows each, rendered in parallel for large statements."""
+    df = with_tally_dates(df, date_format)
+    if VOUCHER_ID_COLUMN not in df.columns:
+        df = df.assign(**{VOUCHER_ID_COLUMN: bank_voucher_ids(df, bank_ledger, date_format)})
+    if use_parallel_xml(df, parallel):
+        return parallel_voucher_batches(build_bank_vouchers, df, (bank_ledger,), chunk_rows)
+    return (build_bank_vouchers(chunk, bank_ledger) for chunk in iter_row_chunks(df, chunk_rows))
+
+
+def stream_tally_xml(df, fixed_ledger_config, dynamic_ledger_config, company_name, voucher_type, journal_mappings,
+                     date_format=None, chunk_rows=XML_CHUNK_ROWS, parallel=None):
+    """Journal Tally XML as a TallyXmlStream, built ``chunk_rows`` journal rows at a time."""
+    return TallyXmlStream(company_name, journal_voucher_batches(
+        df, fixed_ledger_config, dynamic_ledger_config, voucher_type, journal_mappings, date_format, chunk_rows,
+        parallel
+    ))
+
+
+def create_tally_xml(df, fixed_ledger_config, dynamic_ledger_config, company_name, voucher_type, journal_mappings,
+                     date_format=None):
+    """
+    Generates journal Tally XML, one voucher per row with at least one non-zero ledger line.
+    The journal is reshaped into a long table of ledger lines (see journal_ledger_lines)
+    and each voucher's entries are joined per row in a single groupby.
+    Large exports should use stream_tally_xml instead.
+    """
+    return stream_tally_xml(df, fixed_ledger_config, dynamic_ledger_config, company_name, voucher_type,
+                            journal_mappings, date_format).getvalue()
 
-                    current_map = mapping_dicts.get(name_col, {})
-                    # Convert to string to ensure hashable type for dictionary lookup
-                    csv_value_str = str(csv_value_as_ledger)
-                    final_ledger_name = current_map.get(csv_value_str, csv_value_str)
 
-                    is_positive_flag = "No" if trans_type == 'Credit' else "Yes"
-                    amount_for_xml = amount_from_col if trans_type == 'Credit' else amount_from_col * -1
+def build_journal_xml_export(df, fixed_ledger_config, dynamic_ledger_config, company_name, voucher_type,
+                             journal_mappings, split_by=None, split_limit=None, totals=None):
+    """
+    Journal XML as (file, file_name, mime): one XML file, or with ``split_by`` (see
+    XML_SPLIT_MODES) a zip of parts plus a manifest. Streamed into a rewound temp file.
+    A ``totals`` dict receives the exported 'vouchers' count and debit-side 'paise'.
+    """
+    totals = {} if totals is None else totals
+    if split_by:
+        batches = count_voucher_batches(journal_voucher_batches(
+            df, fixed_ledger_config, dynamic_ledger_config, voucher_type, journal_mappings
+        ), totals)
+        export_file = build_split_xml_export({f"{voucher_type}Vouchers": batches}, company_name, split_by, split_limit)
+        return export_file, f"{voucher_type}Vouchers.zip", "application/zip"
+    stream = stream_tally_xml(df, fixed_ledger_config, dynamic_ledger_config, company_name, voucher_type,
+                              journal_mappings)
+    export_file = stream.to_file()
+    totals.update(vouchers=stream.voucher_count, paise=stream.total_paise)
+    return export_file, f"{voucher_type}Vouchers.xml", "application/xml"
+
+
+def journal_ledger_lines(df, fixed_ledger_config, dynamic_ledger_config, journal_mappings):
+    """
+    Reshape a journal into one long table of candidate ledger lines: a melt over the
+    fixed amount columns and one over the dynamic (ledger name, amount) column pairs.
+    Columns: pos (row position), rule (config order, fixed rules first), paise, type,
+    ledger (escaped Tally ledger name), invalid (a non-blank amount that did not parse)
+    and include (the line goes into the voucher). Dynamic ledger names are resolved
+    with one join against all mapping tables.
+    """
+    positions = np.arange(len(df))
+    amount_paise, amount_invalid = {}, {}
+    parts = []
+
+    # Fixed ledgers: one melt over the amount columns they read
+    fixed_rules = [(rule, ledger) for rule, ledger in enumerate(fixed_ledger_config)
+                   if ledger['CSV Column Name'] in df.columns]
+    for rule, ledger in fixed_rules:
+        col = ledger['CSV Column Name']
+        if col not in amount_paise:
+            amount_paise[col], _, amount_invalid[col] = parse_amounts(df[col])
+    if fixed_rules:
+        wide = pd.DataFrame({rule: amount_paise[ledger['CSV Column Name']].to_numpy() for rule, ledger in fixed_rules})
+        wide['pos'] = positions
+        fixed = wide.melt(id_vars='pos', var_name='rule', value_name='paise')
+        rule_ledgers = pd.DataFrame({
+            'rule': [rule for rule, _ in fixed_rules],
+            'column': [ledger['CSV Column Name'] for _, ledger in fixed_rules],
+            'type': [ledger['Type (Debit/Credit)'] for _, ledger in fixed_rules],
+            'ledger': [escape(str(ledger['Tally Ledger Name'])) for _, ledger in fixed_rules],
+        })
+        fixed = fixed.merge(rule_ledgers, on='rule', how='left')
+        present = np.concatenate([df[ledger['CSV Column Name']].notna().to_numpy() for _, ledger in fixed_rules])
+        invalid = np.concatenate([amount_invalid[ledger['CSV Column Name']].to_numpy() for _, ledger in fixed_rules])
+        fixed['invalid'] = present & invalid
+        fixed['include'] = present & ~invalid & (fixed['paise'].to_numpy() != 0)
+        parts.append(fixed)
+
+    # Dynamic ledgers: one melt over the (ledger name, amount) column pairs
+    dynamic_rules = [(len(fixed_ledger_config) + i, dyn) for i, dyn in enumerate(dynamic_ledger_config)
+                     if dyn['CSV Column for Ledger Name'] in df.columns and dyn['CSV Column for Amount'] in df.columns]
+    for rule, dyn in dynamic_rules:
+        col = dyn['CSV Column for Amount']
+        if col not in amount_paise:
+            amount_paise[col], _, amount_invalid[col] = parse_amounts(df[col])
+    if dynamic_rules:
+        dynamic = pd.DataFrame({
+            'pos': np.tile(positions, len(dynamic_rules)),
+            'rule': np.repeat([rule for rule, _ in dynamic_rules], len(df)),
+            'column': np.repeat([dyn['CSV Column for Ledger Name'] for _, dyn in dynamic_rules], len(df)),
+            'type': np.repeat([dyn['Transaction Type'] for _, dyn in dynamic_rules], len(df)),
+            'paise': np.concatenate([amount_paise[dyn['CSV Column for Amount']].to_numpy() for _, dyn in dynamic_rules]),
+        })
+        names = pd.concat([df[dyn['CSV Column for Ledger Name']].astype(object) for _, dyn in dynamic_rules],
+                          ignore_index=True)
+        present = np.concatenate([df[dyn['CSV Column for Amount']].notna().to_numpy() for _, dyn in dynamic_rules])
+        invalid = np.concatenate([amount_invalid[dyn['CSV Column for Amount']].to_numpy() for _, dyn in dynamic_rules])
+        name_text = stringify_column(names)
+        has_name = (names.notna() & name_text.str.strip().ne("")).to_numpy(dtype=bool)
+        dynamic['invalid'] = present & invalid
+        dynamic['include'] = present & ~invalid & has_name & (dynamic['paise'].to_numpy() != 0)
+
+        # One join against every mapping table; unmapped values are used as the ledger name
+        dynamic['csv_value'] = name_text.astype(object)
+        mapping_tables = [
+            pd.DataFrame({'column': col_name, 'csv_value': mapping_df['CSV Value'].astype(object).to_numpy(),
+                          'mapped': mapping_df['Mapped Ledger'].astype(object).to_numpy()})
+            for col_name, mapping_df in journal_mappings.items()
+        ]
+        if mapping_tables:
+            mappings = pd.concat(mapping_tables, ignore_index=True).drop_duplicates(['column', 'csv_value'], keep='last')
+            dynamic = dynamic.merge(mappings, on=['column', 'csv_value'], how='left', indicator=True)
+            ledger = dynamic['mapped'].where(dynamic['_merge'].eq('both'), dynamic['csv_value'])
+            dynamic = dynamic.drop(columns=['mapped', '_merge'])
+        else:
+            ledger = dynamic['csv_value']
+        dynamic['ledger'] = escape_xml_column(ledger)
+        parts.append(dynamic.drop(columns=['csv_value']))
 
-                    # XML escape ledger name
-                    ledger_name_safe = escape(str(final_ledger_name))
+    if not parts:
+        return pd.DataFrame(columns=['pos', 'rule', 'column', 'type', 'paise', 'ledger', 'invalid', 'include'])
+    return pd.concat(parts, ignore_index=True)
 
-                    ledger_xml = ledger_line_template.format(
-                        ledger_name=ledger_name_safe,
-                        is_positive=is_positive_flag,
-                        amount=amount_for_xml
-                    )
-                    # Store as tuple (xml, type) for sorting
-                    ledger_entries_list.append((ledger_xml, trans_type))
-
-            if ledger_entries_list:
-                # Sort entries: Debit first (priority 0), Credit second (priority 1)
-                ledger_entries_list.sort(key=lambda x: 0 if x[1] == 'Debit' else 1)
-                # Extract only the XML strings
-                sorted_ledger_xmls = [entry[0] for entry in ledger_entries_list]
-                final_ledger_entries = "\n".join(sorted_ledger_xmls)
-                # Safely get narration with proper type checking and XML escaping
-                narration_raw = row.get('Narration', 'N/A')
-                narration_safe = escape(str(narration_raw)) if pd.notna(narration_raw) else "N/A"
-
-                all_tally_messages.append(tally_message_template.format(
-                    voucher_type=voucher_type,
-                    date=tally_date,
-                    voucher_number=voucher_number,
-                    narration=narration_safe,
-                    ledger_entries=final_ledger_entries
-                ))
-        except Exception as e:
-            st.error(f"Error processing row {index} ('{row.get('Narration', 'N/A')}'): {e}. Skipping row.")
 
-    # XML escape company name before inserting into template
-    company_name_safe = escape(str(company_name))
+def build_journal_vouchers(df, fixed_ledger_config, dynamic_ledger_config, voucher_type, journal_mappings,
+                           date_format=None, on_error=None):
+    """
+    The vouchers of every exportable journal row, in row order, as a frame indexed
+    like ``df`` with 'date' (Tally YYYYMMDD), 'paise' (debit-side total) and 'xml'
+    (the <TALLYMESSAGE> string). Rows with an unreadable date or an invalid amount
+    are reported (``on_error``, default st.error) and skipped. Within a voucher,
+    debit entries come before credits, each in config order.
+    """
+    if df.empty:
+        return empty_voucher_frame()
+    tally_dates = get_tally_dates(df, date_format).to_numpy()
+    lines = journal_ledger_lines(df, fixed_ledger_config, dynamic_ledger_config, journal_mappings)
+    narrations = df['Narration'] if 'Narration' in df.columns else pd.Series('N/A', index=df.index)
+
+    # Row problems are reported in row order; the first failing check names the error
+    errors = {}
+    for pos in np.flatnonzero(pd.isna(tally_dates)):
+        errors[pos] = f"unreadable date '{df['Date'].iat[pos]}'"
+    if 'Voucher Number' not in df.columns:
+        for pos in range(len(df)):
+            errors.setdefault(pos, "'Voucher Number'")
+    bad_lines = lines[lines['invalid'].to_numpy(dtype=bool)].sort_values(['pos', 'rule'], kind='stable')
+    for pos, line in bad_lines.groupby('pos', sort=False).head(1).set_index('pos').iterrows():
+        errors.setdefault(pos, f"invalid amount '{df[line['column']].iat[pos]}' in column '{line['column']}'")
+    for pos in sorted(errors):
+        (on_error or st.error)(
+            f"Error processing row {df.index[pos]} ('{narrations.iat[pos]}'): {errors[pos]}. Skipping row."
+        )
 
-    return xml_template.format(
-        company_name=company_name_safe,
-        tally_messages="\n".join(all_tally_messages)
+    bad_rows = np.zeros(len(df), dtype=bool)
+    bad_rows[list(errors)] = True
+    lines = lines[lines['include'].to_numpy(dtype=bool) & ~bad_rows[lines['pos'].to_numpy(dtype=int)]]
+    if lines.empty:
+        return empty_voucher_frame()
+
+    # Debit entries first, then credits; config order within each side
+    is_debit = lines['type'].eq('Debit').to_numpy()
+    lines = lines.iloc[np.lexsort((lines['rule'].to_numpy(), ~is_debit, lines['pos'].to_numpy()))]
+    is_credit = lines['type'].eq('Credit')
+    paise = lines['paise'].astype('int64')
+    # Lines are sorted by row, so a newline before every line but a row's first lets a
+    # groupby string sum join each voucher's entries natively
+    pos = lines['pos'].to_numpy(dtype=int)
+    continues_row = np.r_[False, pos[1:] == pos[:-1]]
+    entries = concat_string_columns(
+        lines.index,
+        np.where(continues_row, "\n", ""),
+        "\n      <ALLLEDGERENTRIES.LIST>\n       <LEDGERNAME>", lines['ledger'],
+        "</LEDGERNAME>\n       <ISDEEMEDPOSITIVE>", np.where(is_credit, "No", "Yes"),
+        "</ISDEEMEDPOSITIVE>\n       <AMOUNT>", format_paise_column(paise.where(is_credit, -paise)),
+        "</AMOUNT>\n      </ALLLEDGERENTRIES.LIST>",
+    )
+    ledger_entries = entries.groupby(pos, sort=True).sum()
+    debit_totals = paise.where(~is_credit, 0).groupby(pos, sort=True).sum()
+    voucher_rows = ledger_entries.index.to_numpy()
+
+    rows = df.iloc[voucher_rows]
+    remote_ids = (df[VOUCHER_ID_COLUMN] if VOUCHER_ID_COLUMN in df.columns else journal_voucher_ids(df)).iloc[voucher_rows]
+    voucher_numbers = stringify_column(rows['Voucher Number']).where(rows['Voucher Number'].notna(), "")
+    narration_safe = escape_xml_column(narrations.iloc[voucher_rows]).where(narrations.iloc[voucher_rows].notna(), "N/A")
+    messages = concat_string_columns(
+        rows.index,
+        "\n    <TALLYMESSAGE xmlns:UDF=\"TallyUDF\">\n     <VOUCHER REMOTEID=\"", remote_ids,
+        f"\" VCHTYPE=\"{voucher_type}\" ACTION=\"Create\">\n      <DATE>", tally_dates[voucher_rows],
+        "</DATE>\n      <GUID>", remote_ids,
+        f"</GUID>\n      <VOUCHERTYPENAME>{voucher_type}</VOUCHERTYPENAME>\n      <VOUCHERNUMBER>", voucher_numbers,
+        "</VOUCHERNUMBER>\n      <NARRATION>", narration_safe,
+        "</NARRATION>\n      <PERSISTEDVIEW>Accounting Voucher View</PERSISTEDVIEW>\n      ", ledger_entries,
+        "\n     </VOUCHER>\n    </TALLYMESSAGE>",
     )
+    return pd.DataFrame({'date': tally_dates[voucher_rows], 'paise': debit_totals.to_numpy(), 'xml': messages},
+                        index=rows.index)
 
 def get_template_csv(fixed_ledger_config, dynamic_ledger_config):
     headers = ["Date", "Voucher Number", "Narration"]
@@ -1968,123 +4620,503 @@ def get_bank_template_csv():
     example_data += "05-04-2024,Amazon Office Supplies,15000,0\n"
     return headers + example_data
 
-def create_bank_tally_xml(df, bank_ledger, company_name):
+def create_bank_tally_xml(df, bank_ledger, company_name, date_format=None):
     """
     Generates Tally XML from a bank statement.
     Assumes the DataFrame *already* has a 'Mapped Ledger' column.
+    Column-oriented: voucher types, amounts and escaped names are computed once per
+    column and the voucher strings are assembled by whole-column concatenation.
+    Large exports should use stream_bank_tally_xml instead.
     """
-    xml_template = """<ENVELOPE>
- <HEADER>
-  <TALLYREQUEST>Import Data</TALLYREQUEST>
- </HEADER>
- <BODY>
-  <IMPORTDATA>
-   <REQUESTDESC>
-    <REPORTNAME>Vouchers</REPORTNAME>
-    <STATICVARIABLES>
-     <SVCURRENTCOMPANY>{company_name}</SVCURRENTCOMPANY>
-    </STATICVARIABLES>
-   </REQUESTDESC>
-   <REQUESTDATA>
-{tally_messages}
-   </REQUESTDATA>
-  </IMPORTDATA>
- </BODY>
-</ENVELOPE>"""
-    voucher_template = """
-    <TALLYMESSAGE xmlns:UDF="TallyUDF">
-     <VOUCHER VCHTYPE="{voucher_type}" ACTION="Create">
-      <DATE>{date}</DATE>
-      <VOUCHERTYPENAME>{voucher_type}</VOUCHERTYPENAME>
-      <NARRATION>{narration}</NARRATION>
-      <PERSISTEDVIEW>Accounting Voucher View</PERSISTEDVIEW>
-      {ledger_entries}
-     </VOUCHER>
-    </TALLYMESSAGE>"""
-
-    ledger_entry_template = """
-      <ALLLEDGERENTRIES.LIST>
-       <LEDGERNAME>{ledger_name}</LEDGERNAME>
-       <ISDEEMEDPOSITIVE>{is_positive}</ISDEEMEDPOSITIVE>
-       <AMOUNT>{amount}</AMOUNT>
-      </ALLLEDGERENTRIES.LIST>"""
-    all_tally_messages = []
-    for index, row in df.iterrows():
-        narration = "N/A"  # Initialize before try block to avoid NameError in exception handler
-        try:
-            date_obj = pd.to_datetime(row['Date'], dayfirst=True)
-            tally_date = date_obj.strftime('%Y%m%d')
-            narration = str(row['Narration'])
-            debit = round(float(row['Debit']), 2)
-            credit = round(float(row['Credit']), 2)
-
-            mapped_ledger = row['Mapped Ledger']
-
-            if debit > 0:
-                voucher_type = "Payment"
-                bank_amount = debit
-                contra_amount = debit * -1
-                is_bank_positive = "No"
-                is_contra_positive = "Yes"
-            elif credit > 0:
-                voucher_type = "Receipt"
-                bank_amount = credit * -1
-                contra_amount = credit
-                is_bank_positive = "Yes"
-                is_contra_positive = "No"
-            else:
-                continue
-            # XML escape narration and ledger names
-            narration_safe = escape(str(narration)) if pd.notna(narration) else "N/A"
-            bank_ledger_safe = escape(str(bank_ledger))
-            mapped_ledger_safe = escape(str(mapped_ledger))
-
-            # Create ledger entries list with tuples (xml, is_debit_flag)
-            ledger_list = []
-
-            # Bank ledger entry
-            bank_entry_xml = ledger_entry_template.format(
-                ledger_name=bank_ledger_safe,
-                is_positive=is_bank_positive,
-                amount=bank_amount
-            )
-            # is_bank_positive="Yes" means debit
-            ledger_list.append((bank_entry_xml, is_bank_positive == "Yes"))
-
-            # Contra ledger entry
-            contra_entry_xml = ledger_entry_template.format(
-                ledger_name=mapped_ledger_safe,
-                is_positive=is_contra_positive,
-                amount=contra_amount
-            )
-            # is_contra_positive="Yes" means debit
-            ledger_list.append((contra_entry_xml, is_contra_positive == "Yes"))
+    return stream_bank_tally_xml(df, bank_ledger, company_name, date_format).getvalue()
+
+
+def stream_bank_tally_xml(df, bank_ledger, company_name, date_format=None, chunk_rows=XML_CHUNK_ROWS, parallel=None):
+    """Bank Tally XML as a TallyXmlStream, built ``chunk_rows`` statement rows at a time."""
+    return TallyXmlStream(company_name, bank_voucher_batches(df, bank_ledger, date_format, chunk_rows, parallel))
+
+
+def build_bank_vouchers(df, bank_ledger, date_format=None, on_error=None):
+    """
+    The vouchers of every exportable bank row, in row order, as a frame indexed like
+    ``df`` with 'date' (Tally YYYYMMDD), 'paise' (transaction amount) and 'xml' (the
+    <TALLYMESSAGE> string). Withdrawals become Payments and deposits Receipts; the
+    debit-side entry (contra ledger for a Payment, bank ledger for a Receipt) always
+    comes first. Rows with neither amount are skipped and rows with unreadable dates
+    are reported (``on_error``, default st.error) and skipped.
+    """
+    if df.empty:
+        return empty_voucher_frame()
+    tally_dates = get_tally_dates(df, date_format)
+    bad_dates = tally_dates.isna().to_numpy()
+    for index, raw_date in zip(df.index[bad_dates], df['Date'].to_numpy()[bad_dates]):
+        (on_error or st.error)(f"Error processing row {index} ('N/A'): unreadable date '{raw_date}'. Skipping row.")
+
+    debit = get_amount_paise(df, 'Debit').to_numpy()
+    credit = get_amount_paise(df, 'Credit').to_numpy()
+    is_payment = debit > 0
+    keep = ~bad_dates & (is_payment | (credit > 0))
+    if not keep.any():
+        return empty_voucher_frame()
+    rows = df[keep]
+    remote_ids = (df[VOUCHER_ID_COLUMN] if VOUCHER_ID_COLUMN in df.columns else
+                  bank_voucher_ids(df, bank_ledger, date_format))[keep]
+    is_payment = is_payment[keep]
+    amount = pd.Series(np.where(is_payment, debit[keep], credit[keep]), index=rows.index)
+
+    # Multi-file batches carry each row's bank account; other rows use bank_ledger
+    bank_ledgers = rows['Bank Ledger'].fillna(bank_ledger) if 'Bank Ledger' in rows.columns else pd.Series(
+        bank_ledger, index=rows.index)
+    bank_safe = escape_xml_column(bank_ledgers)
+    contra_safe = escape_xml_column(rows['Mapped Ledger'])
+    first_ledger = contra_safe.where(is_payment, bank_safe)
+    second_ledger = bank_safe.where(is_payment, contra_safe)
+    voucher_type = np.where(is_payment, "Payment", "Receipt")
+
+    messages = concat_string_columns(
+        rows.index,
+        "\n    <TALLYMESSAGE xmlns:UDF=\"TallyUDF\">\n     <VOUCHER REMOTEID=\"", remote_ids,
+        "\" VCHTYPE=\"", voucher_type,
+        "\" ACTION=\"Create\">\n      <DATE>", tally_dates[keep],
+        "</DATE>\n      <GUID>", remote_ids,
+        "</GUID>\n      <VOUCHERTYPENAME>", voucher_type,
+        "</VOUCHERTYPENAME>\n      <NARRATION>", escape_xml_column(rows['Narration']),
+        "</NARRATION>\n      <PERSISTEDVIEW>Accounting Voucher View</PERSISTEDVIEW>\n      ",
+        "\n      <ALLLEDGERENTRIES.LIST>\n       <LEDGERNAME>", first_ledger,
+        "</LEDGERNAME>\n       <ISDEEMEDPOSITIVE>Yes</ISDEEMEDPOSITIVE>\n       <AMOUNT>", format_paise_column(-amount),
+        "</AMOUNT>\n      </ALLLEDGERENTRIES.LIST>\n",
+        "\n      <ALLLEDGERENTRIES.LIST>\n       <LEDGERNAME>", second_ledger,
+        "</LEDGERNAME>\n       <ISDEEMEDPOSITIVE>No</ISDEEMEDPOSITIVE>\n       <AMOUNT>", format_paise_column(amount),
+        "</AMOUNT>\n      </ALLLEDGERENTRIES.LIST>\n     </VOUCHER>\n    </TALLYMESSAGE>",
+    )
+    return pd.DataFrame({'date': tally_dates[keep], 'paise': amount, 'xml': messages}, index=rows.index)
+
+def build_bank_xml_export(df, bank_ledger, company_name, date_format=None, split_by_ledger=False, split_by=None,
+                          split_limit=None, totals=None):
+    """
+    XML for the selected bank rows as (file, file_name, mime): one combined file, or
+    with ``split_by_ledger`` a zip holding one XML per bank account. ``split_by``
+    (see XML_SPLIT_MODES) further cuts the XML into parts in a zip with a manifest.
+    The export is streamed into a rewound temp file rather than built in memory.
+    A ``totals`` dict receives the exported 'vouchers' count and debit-side 'paise'.
+    """
+    totals = {} if totals is None else totals
+    if split_by:
+        df = with_tally_dates(df, date_format)
+        if split_by_ledger and 'Bank Ledger' in df.columns:
+            batches = {
+                f"BankVouchers_{re.sub(r'[^A-Za-z0-9._-]+', '_', str(ledger)).strip('_') or 'Bank'}":
+                    count_voucher_batches(bank_voucher_batches(group, ledger, date_format), totals)
+                for ledger, group in df.groupby(df['Bank Ledger'].fillna(bank_ledger), sort=False)
+            }
+        else:
+            batches = {"BankVouchers": count_voucher_batches(bank_voucher_batches(df, bank_ledger, date_format),
+                                                             totals)}
+        return build_split_xml_export(batches, company_name, split_by, split_limit), "BankVouchers.zip", "application/zip"
+    if not split_by_ledger or 'Bank Ledger' not in df.columns:
+        stream = stream_bank_tally_xml(df, bank_ledger, company_name, date_format=date_format)
+        export_file = stream.to_file()
+        totals.update(vouchers=stream.voucher_count, paise=stream.total_paise)
+        return export_file, "BankVouchers.xml", "application/xml"
+    export_file = new_export_file()
+    totals.update(vouchers=0, paise=0)
+    with zipfile.ZipFile(export_file, "w", zipfile.ZIP_DEFLATED) as archive:
+        for ledger, group in df.groupby(df['Bank Ledger'].fillna(bank_ledger), sort=False):
+            safe_name = re.sub(r'[^A-Za-z0-9._-]+', '_', str(ledger)).strip('_') or "Bank"
+            with archive.open(f"BankVouchers_{safe_name}.xml", "w") as member:
+                stream = stream_bank_tally_xml(group, ledger, company_name, date_format=date_format)
+                stream.write_to(member)
+            totals.update(vouchers=totals['vouchers'] + stream.voucher_count, paise=totals['paise'] + stream.total_paise)
+    export_file.seek(0)
+    return export_file, "BankVouchers.zip", "application/zip"
+
+
+# Pre-push validation: one row per problem found, keyed by the source row's index label
+VALIDATION_ISSUE_COLUMNS = ['Row', 'Severity', 'Check', 'Detail']
+
+
+def financial_year_period(tally_date):
+    """The Indian financial year (April-March) holding a Tally YYYYMMDD date, as (start, end) YYYYMMDD."""
+    year, month = int(tally_date[:4]), int(tally_date[4:6])
+    start = year if month >= 4 else year - 1
+    return f"{start}0401", f"{start + 1}0331"
+
+
+def _issue_frame(labels, severity, check, details):
+    labels = list(labels)
+    details = [details] * len(labels) if isinstance(details, str) else list(details)
+    return pd.DataFrame({'Row': labels, 'Severity': severity, 'Check': check, 'Detail': details},
+                        columns=VALIDATION_ISSUE_COLUMNS)
+
+
+def _collect_issues(parts):
+    parts = [part for part in parts if not part.empty]
+    if not parts:
+        return pd.DataFrame(columns=VALIDATION_ISSUE_COLUMNS)
+    return pd.concat(parts, ignore_index=True).drop_duplicates(ignore_index=True)
+
+
+def _date_issues(df, tally_dates, period):
+    """Unreadable dates, and readable ones outside ``period`` ((start, end) YYYYMMDD, inclusive)."""
+    unreadable = pd.isna(tally_dates)
+    parts = [_issue_frame(df.index[unreadable], 'Error', 'Date',
+                          [f"unreadable date '{value}'" for value in df['Date'].to_numpy()[unreadable]])]
+    if period:
+        dates = pd.Series(tally_dates).fillna(period[0]).to_numpy(dtype=object)
+        outside = (dates < period[0]) | (dates > period[1])
+        parts.append(_issue_frame(df.index[outside], 'Error', 'Date',
+                                  [f"{value} is outside {period[0]}-{period[1]}" for value in dates[outside]]))
+    return parts
+
+
+def _unknown_ledger_issues(labels, ledgers, known_ledgers):
+    """Rows whose (escaped) ledger name is not in ``known_ledgers``; one hash-set lookup per line."""
+    if known_ledgers is None:
+        return []
+    known = {escape(str(name)) for name in known_ledgers}
+    ledgers = pd.Series(ledgers).astype(object).to_numpy()
+    unknown = ~pd.Series(ledgers).isin(known).to_numpy()
+    return [_issue_frame(np.asarray(labels)[unknown], 'Error', 'Ledger',
+                         [f"ledger '{unescape(name)}' is not in the Tally company"
+                          for name in ledgers[unknown]])]
+
+
+def validate_journal_vouchers(df, fixed_ledger_config, dynamic_ledger_config, journal_mappings,
+                              known_ledgers=None, period=None, date_format=None):
+    """
+    Check a journal before any XML is built. Returns a per-row issue table
+    (VALIDATION_ISSUE_COLUMNS). Errors: unreadable or out-of-``period`` dates, invalid
+    amounts, vouchers whose debits and credits differ, and ledgers missing from
+    ``known_ledgers`` (skipped when None). Warnings: rows with no non-zero ledger line
+    (they produce no voucher) and repeated voucher numbers.
+    """
+    if df.empty:
+        return _collect_issues([])
+    tally_dates = get_tally_dates(df, date_format).to_numpy()
+    lines = journal_ledger_lines(df, fixed_ledger_config, dynamic_ledger_config, journal_mappings)
+    pos = lines['pos'].to_numpy(dtype=int)
+    parts = _date_issues(df, tally_dates, period)
+
+    amount_columns = [ledger['CSV Column Name'] for ledger in fixed_ledger_config] + [
+        dyn['CSV Column for Amount'] for dyn in dynamic_ledger_config]
+    bad_lines = lines[lines['invalid'].to_numpy(dtype=bool)]
+    bad_amounts = pd.DataFrame({'pos': bad_lines['pos'].to_numpy(dtype=int),
+                                'column': [amount_columns[rule] for rule in bad_lines['rule']]}).drop_duplicates()
+    parts.append(_issue_frame(
+        df.index[bad_amounts['pos'].to_numpy()], 'Error', 'Amount',
+        [f"invalid amount '{df[column].iat[p]}' in column '{column}'"
+         for p, column in zip(bad_amounts['pos'], bad_amounts['column'])]))
+
+    included = lines['include'].to_numpy(dtype=bool)
+    paise = lines['paise'].to_numpy(dtype='int64')
+    is_credit = lines['type'].eq('Credit').to_numpy()
+    sides = pd.DataFrame({'debit': np.where(included & ~is_credit, paise, 0),
+                          'credit': np.where(included & is_credit, paise, 0)})
+    totals = sides.groupby(pos).sum().reindex(range(len(df)), fill_value=0)
+    lines_per_row = np.bincount(pos[included], minlength=len(df))
+    unbalanced = (totals['debit'] != totals['credit']).to_numpy() & (lines_per_row > 0)
+    parts.append(_issue_frame(
+        df.index[unbalanced], 'Error', 'Balance',
+        [f"debits {format_paise(d)} do not equal credits {format_paise(c)}"
+         for d, c in zip(totals['debit'].to_numpy()[unbalanced], totals['credit'].to_numpy()[unbalanced])]))
+    parts.extend(_unknown_ledger_issues(df.index[pos[included]], lines['ledger'].to_numpy()[included], known_ledgers))
+
+    empty = (lines_per_row == 0) & ~pd.isna(tally_dates)
+    empty[bad_amounts['pos'].to_numpy()] = False
+    parts.append(_issue_frame(df.index[empty], 'Warning', 'Amount', "no non-zero ledger amounts; no voucher is created"))
+    if 'Voucher Number' in df.columns:
+        numbers = df['Voucher Number']
+        repeated = (numbers.notna() & numbers.duplicated(keep=False)).to_numpy()
+        parts.append(_issue_frame(df.index[repeated], 'Warning', 'Voucher Number',
+                                  [f"voucher number '{value}' is used more than once" for value in numbers[repeated]]))
+    else:
+        parts.append(_issue_frame(df.index, 'Error', 'Voucher Number', "missing 'Voucher Number' column"))
+    return _collect_issues(parts)
+
+
+def validate_bank_vouchers(df, bank_ledger, known_ledgers=None, period=None, date_format=None):
+    """
+    Check bank rows before any XML is built. Returns a per-row issue table
+    (VALIDATION_ISSUE_COLUMNS). Errors: unreadable or out-of-``period`` dates, invalid
+    amounts, and bank or mapped ledgers missing from ``known_ledgers`` (skipped when
+    None). Warnings: rows with neither amount (they produce no voucher), rows with
+    both amounts (exported as a Payment) and repeated date/narration/amount rows.
+    """
+    if df.empty:
+        return _collect_issues([])
+    tally_dates = get_tally_dates(df, date_format).to_numpy()
+    parts = _date_issues(df, tally_dates, period)
+
+    any_invalid = np.zeros(len(df), dtype=bool)
+    for col in ('Debit', 'Credit'):
+        invalid = get_invalid_amounts(df, col).to_numpy(dtype=bool)
+        any_invalid |= invalid
+        if BANK_PAISE_COLUMNS[col] in df.columns:
+            # The unreadable text was reported at upload; the cell is blank in the grid
+            details = f"unreadable amount in column '{col}'"
+        else:
+            details = [f"invalid amount '{value}' in column '{col}'" for value in df[col].to_numpy()[invalid]]
+        parts.append(_issue_frame(df.index[invalid], 'Error', 'Amount', details))
+    debit, credit = get_amount_paise(df, 'Debit').to_numpy(), get_amount_paise(df, 'Credit').to_numpy()
+    exported = (debit > 0) | (credit > 0)
+
+    bank_ledgers = df['Bank Ledger'].fillna(bank_ledger) if 'Bank Ledger' in df.columns else pd.Series(
+        bank_ledger, index=df.index)
+    parts.extend(_unknown_ledger_issues(
+        np.concatenate([df.index[exported], df.index[exported]]),
+        np.concatenate([escape_xml_column(bank_ledgers[exported]).to_numpy(dtype=object),
+                        escape_xml_column(df['Mapped Ledger'][exported]).to_numpy(dtype=object)]),
+        known_ledgers))
+
+    parts.append(_issue_frame(df.index[~exported & ~any_invalid], 'Warning', 'Amount',
+                              "no withdrawal or deposit; no voucher is created"))
+    parts.append(_issue_frame(df.index[(debit > 0) & (credit > 0)], 'Warning', 'Amount',
+                              "both withdrawal and deposit; exported as a Payment"))
+    keys = pd.DataFrame({'date': tally_dates, 'narration': df['Narration'].to_numpy(), 'debit': debit, 'credit': credit})
+    repeated = keys.duplicated(keep=False).to_numpy() & exported
+    parts.append(_issue_frame(df.index[repeated], 'Warning', 'Duplicate', "same date, narration and amount as another row"))
+    return _collect_issues(parts)
+
+
+def rows_with_errors(issues):
+    """Index labels of the rows that have at least one Error issue."""
+    return pd.Index(issues.loc[issues['Severity'].eq('Error'), 'Row'].unique())
+
+
+# Generated exports are kept gzip-compressed under their content hash so identical
+# requests are served without regeneration and past exports can be fetched again.
+# Bump EXPORT_FORMAT_VERSION whenever the generated XML changes for the same inputs.
+EXPORT_HISTORY_DIR = os.path.join("data", "exports")
+EXPORT_RETENTION_DAYS = int(os.getenv("EXPORT_RETENTION_DAYS", "30"))
+EXPORT_HISTORY_MAX_PER_USER = int(os.getenv("EXPORT_HISTORY_MAX_PER_USER", "50"))
+EXPORT_FORMAT_VERSION = 3
+
+
+def _hash_export_input(sha, value):
+    if isinstance(value, pd.DataFrame):
+        sha.update(json.dumps([[str(col), str(dtype)] for col, dtype in value.dtypes.items()]).encode())
+        sha.update(pd.util.hash_pandas_object(value, index=True).to_numpy().tobytes())
+    elif isinstance(value, dict):
+        for key in sorted(value, key=str):
+            sha.update(f"\x00{key}\x01".encode())
+            _hash_export_input(sha, value[key])
+    elif isinstance(value, (list, tuple)):
+        sha.update(f"[{len(value)}".encode())
+        for item in value:
+            _hash_export_input(sha, item)
+    else:
+        sha.update(f"\x02{value!r}".encode())
+
+
+def export_inputs_key(kind, *inputs):
+    """Digest of everything an export is generated from: frames are hashed by content, configs by value."""
+    sha = hashlib.sha256(f"{kind}/{EXPORT_FORMAT_VERSION}".encode())
+    _hash_export_input(sha, inputs)
+    return sha.hexdigest()
+
+
+def batch_upload_digest(sources):
+    """One digest for a batch of uploads (the upload's own digest for a single file)."""
+    digests = [get_upload_digest(source) for source in sources]
+    if len(digests) == 1:
+        return digests[0]
+    return hashlib.sha256("|".join(digests).encode()).hexdigest()
+
+
+def _export_artifact_path(content_hash, root=EXPORT_HISTORY_DIR):
+    return os.path.join(root, f"{content_hash}.gz")
+
+
+def _artifact_row(row):
+    return dict(row._mapping)
+
+
+def find_export_artifact(email, inputs_key, root=EXPORT_HISTORY_DIR):
+    """The stored artifact generated from ``inputs_key`` for this user, or None."""
+    try:
+        conn = get_db_conn()
+        with conn.session as s:
+            row = s.execute(text('''
+                SELECT * FROM export_artifacts WHERE email = :email AND inputs_key = :inputs_key
+            '''), params=dict(email=email, inputs_key=inputs_key)).fetchone()
+            if row is None or not os.path.exists(_export_artifact_path(row.content_hash, root)):
+                return None
+            s.execute(text('UPDATE export_artifacts SET last_used_at = CURRENT_TIMESTAMP WHERE id = :id'),
+                      params=dict(id=row.id))
+            s.commit()
+            return _artifact_row(row)
+    except Exception as e:
+        print(f"Error looking up export artifact: {e}")
+        return None
+
+
+def open_export_artifact(artifact, root=EXPORT_HISTORY_DIR):
+    """The artifact's original bytes, decompressed into a rewound export temp file."""
+    export_file = new_export_file()
+    with gzip.open(_export_artifact_path(artifact['content_hash'], root), "rb") as stored:
+        shutil.copyfileobj(stored, export_file, SPOOL_COPY_BYTES)
+    export_file.seek(0)
+    return export_file
+
+
+def save_export_artifact(email, inputs_key, export_file, file_name, mime, kind, company_name, voucher_count=None,
+                         total_paise=None, bank_ledger=None, source_digest=None, root=EXPORT_HISTORY_DIR):
+    """
+    Store a generated export (a file object, read from its current position and
+    rewound afterwards) under its SHA-256 and record its metadata. Identical
+    content is stored once. Returns the artifact row, or None if it could not be saved.
+    """
+    os.makedirs(root, exist_ok=True)
+    start = export_file.tell()
+    sha = hashlib.sha256()
+    size = 0
+    tmp_path = os.path.join(root, f"{uuid.uuid4().hex}.tmp")
+    try:
+        with gzip.open(tmp_path, "wb", compresslevel=6) as stored:
+            while chunk := export_file.read(SPOOL_COPY_BYTES):
+                sha.update(chunk)
+                stored.write(chunk)
+                size += len(chunk)
+        content_hash = sha.hexdigest()
+        path = _export_artifact_path(content_hash, root)
+        if os.path.exists(path):
+            os.remove(tmp_path)
+        else:
+            os.replace(tmp_path, path)
+    except Exception as e:
+        print(f"Error storing export artifact: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return None
+    finally:
+        export_file.seek(start)
 
-            # Sort: Debit entries (True) first, Credit entries (False) second
-            ledger_list.sort(key=lambda x: not x[1])  # not x[1] puts True before False
+    try:
+        conn = get_db_conn()
+        with conn.session as s:
+            s.execute(text('''
+                INSERT INTO export_artifacts (email, inputs_key, content_hash, file_name, mime, kind, company_name,
+                                              bank_ledger, voucher_count, total_paise, size_bytes, source_digest)
+                VALUES (:email, :inputs_key, :content_hash, :file_name, :mime, :kind, :company_name,
+                        :bank_ledger, :voucher_count, :total_paise, :size_bytes, :source_digest)
+                ON CONFLICT(email, inputs_key) DO UPDATE SET
+                    content_hash=excluded.content_hash,
+                    file_name=excluded.file_name,
+                    mime=excluded.mime,
+                    voucher_count=excluded.voucher_count,
+                    total_paise=excluded.total_paise,
+                    size_bytes=excluded.size_bytes,
+                    source_digest=excluded.source_digest,
+                    created_at=CURRENT_TIMESTAMP,
+                    last_used_at=CURRENT_TIMESTAMP
+            '''), params=dict(email=email, inputs_key=inputs_key, content_hash=content_hash, file_name=file_name,
+                              mime=mime, kind=kind, company_name=company_name, bank_ledger=bank_ledger,
+                              voucher_count=voucher_count, total_paise=total_paise, size_bytes=size,
+                              source_digest=source_digest))
+            s.commit()
+            row = s.execute(text('''
+                SELECT * FROM export_artifacts WHERE email = :email AND inputs_key = :inputs_key
+            '''), params=dict(email=email, inputs_key=inputs_key)).fetchone()
+        prune_export_artifacts(email, root=root)
+        return _artifact_row(row)
+    except Exception as e:
+        print(f"Error recording export artifact: {e}")
+        return None
 
-            # Extract sorted XML strings
-            sorted_ledger_entries = "\n".join([entry[0] for entry in ledger_list])
 
-            all_tally_messages.append(
-                voucher_template.format(
-                    voucher_type=voucher_type,
-                    date=tally_date,
-                    narration=narration_safe,
-                    ledger_entries=sorted_ledger_entries
+def prune_export_artifacts(email, root=EXPORT_HISTORY_DIR, retention_days=EXPORT_RETENTION_DAYS,
+                           max_per_user=EXPORT_HISTORY_MAX_PER_USER):
+    """
+    Drop this user's history entries unused for ``retention_days`` or beyond their
+    ``max_per_user`` most recently used, then delete stored files no entry references.
+    """
+    try:
+        conn = get_db_conn()
+        with conn.session as s:
+            s.execute(text('''
+                DELETE FROM export_artifacts
+                WHERE email = :email AND (
+                    last_used_at < DATETIME('now', :cutoff)
+                    OR id NOT IN (
+                        SELECT id FROM export_artifacts WHERE email = :email
+                        ORDER BY last_used_at DESC, id DESC LIMIT :keep
+                    )
                 )
-            )
-        except Exception as e:
-            st.error(f"Error processing row {index} ('{narration}'): {e}. Skipping row.")
+            '''), params=dict(email=email, cutoff=f"-{int(retention_days)} days", keep=max_per_user))
+            s.commit()
+            referenced = {row[0] for row in s.execute(text('SELECT DISTINCT content_hash FROM export_artifacts'))}
+        for name in os.listdir(root):
+            path = os.path.join(root, name)
+            # A file this young may belong to an export whose entry is still being written
+            if name.endswith(".gz") and name[:-3] not in referenced and time.time() - os.path.getmtime(path) > 60:
+                os.remove(path)
+    except Exception as e:
+        print(f"Error pruning export artifacts: {e}")
+
+
+def get_export_history(email, kind=None, limit=20):
+    """This user's stored exports, most recently used first, optionally of one ``kind``."""
+    try:
+        conn = get_db_conn()
+        with conn.session as s:
+            rows = s.execute(text('''
+                SELECT * FROM export_artifacts
+                WHERE email = :email AND (:kind IS NULL OR kind = :kind)
+                ORDER BY last_used_at DESC, id DESC LIMIT :limit
+            '''), params=dict(email=email, kind=kind, limit=limit)).fetchall()
+        return [_artifact_row(row) for row in rows]
+    except Exception as e:
+        print(f"Error loading export history: {e}")
+        return []
+
+
+def get_or_build_export(email, inputs_key, build, kind, company_name, bank_ledger=None, source_digest=None):
+    """
+    The export generated from ``inputs_key``: served from history when this user
+    already has it, else produced by ``build(totals)`` -> (file, file_name, mime),
+    which fills ``totals`` like build_bank_xml_export, and stored. Returns
+    (rewound file, artifact, reused); ``artifact`` is a plain dict of the build
+    results if storing failed.
+    """
+    artifact = find_export_artifact(email, inputs_key)
+    if artifact is not None:
+        return open_export_artifact(artifact), artifact, True
+    totals = {}
+    export_file, file_name, mime = build(totals)
+    artifact = save_export_artifact(email, inputs_key, export_file, file_name, mime, kind, company_name,
+                                    totals.get('vouchers'), totals.get('paise'), bank_ledger, source_digest)
+    if artifact is None:
+        artifact = dict(file_name=file_name, mime=mime, voucher_count=totals.get('vouchers'),
+                        total_paise=totals.get('paise'))
+    return export_file, artifact, False
+
+
+def get_journal_export(email, df, fixed_ledger_config, dynamic_ledger_config, company_name, voucher_type,
+                       journal_mappings, split_by=None, split_limit=None, source_digest=None):
+    """build_journal_xml_export through the export history. Returns (file, artifact, reused)."""
+    inputs_key = export_inputs_key("journal", df, fixed_ledger_config, dynamic_ledger_config, company_name,
+                                   voucher_type, journal_mappings, split_by, split_limit)
+    return get_or_build_export(
+        email, inputs_key,
+        lambda totals: build_journal_xml_export(df, fixed_ledger_config, dynamic_ledger_config, company_name,
+                                                voucher_type, journal_mappings, split_by, split_limit, totals),
+        "journal", company_name, source_digest=source_digest
+    )
 
-    # XML escape company name before inserting into template
-    company_name_safe = escape(str(company_name))
 
-    return xml_template.format(
-        company_name=company_name_safe,
-        tally_messages="\n".join(all_tally_messages)
+def get_bank_export(email, df, bank_ledger, company_name, date_format=None, split_by_ledger=False, split_by=None,
+                    split_limit=None, source_digest=None):
+    """build_bank_xml_export through the export history. Returns (file, artifact, reused)."""
+    inputs_key = export_inputs_key("bank", df, bank_ledger, company_name, date_format, split_by_ledger, split_by,
+                                   split_limit)
+    return get_or_build_export(
+        email, inputs_key,
+        lambda totals: build_bank_xml_export(df, bank_ledger, company_name, date_format, split_by_ledger, split_by,
+                                             split_limit, totals),
+        "bank", company_name, bank_ledger=bank_ledger, source_digest=source_digest
     )
 
+
 def filter_selected_transactions(df):
     """Return only transactions marked for inclusion."""
     include_mask = df.get('Include', True)
@@ -2115,6 +5147,11 @@ def normalize_tally_host(host):
     host = host.split('/')[0]
     return host
 
+# How long the default-gateway read from the route table and each resolved Tally endpoint are reused
+TALLY_ROUTE_CACHE_SECONDS = int(os.getenv("TALLY_ROUTE_CACHE_SECONDS", "300"))
+TALLY_ENDPOINT_TTL_SECONDS = int(os.getenv("TALLY_ENDPOINT_TTL_SECONDS", "600"))
+
+@st.cache_data(ttl=TALLY_ROUTE_CACHE_SECONDS, show_spinner=False)
 def get_default_gateway_ips():
     """Best-effort detection of local gateway IPs (useful for containerized deployments)."""
     gateways = []
@@ -2169,25 +5206,169 @@ def get_tally_host_candidates(host):
 
     return [candidate for candidate in host_candidates if candidate]
 
-def post_to_tally_with_fallback(host, port, data, timeout):
-    """POST to Tally, trying sensible localhost fallbacks when needed."""
-    headers = {'Content-Type': 'text/xml'}
-    host_candidates = get_tally_host_candidates(host)
-    last_error = None
+# Tally HTTP: connect timeout for every request, read timeouts for queries and pushes,
+# and the most keep-alive connections held open per Tally endpoint
+TALLY_CONNECT_TIMEOUT = float(os.getenv("TALLY_CONNECT_TIMEOUT", "5"))
+TALLY_READ_TIMEOUT = float(os.getenv("TALLY_READ_TIMEOUT", "10"))
+TALLY_PUSH_TIMEOUT = float(os.getenv("TALLY_PUSH_TIMEOUT", "30"))
+TALLY_POOL_MAXSIZE = int(os.getenv("TALLY_POOL_MAXSIZE", "4"))
 
-    for candidate in host_candidates:
-        try:
-            url = f"http://{candidate}:{port}"
-            response = requests.post(url, data=data, headers=headers, timeout=timeout)
-            return response, candidate, host_candidates
-        except requests.exceptions.ConnectionError as err:
-            last_error = err
-            continue
 
-    if last_error:
-        raise last_error
+class TallyHttpPool:
+    """
+    One keep-alive requests.Session per Tally endpoint (host, port), shared by all
+    user sessions in the process so syncs, company fetches and push batches reuse
+    open TCP connections. Each session holds at most ``pool_maxsize`` connections;
+    callers beyond that wait for a free one. Requests use ``connect_timeout`` plus
+    the caller's read timeout.
+    """
+
+    def __init__(self, pool_maxsize=TALLY_POOL_MAXSIZE, connect_timeout=TALLY_CONNECT_TIMEOUT):
+        self.pool_maxsize = pool_maxsize
+        self.connect_timeout = connect_timeout
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def session(self, host, port):
+        key = (host, int(port))
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_maxsize,
+                                                        pool_block=True, max_retries=0)
+                session.mount("http://", adapter)
+                self._sessions[key] = session
+            return session
+
+    def post(self, host, port, data, headers, timeout):
+        """POST ``data`` to http://host:port over the endpoint's pooled session."""
+        return self.session(host, port).post(f"http://{host}:{port}", data=data, headers=headers,
+                                             timeout=(self.connect_timeout, timeout))
+
+    def stats(self):
+        """Per endpoint: requests sent, TCP connections opened and requests that reused an open connection."""
+        with self._lock:
+            sessions = dict(self._sessions)
+        stats = {}
+        for key, session in sessions.items():
+            pools = session.get_adapter("http://").poolmanager.pools
+            connection_pools = [pools[pool_key] for pool_key in pools.keys()]
+            sent = sum(pool.num_requests for pool in connection_pools)
+            opened = sum(pool.num_connections for pool in connection_pools)
+            stats[key] = {'requests': sent, 'connections': opened, 'reused': max(sent - opened, 0)}
+        return stats
+
 
-    raise requests.exceptions.ConnectionError(f"Unable to resolve a valid Tally host from '{host}'")
+@st.cache_resource(show_spinner=False)
+def get_tally_http_pool():
+    """One Tally connection pool per process."""
+    return TallyHttpPool()
+
+
+class TallyEndpointCache:
+    """
+    The candidate host that last answered for each (user, host, port) a user entered,
+    kept for ``ttl`` seconds so later requests skip host resolution entirely.
+    """
+
+    def __init__(self, ttl=TALLY_ENDPOINT_TTL_SECONDS):
+        self.ttl = ttl
+        self._endpoints = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._endpoints.get(key)
+            if entry is None:
+                return None
+            candidate, expires_at = entry
+            if time.monotonic() >= expires_at:
+                del self._endpoints[key]
+                return None
+            return candidate
+
+    def remember(self, key, candidate):
+        with self._lock:
+            self._endpoints[key] = (candidate, time.monotonic() + self.ttl)
+
+    def forget(self, key):
+        with self._lock:
+            self._endpoints.pop(key, None)
+
+
+@st.cache_resource(show_spinner=False)
+def get_tally_endpoint_cache():
+    """One resolved-endpoint cache per process."""
+    return TallyEndpointCache()
+
+
+def _tally_port_open(host, port, timeout):
+    """True when a TCP connection to host:port succeeds within ``timeout`` seconds."""
+    try:
+        with socket.create_connection((host, int(port)), timeout=timeout):
+            return True
+    except (OSError, ValueError):
+        return False
+
+
+def probe_tally_hosts(host_candidates, port, timeout=TALLY_CONNECT_TIMEOUT):
+    """
+    Connect to every candidate at once and return the first one, in candidate order,
+    that accepts a connection on ``port`` (None when none does). Resolution costs at
+    most one connect timeout instead of one per dead candidate.
+    """
+    if not host_candidates:
+        return None
+    executor = ThreadPoolExecutor(max_workers=len(host_candidates), thread_name_prefix="tally-probe")
+    try:
+        futures = [executor.submit(_tally_port_open, candidate, port, timeout) for candidate in host_candidates]
+        for candidate, future in zip(host_candidates, futures):
+            if future.result():
+                return candidate
+        return None
+    finally:
+        # Lower-ranked probes still connecting are left to time out on their own
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def post_to_tally_with_fallback(host, port, data, timeout, user=None):
+    """
+    POST to Tally over pooled keep-alive connections. Localhost-style hosts are resolved
+    to the fallback candidate that answers, which is cached per (user, host, port) and
+    only re-probed once it stops accepting connections.
+    """
+    headers = {'Content-Type': 'text/xml'}
+    host_candidates = get_tally_host_candidates(host)
+    pool = get_tally_http_pool()
+
+    def _post(candidate):
+        if hasattr(data, 'seek'):
+            # File bodies are re-sent from the start for every candidate host
+            data.seek(0)
+        return pool.post(candidate, port, data, headers, timeout)
+
+    if not host_candidates:
+        raise requests.exceptions.ConnectionError(f"Unable to resolve a valid Tally host from '{host}'")
+    if len(host_candidates) == 1:
+        return _post(host_candidates[0]), host_candidates[0], host_candidates
+
+    endpoints = get_tally_endpoint_cache()
+    key = (user, normalize_tally_host(host), int(port))
+    cached = endpoints.get(key)
+    if cached:
+        try:
+            return _post(cached), cached, host_candidates
+        except requests.exceptions.ConnectionError:
+            endpoints.forget(key)
+
+    candidate = probe_tally_hosts(host_candidates, port)
+    if candidate is None:
+        raise requests.exceptions.ConnectionError(
+            f"No Tally server is accepting connections on port {port} at: {', '.join(host_candidates)}")
+    response = _post(candidate)
+    endpoints.remember(key, candidate)
+    return response, candidate, host_candidates
 
 def get_tally_connection_error_message(host, port, host_candidates):
     if len(host_candidates) > 1:
@@ -2238,7 +5419,8 @@ def sync_ledgers_from_tally(host, port, company_name, email):
         '''
 
         # Send request to Tally
-        response, _, _ = post_to_tally_with_fallback(host, port, tally_request, timeout=10)
+        response, _, _ = post_to_tally_with_fallback(host, port, tally_request, timeout=TALLY_READ_TIMEOUT,
+                                                     user=email)
 
         if response.status_code != 200:
             return False, f"Tally server returned error: {response.status_code}", 0
@@ -2305,20 +5487,35 @@ def sync_ledgers_from_tally(host, port, company_name, email):
     except Exception as e:
         return False, f"Error syncing ledgers: {str(e)}", 0
 
-def push_vouchers_to_tally(xml_data, host, port):
+TALLY_PUSH_RETRIES = int(os.getenv("TALLY_PUSH_RETRIES", "1"))
+
+
+def push_vouchers_to_tally(xml_data, host, port, voucher_count=None, retries=TALLY_PUSH_RETRIES, user=None):
     """
     Pushes vouchers directly to Tally server via HTTP POST.
+    ``xml_data`` is an XML string or a file object (e.g. TallyXmlStream.to_file()),
+    which is streamed from disk; ``voucher_count`` is then the number of vouchers in it.
+    A timed-out push is re-sent up to ``retries`` times: vouchers carry a REMOTEID, so
+    Tally alters those an interrupted attempt already created instead of duplicating them.
     Returns tuple (success: bool, message: str, voucher_count: int)
     """
     try:
         # Send XML data to Tally server
-        response, _, _ = post_to_tally_with_fallback(host, port, xml_data, timeout=30)
+        for attempt in range(retries + 1):
+            try:
+                response, _, _ = post_to_tally_with_fallback(host, port, xml_data, timeout=TALLY_PUSH_TIMEOUT,
+                                                             user=user)
+                break
+            except requests.exceptions.Timeout:
+                if attempt == retries:
+                    raise
+                print(f"Tally push timed out; re-sending (attempt {attempt + 2} of {retries + 1})")
 
         if response.status_code != 200:
             return False, f"Tally server returned error: {response.status_code}", 0
 
         # Count how many vouchers we attempted to send
-        vouchers_sent = xml_data.count('<TALLYMESSAGE')
+        vouchers_sent = voucher_count if voucher_count is not None else xml_data.count('<TALLYMESSAGE')
 
         # Parse response to check for errors and actual success
         try:
@@ -2345,17 +5542,22 @@ def push_vouchers_to_tally(xml_data, host, port):
                     error_msg += f"\n  ... and {len(line_errors) - 5} more errors"
                 return False, error_msg, 0
 
-            # Check for CREATED count in response (Tally's confirmation)
+            # Check for CREATED/ALTERED counts in response (Tally's confirmation); vouchers
+            # whose REMOTEID Tally already had (a re-sent push) are ALTERED, not duplicated
             created_elem = root.find('.//CREATED')
-            if created_elem is not None and created_elem.text:
+            altered_elem = root.find('.//ALTERED')
+            if (created_elem is not None and created_elem.text) or (altered_elem is not None and altered_elem.text):
                 try:
-                    created_count = int(created_elem.text)
-                    if created_count == 0:
+                    created_count = int(created_elem.text) if created_elem is not None and created_elem.text else 0
+                    altered_count = int(altered_elem.text) if altered_elem is not None and altered_elem.text else 0
+                    applied_count = created_count + altered_count
+                    updated_note = f" ({altered_count} already in Tally were updated)" if altered_count else ""
+                    if applied_count == 0:
                         return False, "Tally accepted the request but created 0 vouchers. Please check:\n- Company name is correct\n- All ledger names exist in Tally\n- Voucher numbers are not duplicates", 0
-                    elif created_count < vouchers_sent:
-                        return False, f"⚠️ Partial success: {created_count} out of {vouchers_sent} vouchers created. Some vouchers may have validation errors.", created_count
+                    elif applied_count < vouchers_sent:
+                        return False, f"⚠️ Partial success: {applied_count} out of {vouchers_sent} vouchers imported{updated_note}. Some vouchers may have validation errors. Pushing again is safe: vouchers already in Tally are updated, not duplicated.", applied_count
                     else:
-                        return True, f"✅ Successfully created {created_count} vouchers in Tally", created_count
+                        return True, f"✅ Successfully created {created_count} vouchers in Tally{updated_note}", applied_count
                 except ValueError:
                     pass
 
@@ -2384,11 +5586,11 @@ def push_vouchers_to_tally(xml_data, host, port):
     except requests.exceptions.ConnectionError:
         return False, get_tally_connection_error_message(host, port, get_tally_host_candidates(host)), 0
     except requests.exceptions.Timeout:
-        return False, "Connection to Tally server timed out. Please try again.", 0
+        return False, "Connection to Tally server timed out. Please try again; vouchers already in Tally will be updated, not duplicated.", 0
     except Exception as e:
         return False, f"Error pushing vouchers to Tally: {str(e)}", 0
 
-def fetch_companies_from_tally(host, port):
+def fetch_companies_from_tally(host, port, user=None):
     """
     Fetches list of company names from Tally server.
     Returns tuple (success: bool, message: str, companies: list)
@@ -2441,7 +5643,8 @@ def fetch_companies_from_tally(host, port):
         '''
 
         # Send request to Tally
-        response, _, _ = post_to_tally_with_fallback(host, port, tally_request, timeout=10)
+        response, _, _ = post_to_tally_with_fallback(host, port, tally_request, timeout=TALLY_READ_TIMEOUT,
+                                                     user=user)
 
         if response.status_code != 200:
             return False, f"Tally server returned error: {response.status_code}", []
@@ -2501,6 +5704,12 @@ def get_synced_ledgers(email):
         '''), params={'email': email})
         return result.fetchall()
 
+
+def get_known_ledger_names(email):
+    """Names of the user's synced Tally ledgers as a set, or None when nothing has been synced yet."""
+    names = {row[0] for row in get_synced_ledgers(email)}
+    return names or None
+
 # --- 6. Page Configuration ---
 st.set_page_config(
     page_title="Xml2Tally - Financial Automation Platform",
@@ -2533,6 +5742,12 @@ if "journal_mappings" not in st.session_state:
     st.session_state.journal_mappings = {}
 if "learned_mappings" not in st.session_state:
     st.session_state.learned_mappings = {}
+if "ledger_groups" not in st.session_state:
+    st.session_state.ledger_groups = {}
+if "direction_group_policy" not in st.session_state:
+    st.session_state.direction_group_policy = {k: list(v) for k, v in DEFAULT_DIRECTION_GROUP_POLICY.items()}
+if "bank_profiles" not in st.session_state:
+    st.session_state.bank_profiles = []
 if "ai_initialized" not in st.session_state:
     st.session_state.ai_initialized = False
 if "tally_server_host" not in st.session_state:
@@ -3233,7 +6448,20 @@ def render_journal_converter_page():
     if uploaded_file:
         try:
             # Process file
-            df = load_uploaded_file(uploaded_file.getvalue(), uploaded_file.name)
+            df = load_upload(uploaded_file, kind="journal")
+            # Normalize dates once per upload; the XML builders read the 'Tally Date' column
+            if 'Tally Date' not in df.columns:
+                st.session_state.journal_date_warning = ""
+                if 'Date' in df.columns:
+                    _, unparsed_dates = add_tally_date_column(df)
+                    st.session_state.journal_date_warning = describe_unparsed_dates(df, unparsed_dates)
+            # Voucher ids come from the full upload, so rows dropped before export keep theirs
+            if VOUCHER_ID_COLUMN not in df.columns:
+                df[VOUCHER_ID_COLUMN] = journal_voucher_ids(df)
+                # The session store hands out its own frame; put it back so spills and sizes follow
+                set_session_frame("upload_handle_journal", df)
+            if st.session_state.get('journal_date_warning'):
+                st.warning(st.session_state.journal_date_warning)
             
             st.success(f"File processed successfully! Found {len(df)} journal entries.")
             
@@ -3322,6 +6550,22 @@ def render_journal_converter_page():
             
             st.divider()
 
+            split_by, split_limit = render_xml_split_options("journal")
+
+            # Pre-push checks run on the whole journal before any XML is built
+            validation_period = render_validation_period(df, "journal")
+            issues = validate_journal_vouchers(
+                df,
+                fixed_rules,
+                dynamic_rules,
+                edited_mappings,
+                known_ledgers=get_known_ledger_names(st.session_state.email),
+                period=validation_period
+            )
+            excluded_rows = render_voucher_validation(issues, "journal")
+            if len(excluded_rows):
+                df = df.drop(index=excluded_rows)
+
             # Final Actions
             # Check if direct push is enabled
             enable_direct_push = st.session_state.get('enable_direct_push_journal', False)
@@ -3350,19 +6594,24 @@ def render_journal_converter_page():
                         st.success(f"🧠 AI learned from {learned_count} mappings for future use!")
 
                     with st.spinner("Pushing vouchers to Tally..."):
-                        xml_data = create_tally_xml(
+                        # Identical inputs reuse the stored XML instead of regenerating it
+                        xml_data, artifact, _ = get_journal_export(
+                            st.session_state.email,
                             df,
                             fixed_rules,
                             dynamic_rules,
                             company_name,
                             voucher_type,
-                            edited_mappings
+                            edited_mappings,
+                            source_digest=get_upload_digest(uploaded_file)
                         )
 
                         success, message, count = push_vouchers_to_tally(
                             xml_data,
                             st.session_state.tally_server_host,
-                            st.session_state.tally_server_port
+                            st.session_state.tally_server_port,
+                            voucher_count=artifact['voucher_count'],
+                            user=st.session_state.email
                         )
 
                     if success:
@@ -3402,21 +6651,26 @@ def render_journal_converter_page():
                         st.success(f"🧠 AI learned from {learned_count} mappings for future use!")
 
                     with st.spinner("Generating Tally XML..."):
-                        xml_data = create_tally_xml(
+                        xml_data, artifact, reused = get_journal_export(
+                            st.session_state.email,
                             df,
                             fixed_rules,
                             dynamic_rules,
                             company_name,
                             voucher_type,
-                            edited_mappings
+                            edited_mappings,
+                            split_by,
+                            split_limit,
+                            source_digest=get_upload_digest(uploaded_file)
                         )
 
-                    st.success("Tally XML generated successfully!")
+                    st.success("Tally XML ready (unchanged since your last export)." if reused
+                               else "Tally XML generated successfully!")
                     st.download_button(
-                        label=f"📥 Download {voucher_type}Vouchers.xml",
+                        label=f"📥 Download {artifact['file_name']}",
                         data=xml_data,
-                        file_name=f"{voucher_type}Vouchers.xml",
-                        mime="application/xml",
+                        file_name=artifact['file_name'],
+                        mime=artifact['mime'],
                         use_container_width=True
                     )
             else:
@@ -3443,27 +6697,129 @@ def render_journal_converter_page():
                         st.success(f"🧠 AI learned from {learned_count} mappings for future use!")
 
                     with st.spinner("Generating Tally XML..."):
-                        xml_data = create_tally_xml(
+                        xml_data, artifact, reused = get_journal_export(
+                            st.session_state.email,
                             df,
                             fixed_rules,
                             dynamic_rules,
                             company_name,
                             voucher_type,
-                            edited_mappings
+                            edited_mappings,
+                            split_by,
+                            split_limit,
+                            source_digest=get_upload_digest(uploaded_file)
                         )
 
-                    st.success("Tally XML generated successfully!")
+                    st.success("Tally XML ready (unchanged since your last export)." if reused
+                               else "Tally XML generated successfully!")
                     st.download_button(
-                        label=f"📥 Download {voucher_type}Vouchers.xml",
+                        label=f"📥 Download {artifact['file_name']}",
                         data=xml_data,
-                        file_name=f"{voucher_type}Vouchers.xml",
-                        mime="application/xml",
+                        file_name=artifact['file_name'],
+                        mime=artifact['mime'],
                         use_container_width=True
                     )
                     
         except Exception as e:
             st.error(f"Error processing file: {e}")
 
+    render_export_history("journal", st.session_state.get('enable_direct_push_journal', False))
+
+def render_export_history(kind, allow_push=False):
+    """Recent exports of ``kind`` with instant re-download and, for XML files, re-push to Tally."""
+    history = get_export_history(st.session_state.email, kind)
+    if not history:
+        return
+    with st.expander(f"🕘 Recent exports ({len(history)})"):
+        for artifact in history:
+            info_col, download_col, push_col = st.columns([4, 1, 1])
+            with info_col:
+                details = [f"{artifact['voucher_count'] or 0} vouchers",
+                           f"total {format_paise(artifact['total_paise'] or 0)}", artifact['company_name']]
+                if artifact.get('bank_ledger'):
+                    details.append(artifact['bank_ledger'])
+                st.markdown(f"**{artifact['file_name']}** · {artifact['last_used_at']}  \n"
+                            f"{' · '.join(str(d) for d in details)}")
+            with download_col:
+                st.download_button(
+                    "📥 Download",
+                    data=lambda artifact=artifact: open_export_artifact(artifact),
+                    file_name=artifact['file_name'],
+                    mime=artifact['mime'],
+                    key=f"{kind}_history_download_{artifact['id']}",
+                    use_container_width=True
+                )
+            with push_col:
+                if allow_push and artifact['mime'] == "application/xml" and st.button(
+                        "🚀 Re-push", key=f"{kind}_history_push_{artifact['id']}", use_container_width=True):
+                    with st.spinner("Pushing vouchers to Tally..."):
+                        success, message, _ = push_vouchers_to_tally(
+                            open_export_artifact(artifact),
+                            st.session_state.tally_server_host,
+                            st.session_state.tally_server_port,
+                            voucher_count=artifact['voucher_count'],
+                            user=st.session_state.email
+                        )
+                    if success:
+                        st.success(f"✅ {message}")
+                    else:
+                        st.error(f"❌ {message}")
+
+def render_xml_split_options(key_prefix):
+    """Split controls for manual-import downloads. Returns (split mode or None, limit)."""
+    mode_col, limit_col = st.columns([2, 1])
+    with mode_col:
+        choice = st.selectbox(
+            "Split XML download:",
+            ["Single XML file"] + list(XML_SPLIT_MODES.values()),
+            key=f"{key_prefix}_xml_split",
+            help="TallyPrime imports very large files unreliably. Parts are zipped together with a manifest."
+        )
+    split_by = next((mode for mode, label in XML_SPLIT_MODES.items() if label == choice), None)
+    split_limit = None
+    if split_by in XML_PART_DEFAULT_LIMITS:
+        with limit_col:
+            split_limit = st.number_input(
+                XML_SPLIT_MODES[split_by],
+                min_value=1,
+                value=XML_PART_DEFAULT_LIMITS[split_by],
+                key=f"{key_prefix}_xml_split_limit_{split_by}"
+            )
+    return split_by, split_limit
+
+def render_validation_period(df, key_prefix, date_format=None):
+    """Financial year picker for the pre-push date check. Returns (start, end) YYYYMMDD or None."""
+    tally_dates = get_tally_dates(df, date_format).dropna() if 'Date' in df.columns else pd.Series(dtype=object)
+    years = sorted({financial_year_period(value) for value in tally_dates.unique()})
+    labels = {f"FY {start[:4]}-{end[2:4]}": (start, end) for start, end in years}
+    choice = st.selectbox(
+        "Vouchers must fall in:",
+        ["Any date"] + list(labels),
+        key=f"{key_prefix}_validation_period",
+        help="Rows dated outside the chosen financial year are reported before anything is sent to Tally."
+    )
+    return labels.get(choice)
+
+
+def render_voucher_validation(issues, key_prefix):
+    """Pre-push check results. Returns the index labels of the rows to leave out of the export."""
+    if issues.empty:
+        st.success("✅ Pre-push checks passed.")
+        return pd.Index([])
+    error_rows = rows_with_errors(issues)
+    warnings = int(issues['Severity'].eq('Warning').sum())
+    with st.expander(f"Pre-push checks: {len(error_rows)} row(s) with errors, {warnings} warning(s)",
+                     expanded=not error_rows.empty):
+        st.dataframe(issues, hide_index=True, use_container_width=True)
+    if error_rows.empty:
+        return pd.Index([])
+    exclude = st.checkbox(
+        f"Leave the {len(error_rows)} row(s) with errors out of the export",
+        value=True,
+        key=f"{key_prefix}_exclude_invalid_rows"
+    )
+    return error_rows if exclude else pd.Index([])
+
 def render_bank_converter_page():
     """Simplified bank converter page with auto-mapping"""
     st.markdown("""
@@ -3587,11 +6943,12 @@ def render_bank_converter_page():
 
     upload_col, helper_col = st.columns([2, 1])
     with upload_col:
-        uploaded_file = st.file_uploader(
+        uploaded_files = st.file_uploader(
             "Upload Statement",
-            type=["csv", "xlsx"],
+            type=["csv", "xlsx", "zip"],
             key="bank_uploader",
-            help="Drag and drop or browse to add your bank statement in CSV or Excel format.",
+            accept_multiple_files=True,
+            help="Drag and drop or browse to add bank statements in CSV or Excel format, or a zip of several statements.",
         )
 
     with helper_col:
@@ -3603,41 +6960,135 @@ def render_bank_converter_page():
             </div>
         """, unsafe_allow_html=True)
 
-    if not uploaded_file:
+    try:
+        sources = expand_upload_batch(uploaded_files)
+    except (zipfile.BadZipFile, ValueError) as e:
+        st.error(f"Could not open zip archive: {e}")
+        sources = []
+
+    if not uploaded_files:
         st.info("No statement uploaded yet. Add a CSV or Excel file to start mapping.")
+    elif not sources:
+        st.warning("No CSV or Excel statements found in the upload.")
     
-    if uploaded_file and bank_ledger:
-        try:
-            # Process file
-            df = load_uploaded_file(uploaded_file.getvalue(), uploaded_file.name)
-            df.columns = [str(c).strip().title() for c in df.columns]
+    skip_processed = st.checkbox(
+        "Skip transactions already exported or pushed to Tally",
+        value=True,
+        key="bank_skip_processed",
+        help="Overlapping statements are matched by date, amount, direction and narration. "
+             "Unchecked, earlier transactions are kept but excluded from export."
+    )
 
-            # Validate required columns
-            for col in ['Date', 'Narration', 'Debit', 'Credit']:
-                if col not in df.columns:
-                    st.error(f"Required column '{col}' not found in file. Please use the template.")
+    if sources and bank_ledger:
+        try:
+            # Parse only when a new batch arrives; mapping edits (including bulk selection)
+            # are preserved in session state while the same files are active
+            batch_key = "|".join(f"{source.name}:{source.size}" for source in sources) + f"|skip={skip_processed}"
+            if (
+                get_session_frame('bank_mapping_df') is None
+                or st.session_state.get('bank_mapping_file') != batch_key
+            ):
+                # User profiles come after built-ins so they win on identical headers
+                bank_profiles = BUILTIN_BANK_PROFILES + st.session_state.get('bank_profiles', [])
+                profiles_version = bank_profiles_key(st.session_state.get('bank_profiles', []))[:12]
+
+                with st.spinner(f"Reading {len(sources)} statement{'s' if len(sources) > 1 else ''}..."):
+                    # Frames in the upload store are already normalized bank statements
+                    results = load_bank_statement_batch(sources, bank_profiles, store_kind=f"bank-{profiles_version}")
+
+                frames = []
+                narration_directions = {}
+                date_formats = {}
+                date_warnings = []
+                for name, part, directions, error in results:
+                    if error:
+                        st.error(f"{name}: {error}" if len(sources) > 1 else error)
+                        continue
+                    # Unique narrations are deduplicated across all files so each is mapped once
+                    merge_narration_directions(narration_directions, directions or get_narration_directions(part))
+                    if part.attrs.get('bank_profile'):
+                        st.info(f"Detected statement format for {name}: {part.attrs['bank_profile']}")
+                    # Normalize dates once per file (the profile's formats win ties); the inferred
+                    # format is kept for rows whose Date is later edited in the grid
+                    tally_dates, date_formats[name], unparsed_dates = normalize_dates(
+                        part['Date'], preferred_formats=part.attrs.get('date_formats')
+                    )
+                    part['Tally Date'] = tally_dates
+                    frames.append((name, part))
+                    for warning in (describe_unparsed_dates(part, unparsed_dates), describe_invalid_amounts(part)):
+                        if warning:
+                            date_warnings.append(f"{name}: {warning}" if len(sources) > 1 else warning)
+                if not frames:
                     st.stop()
 
-            # Convert numeric columns
-            for col in ['Debit', 'Credit']:
-                df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
-
-            # Set default ledger for all transactions
-            df['Mapped Ledger'] = suspense_ledger
-            # Allow users to choose which transactions to include in export/push
-            df['Include'] = True
+                source_ledgers = {name: bank_ledger for name, _ in frames}
+                df = combine_bank_statements(frames, source_ledgers)
+
+                # Set default ledger for all transactions
+                df['Mapped Ledger'] = suspense_ledger
+                # Allow users to choose which transactions to include in export/push
+                df['Include'] = True
+
+                # Drop (or untick) rows already exported/pushed before any mapping work
+                df['Fingerprint'] = compute_transaction_fingerprints(df, date_formats)
+                processed = find_processed_transactions(st.session_state.email, df, bank_ledger)
+                # Overlapping statements in one batch share rows; only the first copy stays ticked
+                repeated = find_repeated_transactions(df, bank_ledger) & ~processed
+                if repeated.any():
+                    df['Include'] = ~repeated
+                    st.info(f"{int(repeated.sum())} transactions appear in more than one uploaded statement; "
+                            "the repeats are unticked.")
+                processed_count = int(processed.sum())
+                if processed_count and skip_processed:
+                    df = df[~processed].reset_index(drop=True)
+                    narration_directions = get_narration_directions(df)
+                    st.info(f"Skipped {processed_count} transactions already exported or pushed to Tally.")
+                elif processed_count:
+                    df['Include'] = df['Include'] & ~processed
+                    st.info(f"{processed_count} transactions were already exported or pushed to Tally and are unticked.")
+                if df.empty:
+                    st.success("Every transaction in this upload has already been processed.")
+                    st.stop()
 
-            # Preserve mapping edits (including bulk selection) while the same file is active
-            if (
-                'bank_mapping_df' not in st.session_state
-                or st.session_state.get('bank_mapping_file') != uploaded_file.name
-            ):
-                st.session_state.bank_mapping_df = df.copy()
-                st.session_state.bank_mapping_file = uploaded_file.name
+                set_session_frame('bank_mapping_df', df)
+                st.session_state.bank_mapping_file = batch_key
+                st.session_state.bank_narration_directions = narration_directions
+                st.session_state.bank_date_format = date_formats
+                st.session_state.bank_date_warning = "\n\n".join(date_warnings)
+                st.session_state.bank_source_ledgers = source_ledgers
+
+            df = get_session_frame('bank_mapping_df')
+            narration_directions = st.session_state.get('bank_narration_directions') or get_narration_directions(df)
+            source_ledgers = st.session_state.get('bank_source_ledgers', {})
+
+            if len(source_ledgers) > 1:
+                st.success(f"{len(source_ledgers)} bank statements processed! {len(df)} transactions ready for mapping.")
+                st.markdown("**Bank account for each statement:**")
+                sources_df = st.data_editor(
+                    pd.DataFrame({
+                        'Source File': list(source_ledgers),
+                        'Bank Ledger': list(source_ledgers.values()),
+                        'Transactions': df['Source File'].value_counts().reindex(list(source_ledgers)).fillna(0).astype(int).tolist(),
+                    }),
+                    column_config={
+                        "Bank Ledger": st.column_config.SelectboxColumn("Bank Ledger", options=ledger_master, required=True),
+                    },
+                    disabled=["Source File", "Transactions"],
+                    use_container_width=True,
+                    hide_index=True,
+                    key="bank_sources_editor"
+                )
+                new_source_ledgers = dict(zip(sources_df['Source File'], sources_df['Bank Ledger']))
             else:
-                df = st.session_state.bank_mapping_df.copy()
-
-            st.success(f"Bank statement processed! {len(df)} transactions ready for mapping.")
+                st.success(f"Bank statement processed! {len(df)} transactions ready for mapping.")
+                # A single statement follows the bank account chosen in step 1
+                new_source_ledgers = {name: bank_ledger for name in source_ledgers}
+            if new_source_ledgers != source_ledgers:
+                df['Bank Ledger'] = df['Source File'].map(new_source_ledgers)
+                st.session_state.bank_source_ledgers = new_source_ledgers
+                set_session_frame('bank_mapping_df', df)
+            if st.session_state.get('bank_date_warning'):
+                st.warning(st.session_state.bank_date_warning)
 
             st.divider()
 
@@ -3661,35 +7112,41 @@ def render_bank_converter_page():
             with col3:
                 if st.button("Auto Map Ledgers", use_container_width=True, type="secondary"):
                     with st.spinner("Applying smart rules and learned mappings..."):
-                        # Get unique narrations for auto-mapping
-                        unique_narrations = df['Narration'].unique()
+                        # Unique narrations were collected (chunk by chunk for large files) at upload
+                        unique_narrations = list(narration_directions)
                         
-                        # Get auto-mappings based on rules and learned patterns
-                        auto_mappings = auto_map_ledgers_based_on_rules(
-                            unique_narrations,
-                            ledger_master,
-                            rules_config,
-                            suspense_ledger,
-                            learned_mappings
-                        )
+                        # Get auto-mappings based on rules and learned patterns, one batch at a time
+                        auto_mappings = {}
+                        batch_size = 5000
+                        progress = st.progress(0.0) if len(unique_narrations) > batch_size else None
+                        for start in range(0, len(unique_narrations), batch_size):
+                            auto_mappings.update(auto_map_ledgers_based_on_rules(
+                                unique_narrations[start:start + batch_size],
+                                ledger_master,
+                                rules_config,
+                                suspense_ledger,
+                                learned_mappings,
+                                narration_directions=narration_directions,
+                                ledger_groups=st.session_state.get('ledger_groups', {}),
+                                group_policy=st.session_state.get('direction_group_policy')
+                            ))
+                            if progress:
+                                progress.progress(min((start + batch_size) / len(unique_narrations), 1.0))
                         
-                        # Apply auto-mappings to dataframe
-                        updated_count = 0
-                        for idx, row in df.iterrows():
-                            narration = str(row['Narration'])
-                            current_ledger = row['Mapped Ledger']
-                            
-                            # Apply auto-mapping based on user preference
-                            if overwrite_existing or current_ledger == suspense_ledger:
-                                auto_ledger = auto_mappings.get(narration, suspense_ledger)
-                                if auto_ledger != suspense_ledger:  # Only update if we found a better match
-                                    df.at[idx, 'Mapped Ledger'] = auto_ledger
-                                    updated_count += 1
+                        # Apply auto-mappings to the whole column at once, based on user preference
+                        auto_ledgers = df['Narration'].astype(str).map(auto_mappings)
+                        eligible = df['Mapped Ledger'] == suspense_ledger
+                        if overwrite_existing:
+                            eligible = pd.Series(True, index=df.index)
+                        # Only update where we found a better match than the suspense ledger
+                        update_mask = eligible & auto_ledgers.notna() & (auto_ledgers != suspense_ledger)
+                        df.loc[update_mask, 'Mapped Ledger'] = auto_ledgers[update_mask]
+                        updated_count = int(update_mask.sum())
                         
                         st.success(f"Auto-mapped {updated_count} transactions!")
 
                         # Persist auto-mapped updates for this file session
-                        st.session_state.bank_mapping_df = df.copy()
+                        set_session_frame('bank_mapping_df', df)
 
                         # Show mapping statistics
                         if updated_count > 0:
@@ -3711,7 +7168,7 @@ def render_bank_converter_page():
                 if st.button("Reset Auto Mapping", use_container_width=True):
                     # Revert all mapped ledgers back to the chosen suspense ledger
                     df['Mapped Ledger'] = suspense_ledger
-                    st.session_state.bank_mapping_df = df.copy()
+                    set_session_frame('bank_mapping_df', df)
                     st.success(f"Reset all mappings to suspense ledger: {suspense_ledger}")
 
             st.info("""
@@ -3724,10 +7181,16 @@ def render_bank_converter_page():
             # Data editor for manual mapping
             st.write(f"Mapping {len(df)} transactions. Select the correct ledger for each transaction:")
 
-            working_df = st.session_state.bank_mapping_df.copy()
+            working_df = get_session_frame('bank_mapping_df')
 
+            editor_columns = ['Date', 'Narration', 'Debit', 'Credit', 'Mapped Ledger', 'Include']
+            # Source, bank account, fingerprint, Tally date and paise travel with each row through edits;
+            # source and bank account are shown only for batches
+            batch_columns = [c for c in ('Source File', 'Bank Ledger', 'Fingerprint', 'Tally Date',
+                                         *BANK_PAISE_COLUMNS.values()) if c in working_df.columns]
+            shown_batch_columns = [c for c in ('Source File', 'Bank Ledger') if c in batch_columns] if len(source_ledgers) > 1 else []
             edited_df = st.data_editor(
-                working_df[['Date', 'Narration', 'Debit', 'Credit', 'Mapped Ledger', 'Include']],
+                working_df[editor_columns + batch_columns],
                 column_config={
                     "Mapped Ledger": st.column_config.SelectboxColumn(
                         "Mapped Ledger",
@@ -3741,16 +7204,48 @@ def render_bank_converter_page():
                         default=True,
                     ),
                 },
+                column_order=editor_columns + shown_batch_columns,
+                disabled=batch_columns,
                 use_container_width=True,
                 hide_index=True,
                 num_rows="dynamic",
                 key="bank_mapping_editor"
             )
 
-            st.session_state.bank_mapping_df = edited_df.copy()
+            # Narrations edited or rows added in the grid invalidate the upload-time narration index
+            if len(edited_df) != len(working_df) or not edited_df['Narration'].equals(working_df['Narration']):
+                st.session_state.bank_narration_directions = None
+            # Only dates and amounts edited (or added) in the grid are parsed again
+            edited_df = refresh_tally_dates(edited_df, working_df, st.session_state.get('bank_date_format'))
+            edited_df = refresh_amount_paise(edited_df, working_df)
+            if not edited_df.equals(working_df):
+                set_session_frame('bank_mapping_df', edited_df)
 
             st.divider()
 
+            split_by_ledger = False
+            if edited_df.get('Bank Ledger') is not None and edited_df['Bank Ledger'].nunique() > 1:
+                split_by_ledger = st.radio(
+                    "XML export layout:",
+                    ["One combined XML", "One XML per bank account (zip)"],
+                    horizontal=True,
+                    key="bank_export_layout"
+                ) != "One combined XML"
+            split_by, split_limit = render_xml_split_options("bank")
+
+            # Pre-push checks run on the selected rows before any XML is built
+            bank_date_format = st.session_state.get('bank_date_format')
+            validated_df = filter_selected_transactions(edited_df)
+            validation_period = render_validation_period(validated_df, "bank", bank_date_format)
+            issues = validate_bank_vouchers(
+                validated_df,
+                bank_ledger,
+                known_ledgers=get_known_ledger_names(st.session_state.email),
+                period=validation_period,
+                date_format=bank_date_format
+            )
+            excluded_rows = render_voucher_validation(issues, "bank")
+
             # Final Actions
             # Check if direct push is enabled
             enable_direct_push = st.session_state.get('enable_direct_push_bank', False)
@@ -3758,7 +7253,7 @@ def render_bank_converter_page():
             if enable_direct_push:
                 # Show Direct Push button as primary action
                 if st.button("🚀 Direct Push to Tally", type="primary", use_container_width=True):
-                    selected_df = filter_selected_transactions(edited_df)
+                    selected_df = filter_selected_transactions(edited_df).drop(index=excluded_rows)
                     if selected_df.empty:
                         st.warning("Please select at least one transaction to push to Tally.")
                         st.stop()
@@ -3782,19 +7277,27 @@ def render_bank_converter_page():
                         st.success(f"🧠 AI learned from {learned_count} mappings for future suggestions!")
 
                     with st.spinner("Pushing bank vouchers to Tally..."):
-                        xml_data = create_bank_tally_xml(
+                        # Identical inputs reuse the stored XML instead of regenerating it
+                        xml_data, artifact, _ = get_bank_export(
+                            st.session_state.email,
                             selected_df,
                             bank_ledger,
-                            company_name
+                            company_name,
+                            date_format=st.session_state.get('bank_date_format'),
+                            source_digest=batch_upload_digest(sources)
                         )
 
                         success, message, count = push_vouchers_to_tally(
                             xml_data,
                             st.session_state.tally_server_host,
-                            st.session_state.tally_server_port
+                            st.session_state.tally_server_port,
+                            voucher_count=artifact['voucher_count'],
+                            user=st.session_state.email
                         )
 
                     if success:
+                        record_processed_transactions(st.session_state.email, selected_df, bank_ledger,
+                                                      st.session_state.get('bank_date_format'))
                         st.success(f"✅ {message}")
                     else:
                         st.error(f"❌ {message}")
@@ -3810,7 +7313,7 @@ def render_bank_converter_page():
 
                 # Show Download XML as secondary option
                 if st.button("📥 Download Bank XML (Backup)", use_container_width=True):
-                    selected_df = filter_selected_transactions(edited_df)
+                    selected_df = filter_selected_transactions(edited_df).drop(index=excluded_rows)
                     if selected_df.empty:
                         st.warning("Please select at least one transaction to download.")
                         st.stop()
@@ -3834,24 +7337,33 @@ def render_bank_converter_page():
                         st.success(f"🧠 AI learned from {learned_count} mappings for future suggestions!")
 
                     with st.spinner("Generating Tally XML..."):
-                        xml_data = create_bank_tally_xml(
+                        xml_data, artifact, reused = get_bank_export(
+                            st.session_state.email,
                             selected_df,
                             bank_ledger,
-                            company_name
+                            company_name,
+                            date_format=st.session_state.get('bank_date_format'),
+                            split_by_ledger=split_by_ledger,
+                            split_by=split_by,
+                            split_limit=split_limit,
+                            source_digest=batch_upload_digest(sources)
                         )
+                    record_processed_transactions(st.session_state.email, selected_df, bank_ledger,
+                                                  st.session_state.get('bank_date_format'))
 
-                    st.success("Tally XML generated successfully!")
+                    st.success("Tally XML ready (unchanged since your last export)." if reused
+                               else "Tally XML generated successfully!")
                     st.download_button(
-                        label="📥 Download BankVouchers.xml",
+                        label=f"📥 Download {artifact['file_name']}",
                         data=xml_data,
-                        file_name="BankVouchers.xml",
-                        mime="application/xml",
+                        file_name=artifact['file_name'],
+                        mime=artifact['mime'],
                         use_container_width=True
                     )
             else:
                 # Show only Generate XML button when direct push is disabled
                 if st.button("Generate Tally XML", type="primary", use_container_width=True):
-                    selected_df = filter_selected_transactions(edited_df)
+                    selected_df = filter_selected_transactions(edited_df).drop(index=excluded_rows)
                     if selected_df.empty:
                         st.warning("Please select at least one transaction to include in the XML.")
                         st.stop()
@@ -3875,24 +7387,35 @@ def render_bank_converter_page():
                         st.success(f"🧠 AI learned from {learned_count} mappings for future suggestions!")
 
                     with st.spinner("Generating Tally XML..."):
-                        xml_data = create_bank_tally_xml(
+                        xml_data, artifact, reused = get_bank_export(
+                            st.session_state.email,
                             selected_df,
                             bank_ledger,
-                            company_name
+                            company_name,
+                            date_format=st.session_state.get('bank_date_format'),
+                            split_by_ledger=split_by_ledger,
+                            split_by=split_by,
+                            split_limit=split_limit,
+                            source_digest=batch_upload_digest(sources)
                         )
+                    record_processed_transactions(st.session_state.email, selected_df, bank_ledger,
+                                                  st.session_state.get('bank_date_format'))
 
-                    st.success("Tally XML generated successfully!")
+                    st.success("Tally XML ready (unchanged since your last export)." if reused
+                               else "Tally XML generated successfully!")
                     st.download_button(
-                        label="📥 Download BankVouchers.xml",
+                        label=f"📥 Download {artifact['file_name']}",
                         data=xml_data,
-                        file_name="BankVouchers.xml",
-                        mime="application/xml",
+                        file_name=artifact['file_name'],
+                        mime=artifact['mime'],
                         use_container_width=True
                     )
                     
         except Exception as e:
             st.error(f"Error processing bank statement: {e}")
 
+    render_export_history("bank", st.session_state.get('enable_direct_push_bank', False))
+
 def render_settings_page():
     """Enhanced settings page"""
     st.markdown("""
@@ -3902,7 +7425,7 @@ def render_settings_page():
         </div>
     """, unsafe_allow_html=True)
     
-    tab1, tab2, tab3, tab4 = st.tabs(["Company", "Journals", "AI Settings", "Tally Integration"])
+    tab1, tab2, tab3, tab4, tab5 = st.tabs(["Company", "Journals", "AI Settings", "Tally Integration", "Bank Formats"])
 
     with tab1:
         st.subheader("Company Settings")
@@ -4116,6 +7639,55 @@ def render_settings_page():
                 st.info("No learned mappings yet. AI will learn as you map transactions.")
         
         st.divider()
+
+        # Direction -> allowed Tally groups policy used to prune mapping candidates
+        st.markdown("#### Ledger Group Filters")
+        st.caption(
+            "Bank payments and receipts are only matched against ledgers in these Tally groups. "
+            "Ledgers in custom groups are always considered."
+        )
+        group_options = TALLY_RESERVED_GROUPS
+        policy_selection = {}
+        col1, col2 = st.columns(2)
+        for column, direction in zip((col1, col2), ("Payment", "Receipt")):
+            with column:
+                current_groups = st.session_state.direction_group_policy.get(direction, [])
+                policy_selection[direction] = st.multiselect(
+                    f"{direction} (money {'out' if direction == 'Payment' else 'in'}):",
+                    options=group_options,
+                    default=[g for g in current_groups if g in group_options],
+                    key=f"group_policy_{direction.lower()}"
+                )
+
+        col1, col2 = st.columns(2)
+        with col1:
+            if st.button("Save Group Filters", use_container_width=True):
+                conn = get_db_conn()
+                with conn.session as s:
+                    s.execute(text('DELETE FROM ledger_group_policy WHERE email = :email'),
+                              params=dict(email=st.session_state.email))
+                    for direction, groups in policy_selection.items():
+                        for ledger_group in groups:
+                            s.execute(text('''
+                                INSERT INTO ledger_group_policy (email, direction, ledger_group)
+                                VALUES (:email, :direction, :ledger_group)
+                            '''), params=dict(email=st.session_state.email, direction=direction, ledger_group=ledger_group))
+                    s.commit()
+                st.session_state.direction_group_policy = policy_selection
+                st.success("Ledger group filters saved!")
+        with col2:
+            if st.button("Restore Default Filters", use_container_width=True):
+                conn = get_db_conn()
+                with conn.session as s:
+                    s.execute(text('DELETE FROM ledger_group_policy WHERE email = :email'),
+                              params=dict(email=st.session_state.email))
+                    s.commit()
+                st.session_state.direction_group_policy = {k: list(v) for k, v in DEFAULT_DIRECTION_GROUP_POLICY.items()}
+                st.session_state.pop("group_policy_payment", None)
+                st.session_state.pop("group_policy_receipt", None)
+                st.rerun()
+
+        st.divider()
         
         # Learned Mappings Management
         st.markdown("#### Learned Mappings")
@@ -4185,7 +7757,8 @@ def render_settings_page():
             with st.spinner("Detecting companies from Tally server..."):
                 success, message, companies = fetch_companies_from_tally(
                     st.session_state.tally_server_host,
-                    st.session_state.tally_server_port
+                    st.session_state.tally_server_port,
+                    user=st.session_state.email
                 )
                 if success and companies:
                     st.session_state.detected_companies = companies
@@ -4392,7 +7965,8 @@ def render_settings_page():
                 with st.spinner("Testing connection and detecting companies..."):
                     success, message, companies = fetch_companies_from_tally(
                         st.session_state.tally_host_input,
-                        st.session_state.tally_port_input
+                        st.session_state.tally_port_input,
+                        user=st.session_state.email
                     )
                     if success:
                         st.session_state.detected_companies = companies
@@ -4425,10 +7999,18 @@ def render_settings_page():
                             synced_ledgers = get_synced_ledgers(st.session_state.email)
                             if synced_ledgers:
                                 st.session_state.ledger_master = [row[0] for row in synced_ledgers]
+                                st.session_state.ledger_groups = {row[0]: row[1] for row in synced_ledgers}
                             st.rerun()
                         else:
                             st.error(message)
 
+        connection_stats = list(get_tally_http_pool().stats().values())
+        if connection_stats:
+            sent = sum(stats['requests'] for stats in connection_stats)
+            reused = sum(stats['reused'] for stats in connection_stats)
+            st.caption(f"🔌 {sent} request(s) to Tally since the server started, "
+                       f"{reused} over an already open connection.")
+
         st.divider()
 
         # Display synced ledgers information
@@ -4480,6 +8062,22 @@ def render_settings_page():
                 hide_index=True
             )
 
+            # Near-duplicate ledgers, so users can clean up their master in Tally
+            catalog = ledger_mapper.ensure_catalog(st.session_state.ledger_master)
+            duplicate_clusters = catalog.duplicate_clusters()
+            if duplicate_clusters:
+                with st.expander(f"Possible duplicate ledgers ({len(duplicate_clusters)} groups)"):
+                    st.caption("Suggestions are matched against the first ledger of each group; "
+                               "merging or disabling the rest in Tally keeps mapping unambiguous.")
+                    st.dataframe(
+                        pd.DataFrame([
+                            {'Preferred Ledger': names[0], 'Near Duplicates': ', '.join(names[1:]), 'Count': len(names)}
+                            for names in duplicate_clusters
+                        ]),
+                        use_container_width=True,
+                        hide_index=True
+                    )
+
             # Export synced ledgers
             if st.button("Export Synced Ledgers to CSV", use_container_width=True):
                 csv = ledgers_df.to_csv(index=False)
@@ -4493,7 +8091,103 @@ def render_settings_page():
         else:
             st.info("No ledgers synced yet. Click 'Sync Ledgers Now' to fetch ledgers from Tally.")
 
+    with tab5:
+        st.subheader("Bank Statement Formats")
+        st.write("Uploads are matched to a format by their header row, so statements can be used exactly as the bank exports them.")
+
+        st.dataframe(
+            pd.DataFrame([
+                {
+                    'Format': profile['name'],
+                    'Source': 'Custom' if profile in st.session_state.bank_profiles else 'Built-in',
+                    'Layout': profile.get('layout', 'debit_credit').replace('_', ' ').title(),
+                    'Header Row': ', '.join(profile.get('headers') or BankProfileRegistry._alias_headers(profile)),
+                }
+                for profile in BUILTIN_BANK_PROFILES + st.session_state.bank_profiles
+            ]),
+            use_container_width=True,
+            hide_index=True
+        )
+
+        st.markdown("#### Add a Format")
+        profile_name = st.text_input("Format name:", key="bank_profile_name", placeholder="e.g. Yes Bank Current A/c")
+        header_text = st.text_input(
+            "Header row (comma-separated, exactly as in the file):",
+            key="bank_profile_headers",
+            placeholder="Txn Date, Description, Withdrawals, Deposits, Balance"
+        )
+        headers = [h.strip() for h in header_text.split(",") if h.strip()]
+        layout_labels = {
+            "Separate debit and credit columns": "debit_credit",
+            "One signed amount column (negative or Dr = withdrawal)": "signed_amount",
+            "Amount column plus a Dr/Cr column": "amount_indicator",
+        }
+        layout_label = st.radio("Amount layout:", list(layout_labels), key="bank_profile_layout")
+        layout = layout_labels[layout_label]
+
+        if headers:
+            none_option = "<None>"
+            col1, col2 = st.columns(2)
+            with col1:
+                date_col = st.selectbox("Date column:", headers, key="bank_profile_date")
+                narration_col = st.selectbox("Narration column:", headers, index=min(1, len(headers) - 1), key="bank_profile_narration")
+                balance_col = st.selectbox("Balance column:", [none_option] + headers, key="bank_profile_balance")
+            with col2:
+                if layout == "debit_credit":
+                    debit_col = st.selectbox("Debit (withdrawal) column:", headers, key="bank_profile_debit")
+                    credit_col = st.selectbox("Credit (deposit) column:", headers, key="bank_profile_credit")
+                else:
+                    amount_col = st.selectbox("Amount column:", headers, key="bank_profile_amount")
+                    if layout == "amount_indicator":
+                        indicator_col = st.selectbox("Dr/Cr column:", headers, key="bank_profile_indicator")
+                date_format = st.text_input("Date format (optional):", key="bank_profile_date_format",
+                                            placeholder="%d/%m/%Y", help="Python strftime format, e.g. %d-%b-%y")
+
+            if st.button("Save Format", use_container_width=True):
+                columns = {'Date': [date_col], 'Narration': [narration_col]}
+                if layout == "debit_credit":
+                    columns.update({'Debit': [debit_col], 'Credit': [credit_col]})
+                else:
+                    columns['Amount'] = [amount_col]
+                    if layout == "amount_indicator":
+                        columns['Indicator'] = [indicator_col]
+                if balance_col != none_option:
+                    columns['Balance'] = [balance_col]
+                profile = {
+                    'name': profile_name.strip() or "Custom Format",
+                    'layout': layout,
+                    'columns': columns,
+                    'headers': headers,
+                    'date_formats': [date_format.strip()] if date_format.strip() else [],
+                }
+                conn = get_db_conn()
+                with conn.session as s:
+                    s.execute(text('''
+                        INSERT INTO bank_format_profiles (email, profile_name, profile_json)
+                        VALUES (:email, :name, :profile_json)
+                        ON CONFLICT(email, profile_name) DO UPDATE SET profile_json = excluded.profile_json
+                    '''), params=dict(email=st.session_state.email, name=profile['name'], profile_json=json.dumps(profile)))
+                    s.commit()
+                st.session_state.bank_profiles = [
+                    p for p in st.session_state.bank_profiles if p['name'] != profile['name']
+                ] + [profile]
+                st.success(f"Format '{profile['name']}' saved!")
+
+        if st.session_state.bank_profiles:
+            st.markdown("#### Remove a Custom Format")
+            remove_name = st.selectbox("Custom format:", [p['name'] for p in st.session_state.bank_profiles], key="bank_profile_remove")
+            if st.button("Delete Format", type="secondary", use_container_width=True):
+                conn = get_db_conn()
+                with conn.session as s:
+                    s.execute(text('DELETE FROM bank_format_profiles WHERE email = :email AND profile_name = :name'),
+                              params=dict(email=st.session_state.email, name=remove_name))
+                    s.commit()
+                st.session_state.bank_profiles = [p for p in st.session_state.bank_profiles if p['name'] != remove_name]
+                st.rerun()
+
 def logout():
+    if 'session_frame_id' in st.session_state:
+        get_session_frame_store().drop_session(st.session_state.session_frame_id)
     st.session_state.logged_in = False
     st.session_state.current_view = "main" 
     st.session_state.email = "default"
@@ -0,0 +1,43 @@
+import sys
+from pathlib import Path
+
+# Ensure the application module is importable during tests
+ROOT_DIR = Path(__file__).resolve().parents[1]
+if str(ROOT_DIR) not in sys.path:
+    sys.path.insert(0, str(ROOT_DIR))
+
+# Prevent heavy optional imports during testing
+sys.modules.setdefault("sentence_transformers", None)
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import app
+
+
+class _TestConnection:
+    def __init__(self, session_factory):
+        self._session_factory = session_factory
+
+    @property
+    def session(self):
+        return self._session_factory()
+
+
+@pytest.fixture
+def app_db(tmp_path, monkeypatch):
+    """A temporary SQLite database with the application's own schema (created by init_db)."""
+    engine = create_engine(f"sqlite:///{tmp_path / 'users.db'}")
+    conn = _TestConnection(sessionmaker(bind=engine))
+    monkeypatch.setattr(app, "get_db_conn", lambda: conn)
+    app.init_db(seed_admin=False)
+    return conn
+
+
+@pytest.fixture(autouse=True)
+def upload_store(tmp_path, monkeypatch):
+    """Parsed uploads go to a per-test store instead of the working tree's data/uploads."""
+    store = app.UploadStore(root=str(tmp_path / "uploads"))
+    monkeypatch.setattr(app, "get_upload_store", lambda: store)
+    return store
@@ -0,0 +1,72 @@
+import app
+
+pd = app.pd
+
+
+def test_parses_indian_grouping_markers_and_negatives_to_paise():
+    values = pd.Series(["1,23,456.00", "12,000.00 Dr", "(500.00)", "₹ 2,500", "Rs. 99.995", "-7.5 Cr", "", None, "abc"])
+    paise, dr_cr, invalid = app.parse_amounts(values)
+
+    assert paise.dtype == "int64"
+    assert paise.tolist() == [12345600, 1200000, -50000, 250000, 10000, -750, 0, 0, 0]
+    assert dr_cr.tolist()[1] == "Dr" and dr_cr.tolist()[5] == "Cr"
+    assert invalid.tolist() == [False] * 8 + [True]
+
+
+def test_parser_without_pyarrow_matches_and_flags_overflowing_amounts(monkeypatch):
+    values = pd.Series(["1,23,456.00", "(500.00)", "Rs. 99.995", "0000000000000000001.50", "99999999999999999", "x"])
+    expected = app.parse_amounts(values)
+    monkeypatch.setattr(app, "PYARROW_AVAILABLE", False)
+    paise, dr_cr, invalid = app.parse_amounts(values)
+
+    assert paise.tolist() == expected[0].tolist() == [12345600, -50000, 10000, 150, 0, 0]
+    assert invalid.tolist() == expected[2].tolist() == [False, False, False, False, True, True]
+    _, _, numeric_invalid = app.parse_amounts(pd.Series([1e20, 5.0]))
+    assert numeric_invalid.tolist() == [True, False]
+
+
+def test_numeric_columns_and_exact_formatting():
+    paise, _, _ = app.parse_amounts(pd.Series([0.1, 0.2, 1234567.89, None]))
+    assert paise.tolist() == [10, 20, 123456789, 0]
+    assert app.format_paise(-123456) == "-1234.56"
+    assert app.format_paise(5) == "0.05"
+
+
+def test_signed_amount_column_is_split_into_debit_and_credit():
+    df = pd.DataFrame({
+        "date": ["01-04-2024"] * 3,
+        "narration": ["a", "b", "c"],
+        "amount": ["-1,500.00", "2,000.00", "300 Dr"],
+    })
+    df = app.normalize_bank_statement(df)
+
+    assert df["Debit"].tolist() == [1500.0, 0.0, 300.0]
+    assert df["Credit"].tolist() == [0.0, 2000.0, 0.0]
+
+
+def test_paise_flow_from_ingestion_into_validation_and_xml(monkeypatch):
+    df = app.normalize_bank_statement(pd.DataFrame({
+        "Date": ["01-04-2024"] * 3,
+        "Narration": ["UPI/ACME", "NEFT/SALARY", "UPI/TYPO"],
+        "Debit": ["1,23,456.78", "", "abc"],
+        "Credit": ["", "5,000.10", ""],
+    }))
+    assert df["Debit Paise"].tolist() == [12345678, 0, pd.NA]
+    assert df["Credit Paise"].tolist() == [0, 500010, 0]
+    assert "1 rows have amounts that could not be read" in app.describe_invalid_amounts(df)
+
+    issues = app.validate_bank_vouchers(df.assign(**{"Mapped Ledger": "Rent"}), "HDFC Bank")
+    assert issues.loc[issues["Check"].eq("Amount"), ["Row", "Severity"]].values.tolist() == [[2, "Error"]]
+
+    # Builders read the paise columns; the displayed rupee floats are never parsed again
+    parse_amounts = app.parse_amounts
+    monkeypatch.setattr(app, "parse_amounts", lambda *a: (_ for _ in ()).throw(AssertionError("re-parsed")))
+    xml = app.create_bank_tally_xml(df.assign(**{"Mapped Ledger": "Rent"}).iloc[:2], "HDFC Bank", "Demo Co")
+    assert "<AMOUNT>-123456.78</AMOUNT>" in xml and "<AMOUNT>5000.10</AMOUNT>" in xml
+
+    monkeypatch.setattr(app, "parse_amounts", parse_amounts)
+    edited = df.copy()
+    edited.loc[2, "Debit"] = 99.5
+    refreshed = app.refresh_amount_paise(edited, df)
+    assert refreshed["Debit Paise"].tolist() == [12345678, 0, 9950]
+    assert app.refresh_amount_paise(df.copy(), df)["Debit Paise"].isna().sum() == 1
@@ -1,14 +1,4 @@
-import sys
 from datetime import date, timedelta
-from pathlib import Path
-
-# Ensure the application module is importable during tests
-ROOT_DIR = Path(__file__).resolve().parents[1]
-if str(ROOT_DIR) not in sys.path:
-    sys.path.insert(0, str(ROOT_DIR))
-
-# Prevent heavy optional imports during testing
-sys.modules.setdefault("sentence_transformers", None)
 
 import pytest
 from sqlalchemy import create_engine, text
@@ -0,0 +1,74 @@
+import io
+
+import pytest
+from openpyxl import Workbook
+
+import app
+
+pd = app.pd
+
+
+def test_exact_header_signature_selects_profile_and_normalizes():
+    df = pd.DataFrame({
+        "Date": ["01/04/24"], "Narration": ["UPI/ACME"], "Chq./Ref.No.": ["0001"], "Value Dt": ["01/04/24"],
+        "Withdrawal Amt.": ["1,500.00"], "Deposit Amt.": [None], "Closing Balance": ["10,000.00"],
+    })
+    out = app.normalize_bank_statement(df)
+
+    assert out.attrs["bank_profile"] == "HDFC Bank"
+    assert out["Debit"].tolist() == [1500.0] and out["Credit"].tolist() == [0.0]
+    assert "Balance" in out.columns
+    assert app.normalize_dates(out["Date"], preferred_formats=out.attrs["date_formats"])[0].tolist() == ["20240401"]
+
+
+def test_amount_indicator_layout_and_alias_coverage_fallback():
+    kotak = pd.DataFrame({
+        "Date": ["01-04-2024", "02-04-2024"], "Description": ["NEFT/X", "IMPS/Y"],
+        "Amount": ["2,000.00", "300.00"], "Dr / Cr": ["DR", "CR"], "Balance": [1, 2], "Extra": [None, None],
+    })
+    out = app.normalize_bank_statement(kotak)
+    assert out.attrs["bank_profile"] == "Kotak Mahindra Bank"
+    assert out["Debit"].tolist() == [2000.0, 0.0]
+    assert out["Credit"].tolist() == [0.0, 300.0]
+
+
+def test_user_profile_overrides_and_unknown_layout_falls_back_to_template():
+    custom = {
+        "name": "My Bank",
+        "layout": "debit_credit",
+        "columns": {"Date": ["Posted"], "Narration": ["Memo"], "Debit": ["Out"], "Credit": ["In"]},
+        "headers": ["Posted", "Memo", "Out", "In"],
+    }
+    df = pd.DataFrame({"Posted": ["01-04-2024"], "Memo": ["Rent"], "Out": ["5,000"], "In": [""]})
+    out = app.normalize_bank_statement(df, app.BUILTIN_BANK_PROFILES + [custom])
+    assert out.attrs["bank_profile"] == "My Bank"
+    assert out["Debit"].tolist() == [5000.0]
+
+    with pytest.raises(ValueError, match="Date"):
+        app.normalize_bank_statement(pd.DataFrame({"Posted": [], "Memo": []}))
+
+
+def test_registry_is_compiled_once_per_profile_set_and_knows_user_headers():
+    custom = {
+        "name": "Co-op Bank",
+        "layout": "debit_credit",
+        "columns": {"Date": ["Posted On"], "Narration": ["Memo"], "Debit": ["Paid Out"], "Credit": ["Paid In"]},
+        "headers": ["Posted On", "Memo", "Paid Out", "Paid In"],
+    }
+    profiles = app.BUILTIN_BANK_PROFILES + [custom]
+    registry = app.get_bank_profile_registry(profiles)
+    assert app.get_bank_profile_registry([dict(p) for p in profiles]) is registry
+    assert app.get_bank_profile_registry() is not registry
+
+    wb = Workbook()
+    wb.active.append(["Co-operative Bank Ltd"])
+    wb.active.append(["Statement", "April 2024"])
+    wb.active.append(["Posted On", "Memo", "Paid Out", "Paid In"])
+    wb.active.append(["01-04-2024", "UPI/ACME", 150.5, None])
+    buffer = io.BytesIO()
+    wb.save(buffer)
+
+    df, _, error = app.parse_bank_statement(app.UploadedMember("coop.xlsx", buffer.getvalue()), profiles)
+    assert error is None
+    assert df.attrs["bank_profile"] == "Co-op Bank"
+    assert df["Narration"].tolist() == ["UPI/ACME"] and df["Debit Paise"].tolist() == [15050]
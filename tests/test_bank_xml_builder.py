@@ -0,0 +1,189 @@
+from html import escape
+
+import app
+
+pd = app.pd
+
+
+def _reference_bank_xml(df, bank_ledger, company_name, date_format=None):
+    """The row-wise create_bank_tally_xml this builder replaced, kept as the output oracle."""
+    xml_template = """<ENVELOPE>
+ <HEADER>
+  <TALLYREQUEST>Import Data</TALLYREQUEST>
+ </HEADER>
+ <BODY>
+  <IMPORTDATA>
+   <REQUESTDESC>
+    <REPORTNAME>Vouchers</REPORTNAME>
+    <STATICVARIABLES>
+     <SVCURRENTCOMPANY>{company_name}</SVCURRENTCOMPANY>
+    </STATICVARIABLES>
+   </REQUESTDESC>
+   <REQUESTDATA>
+{tally_messages}
+   </REQUESTDATA>
+  </IMPORTDATA>
+ </BODY>
+</ENVELOPE>"""
+    voucher_template = """
+    <TALLYMESSAGE xmlns:UDF="TallyUDF">
+     <VOUCHER REMOTEID="{remote_id}" VCHTYPE="{voucher_type}" ACTION="Create">
+      <DATE>{date}</DATE>
+      <GUID>{remote_id}</GUID>
+      <VOUCHERTYPENAME>{voucher_type}</VOUCHERTYPENAME>
+      <NARRATION>{narration}</NARRATION>
+      <PERSISTEDVIEW>Accounting Voucher View</PERSISTEDVIEW>
+      {ledger_entries}
+     </VOUCHER>
+    </TALLYMESSAGE>"""
+
+    ledger_entry_template = """
+      <ALLLEDGERENTRIES.LIST>
+       <LEDGERNAME>{ledger_name}</LEDGERNAME>
+       <ISDEEMEDPOSITIVE>{is_positive}</ISDEEMEDPOSITIVE>
+       <AMOUNT>{amount}</AMOUNT>
+      </ALLLEDGERENTRIES.LIST>"""
+    all_tally_messages = []
+    remote_ids = app.bank_voucher_ids(df, bank_ledger, date_format)
+    tally_dates = app.get_tally_dates(df, date_format)
+    # Multi-file batches carry each row's bank account; other rows use bank_ledger
+    row_bank_ledgers = df['Bank Ledger'] if 'Bank Ledger' in df.columns else None
+    debit_paise = app.get_amount_paise(df, 'Debit')
+    credit_paise = app.get_amount_paise(df, 'Credit')
+    for index, row in df.iterrows():
+        narration = "N/A"  # Initialize before try block to avoid NameError in exception handler
+        try:
+            tally_date = tally_dates.at[index]
+            if pd.isna(tally_date):
+                raise ValueError(f"unreadable date '{row['Date']}'")
+            narration = str(row['Narration'])
+            debit = int(debit_paise.at[index])
+            credit = int(credit_paise.at[index])
+
+            mapped_ledger = row['Mapped Ledger']
+
+            if debit > 0:
+                voucher_type = "Payment"
+                bank_amount = debit
+                contra_amount = debit * -1
+                is_bank_positive = "No"
+                is_contra_positive = "Yes"
+            elif credit > 0:
+                voucher_type = "Receipt"
+                bank_amount = credit * -1
+                contra_amount = credit
+                is_bank_positive = "Yes"
+                is_contra_positive = "No"
+            else:
+                continue
+            # XML escape narration and ledger names
+            narration_safe = escape(str(narration)) if pd.notna(narration) else "N/A"
+            row_bank_ledger = bank_ledger
+            if row_bank_ledgers is not None and pd.notna(row_bank_ledgers.at[index]):
+                row_bank_ledger = row_bank_ledgers.at[index]
+            bank_ledger_safe = escape(str(row_bank_ledger))
+            mapped_ledger_safe = escape(str(mapped_ledger))
+
+            # Create ledger entries list with tuples (xml, is_debit_flag)
+            ledger_list = []
+
+            # Bank ledger entry
+            bank_entry_xml = ledger_entry_template.format(
+                ledger_name=bank_ledger_safe,
+                is_positive=is_bank_positive,
+                amount=app.format_paise(bank_amount)
+            )
+            # is_bank_positive="Yes" means debit
+            ledger_list.append((bank_entry_xml, is_bank_positive == "Yes"))
+
+            # Contra ledger entry
+            contra_entry_xml = ledger_entry_template.format(
+                ledger_name=mapped_ledger_safe,
+                is_positive=is_contra_positive,
+                amount=app.format_paise(contra_amount)
+            )
+            # is_contra_positive="Yes" means debit
+            ledger_list.append((contra_entry_xml, is_contra_positive == "Yes"))
+
+            # Sort: Debit entries (True) first, Credit entries (False) second
+            ledger_list.sort(key=lambda x: not x[1])  # not x[1] puts True before False
+
+            # Extract sorted XML strings
+            sorted_ledger_entries = "\n".join([entry[0] for entry in ledger_list])
+
+            all_tally_messages.append(
+                voucher_template.format(
+                    voucher_type=voucher_type,
+                    remote_id=remote_ids.at[index],
+                    date=tally_date,
+                    narration=narration_safe,
+                    ledger_entries=sorted_ledger_entries
+                )
+            )
+        except Exception as e:
+            app.st.error(f"Error processing row {index} ('{narration}'): {e}. Skipping row.")
+
+    # XML escape company name before inserting into template
+    company_name_safe = escape(str(company_name))
+
+    return xml_template.format(
+        company_name=company_name_safe,
+        tally_messages="\n".join(all_tally_messages)
+    )
+
+
+def _statement(rows):
+    narrations = ["UPI/ACME & Sons <shop>", 'NEFT "SALARY"', "O'Brien refund", None, "Cash", "Zero row", "Bad date"]
+    data = {
+        "Date": [f"{(i % 28) + 1:02d}-04-2024" for i in range(rows)],
+        "Narration": [narrations[i % len(narrations)] for i in range(rows)],
+        "Debit": [["1,250.50", "0", "", "12.345", "(40)", "0", "5"][i % 7] for i in range(rows)],
+        "Credit": [["0", "5000", "99.99", "0", "0", "0", "0"][i % 7] for i in range(rows)],
+        "Mapped Ledger": [["Rent", "Salary", "Refunds & Returns", None, "Cash", "Suspense", "Rent"][i % 7]
+                          for i in range(rows)],
+    }
+    df = pd.DataFrame(data, index=range(100, 100 + rows))
+    df.loc[df.index[6::7], "Date"] = "not a date"
+    return df
+
+
+def test_vectorized_bank_xml_matches_row_wise_builder():
+    df = _statement(70)
+    assert app.create_bank_tally_xml(df, "HDFC <Bank>", "Demo & Co") == _reference_bank_xml(df, "HDFC <Bank>", "Demo & Co")
+
+    df["Bank Ledger"] = ["SBI Bank" if i % 3 else None for i in range(len(df))]
+    assert app.create_bank_tally_xml(df, "HDFC Bank", "Demo") == _reference_bank_xml(df, "HDFC Bank", "Demo")
+    assert app.create_bank_tally_xml(df.iloc[:0], "HDFC Bank", "Demo") == _reference_bank_xml(df.iloc[:0], "HDFC Bank", "Demo")
+
+
+def test_vectorized_bank_xml_matches_on_normalized_statement():
+    df = app.normalize_bank_statement(_statement(70).drop(columns="Mapped Ledger"))
+    df["Mapped Ledger"] = "Office Expenses"
+    xml = app.create_bank_tally_xml(df, "HDFC Bank", "Demo", date_format="%d-%m-%Y")
+    assert xml.count("<VOUCHER ") == 40
+    assert xml == _reference_bank_xml(df, "HDFC Bank", "Demo", date_format="%d-%m-%Y")
+
+
+def test_streamed_bank_xml_matches_and_pushes_from_file(monkeypatch):
+    df = _statement(70)
+    stream = app.stream_bank_tally_xml(df, "HDFC Bank", "Demo", chunk_rows=8)
+    chunks = list(stream)
+    assert len(chunks) > 3 and stream.voucher_count == 40
+    assert b"".join(chunks).decode() == _reference_bank_xml(df, "HDFC Bank", "Demo")
+
+    sent = []
+
+    class _Response:
+        status_code = 200
+        text = "<RESPONSE><CREATED>40</CREATED></RESPONSE>"
+
+    def _post(session, url, data, headers, timeout):
+        sent.append(data.read())
+        return _Response()
+
+    monkeypatch.setattr(app.requests.Session, "post", _post)
+    stream = app.stream_bank_tally_xml(df, "HDFC Bank", "Demo", chunk_rows=8)
+    xml_file = stream.to_file()
+    success, _, count = app.push_vouchers_to_tally(xml_file, "tally.local", 9000, voucher_count=stream.voucher_count)
+    assert success and count == 40
+    assert sent[0].decode() == _reference_bank_xml(df, "HDFC Bank", "Demo")
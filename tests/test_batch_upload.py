@@ -0,0 +1,79 @@
+import io
+import zipfile
+
+import pytest
+
+import app
+
+pd = app.pd
+
+APRIL = b"Date,Narration,Debit,Credit\n01-04-2024,UPI/ACME,100,0\n02-04-2024,NEFT/SALARY,0,5000\n"
+MAY = b"Date,Narration,Debit,Credit\n05/01/2024,UPI/ACME,250,0\n"
+
+
+def _zip(members):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+    upload = app.UploadedMember("month_end.zip", buffer.getvalue())
+    return upload
+
+
+def test_zip_members_are_expanded_and_parsed():
+    upload = _zip({"hdfc/april.csv": APRIL, "__MACOSX/hdfc/._april.csv": b"x", "notes.txt": b"x", "sbi_may.csv": MAY})
+    sources = app.expand_upload_batch([upload, app.UploadedMember("extra.pdf", b"%PDF")])
+
+    assert [s.name for s in sources] == ["month_end.zip/hdfc/april.csv", "month_end.zip/sbi_may.csv"]
+    df, directions, error = app.parse_bank_statement(sources[0])
+    assert error is None and len(df) == 2
+
+
+def test_batch_combines_sources_and_exports_per_bank_ledger():
+    frames = [(name, app.parse_bank_statement(app.UploadedMember(name, data))[0]) for name, data in
+              [("april.csv", APRIL), ("may.csv", MAY)]]
+    directions = {}
+    for _, part in frames:
+        app.merge_narration_directions(directions, app.get_narration_directions(part))
+    assert directions == {"UPI/ACME": "Payment", "NEFT/SALARY": "Receipt"}
+
+    df = app.combine_bank_statements(frames, {"april.csv": "HDFC Bank", "may.csv": "SBI Bank"})
+    df["Mapped Ledger"] = "Rent"
+    date_formats = {"april.csv": "%d-%m-%Y", "may.csv": "%m/%d/%Y"}
+
+    combined = app.create_bank_tally_xml(df, "HDFC Bank", "Demo Co", date_format=date_formats)
+    assert combined.count("<VOUCHER ") == 3
+    assert "<LEDGERNAME>SBI Bank</LEDGERNAME>" in combined
+    assert "<DATE>20240501</DATE>" in combined
+
+    export_file, name, mime = app.build_bank_xml_export(df, "HDFC Bank", "Demo Co", date_formats, split_by_ledger=True)
+    data = export_file.read()
+    assert name == "BankVouchers.zip" and mime == "application/zip"
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        assert sorted(archive.namelist()) == ["BankVouchers_HDFC_Bank.xml", "BankVouchers_SBI_Bank.xml"]
+        assert archive.read("BankVouchers_SBI_Bank.xml").decode().count("<VOUCHER ") == 1
+
+
+def test_same_named_statements_get_unique_sources():
+    frames = app.load_bank_statement_batch([app.UploadedMember("statement.csv", APRIL),
+                                            app.UploadedMember("statement.csv", MAY)])
+    names = [name for name, *_ in frames]
+    assert names == ["statement.csv", "statement.csv (2)"]
+
+    df = app.combine_bank_statements([(name, df) for name, df, _, _ in frames],
+                                     {"statement.csv": "HDFC Bank", "statement.csv (2)": "SBI Bank"})
+    assert df.groupby("Source File")["Bank Ledger"].first().to_dict() == {
+        "statement.csv": "HDFC Bank", "statement.csv (2)": "SBI Bank"}
+
+
+def test_zip_expansion_limits_are_checked_before_extracting(monkeypatch):
+    upload = _zip({"april.csv": APRIL, "may.csv": MAY})
+    monkeypatch.setattr(app, "ZIP_MEMBER_MAX_BYTES", len(APRIL) - 1)
+    with pytest.raises(ValueError, match="limit per statement"):
+        app.expand_upload_batch([upload])
+
+    monkeypatch.setattr(app, "ZIP_MEMBER_MAX_BYTES", len(APRIL))
+    monkeypatch.setattr(app, "ZIP_TOTAL_MAX_BYTES", len(APRIL) + len(MAY) - 1)
+    monkeypatch.setattr(app.zipfile.ZipFile, "read", lambda *a: pytest.fail("member extracted"))
+    with pytest.raises(ValueError, match="expand to more than"):
+        app.expand_upload_batch([upload])
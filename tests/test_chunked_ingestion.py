@@ -0,0 +1,97 @@
+import io
+
+import pytest
+
+import app
+
+
+def _statement_csv(rows):
+    lines = ["date , narration,DEBIT,credit,Balance"]
+    for i in range(rows):
+        if i % 2:
+            lines.append(f"01-04-2024,UPI/{i % 3}/Rent,0,1{i},99")
+        else:
+            lines.append(f"01-04-2024,NEFT/{i % 3}/Salary,1{i},,99")
+    return io.BytesIO("\n".join(lines).encode("latin1"))
+
+
+def test_chunked_ingestion_matches_single_pass():
+    seen = []
+    df, directions = app.ingest_bank_statement_chunked(_statement_csv(25), chunk_rows=4, on_chunk=seen.append)
+
+    full = app.normalize_bank_statement(app.pd.read_csv(_statement_csv(25), encoding="latin1"))
+    assert list(df.columns) == app.BANK_INGEST_COLUMNS
+    for col in ["Debit", "Credit", "Debit Paise", "Credit Paise"]:
+        assert df[col].tolist() == full[col].tolist()
+    assert seen[-1] == 25 and len(seen) == 7
+    assert directions == app.get_narration_directions(full)
+    assert directions["NEFT/0/Salary"] == "Payment"
+    assert directions["UPI/1/Rent"] == "Receipt"
+
+
+def test_chunked_ingestion_rejects_missing_columns():
+    with pytest.raises(ValueError, match="Credit"):
+        app.ingest_bank_statement_chunked(io.BytesIO(b"Date,Narration,Debit\n01-04-2024,x,1"))
+
+
+def _xlsx_with_preamble():
+    from datetime import datetime
+    from openpyxl import Workbook
+
+    wb = Workbook()
+    ws = wb.active
+    ws.append(["State Bank of India"])
+    ws.append(["Account Statement", None, "From 01-04-2024"])
+    ws.append([])
+    ws.append(["Txn Date", "Description", "Debit", "Credit", "Balance"])
+    ws.append([datetime(2024, 4, 1), "UPI/ACME", 150.5, None, 1000])
+    ws.append([None, None, None, None, None])
+    ws.append([datetime(2024, 4, 2), "NEFT/SALARY", None, 5000, 6000])
+    buffer = io.BytesIO()
+    wb.save(buffer)
+    buffer.seek(0)
+    return buffer
+
+
+def test_xlsx_reader_skips_preamble_and_blank_rows():
+    df = app.read_xlsx_streaming(_xlsx_with_preamble())
+
+    assert list(df.columns) == ["Txn Date", "Description", "Debit", "Credit", "Balance"]
+    assert df["Description"].tolist() == ["UPI/ACME", "NEFT/SALARY"]
+    assert df["Debit"].iloc[0] == 150.5
+    assert df["Txn Date"].iloc[1].day == 2
+
+
+def test_detect_header_row_falls_back_to_first_non_empty_row():
+    rows = [(None, None), ("Voucher No", "Account"), ("1", "Cash")]
+    assert app.detect_header_row(rows) == 1
+
+
+def test_csv_encoding_is_sniffed_for_utf8_bom_and_latin1():
+    utf8 = "Date,Narration,Debit,Credit\n01-04-2024,UPI/रमेश कुमार/₹ refund,10,0\n".encode("utf-8")
+    assert app.detect_text_encoding(utf8) == "utf-8"
+    assert app.detect_text_encoding(b"\xef\xbb\xbf" + utf8) == "utf-8-sig"
+    assert app.detect_text_encoding("Café bill".encode("latin1")) == "latin1"
+
+    df = app.load_uploaded_file(b"\xef\xbb\xbf" + utf8, "statement.csv")
+    assert list(df.columns) == ["Date", "Narration", "Debit", "Credit"]
+    assert df["Narration"].iloc[0] == "UPI/रमेश कुमार/₹ refund"
+
+    chunked, directions = app.ingest_bank_statement_chunked(io.BytesIO(utf8), chunk_rows=1)
+    assert list(directions) == ["UPI/रमेश कुमार/₹ refund"]
+
+    latin = app.load_uploaded_file("Date,Narration,Debit,Credit\n01-04-2024,Café,1,0\n".encode("latin1"), "s.csv")
+    assert latin["Narration"].iloc[0] == "Café"
+
+
+def test_chunked_and_whole_file_reads_decode_late_latin1_bytes_alike(monkeypatch):
+    # The sniffed sample is valid UTF-8; the latin1 byte only appears further in
+    monkeypatch.setattr(app, "CSV_SNIFF_BYTES", 64)
+    rows = b"".join(b"01-04-2024,UPI/%d,10,0\n" % i for i in range(50))
+    csv = b"Date,Narration,Debit,Credit\n" + rows + b"02-04-2024,Caf\xe9 bill,5,0\n"
+
+    whole = app.normalize_bank_statement(app.load_uploaded_file(csv, "statement.csv"))
+    chunked, directions = app.ingest_bank_statement_chunked(io.BytesIO(csv), chunk_rows=10)
+
+    assert chunked["Narration"].iloc[-1] == whole["Narration"].iloc[-1] == "Café bill"
+    assert "Café bill" in directions and len(directions) == 51
@@ -0,0 +1,62 @@
+from datetime import datetime
+
+import app
+
+pd = app.pd
+
+
+def test_infers_one_day_first_format_for_the_whole_column():
+    dates = pd.Series(["01-02-2024", "13-02-2024", "28-02-2024", "not a date", None])
+    tally_dates, fmt, unparsed = app.normalize_dates(dates)
+
+    assert fmt == "%d-%m-%Y"
+    assert tally_dates.tolist()[:3] == ["20240201", "20240213", "20240228"]
+    assert list(unparsed) == [3, 4]
+
+
+def test_month_names_excel_serials_and_datetime_cells():
+    assert app.normalize_dates(pd.Series(["05-Apr-24", "30-Apr-24"]))[0].tolist() == ["20240405", "20240430"]
+    assert app.normalize_dates(pd.Series([45383, 45384.0]))[0].tolist() == ["20240401", "20240402"]
+
+    mixed = pd.Series([datetime(2024, 4, 1), "02/04/2024", "03/04/2024"], dtype=object)
+    tally_dates, fmt, unparsed = app.normalize_dates(mixed)
+    assert fmt == "%d/%m/%Y"
+    assert tally_dates.tolist() == ["20240401", "20240402", "20240403"]
+    assert len(unparsed) == 0
+
+
+def test_bank_xml_uses_precomputed_dates_and_skips_unreadable_rows():
+    df = pd.DataFrame({
+        "Date": ["01/02/2024", "garbage"],
+        "Narration": ["UPI/ACME", "NEFT/X"],
+        "Debit": [100.0, 50.0],
+        "Credit": [0.0, 0.0],
+        "Mapped Ledger": ["Rent", "Rent"],
+    })
+    xml = app.create_bank_tally_xml(df, "HDFC Bank", "Demo Co", date_format="%d/%m/%Y")
+
+    assert "<DATE>20240201</DATE>" in xml
+    assert xml.count("<VOUCHER ") == 1
+
+
+def test_grid_edits_only_renormalize_changed_and_added_rows(monkeypatch):
+    before = pd.DataFrame({
+        "Date": ["02/01/2024", "03/01/2024"],
+        "Source File": ["april.csv", "april.csv"],
+        "Tally Date": ["20240102", "20240103"],
+    })
+    edited = pd.DataFrame({
+        "Date": ["02/01/2024", "04/01/2024", "05/01/2024"],
+        "Source File": ["april.csv", "april.csv", None],
+        "Tally Date": ["20240102", "20240103", None],
+    })
+    converted = []
+    normalize_dates = app.normalize_dates
+    monkeypatch.setattr(app, "normalize_dates", lambda values, *a, **k: (converted.append(len(values)),
+                                                                          normalize_dates(values, *a, **k))[1])
+
+    refreshed = app.refresh_tally_dates(edited, before, {"april.csv": "%d/%m/%Y"})
+
+    assert refreshed["Tally Date"].tolist() == ["20240102", "20240104", "20240105"]
+    assert sum(converted) == 2
+    assert app.refresh_tally_dates(before, before, {"april.csv": "%d/%m/%Y"}) is before
@@ -0,0 +1,85 @@
+import os
+
+import pytest
+from sqlalchemy import text
+
+import app
+
+pd = app.pd
+
+
+@pytest.fixture
+def history_db(app_db, tmp_path, monkeypatch):
+    # Artifacts are written under the relative data/exports directory
+    monkeypatch.chdir(tmp_path)
+    return app_db
+
+
+def _statement():
+    return pd.DataFrame({
+        "Date": ["01-04-2024", "02-04-2024", "03-04-2024"],
+        "Narration": ["Rent", "Salary", "Nothing"],
+        "Debit": ["500", "0", "0"],
+        "Credit": ["0", "1,000.50", "0"],
+        "Mapped Ledger": ["Rent", "Salary Income", "Rent"],
+    })
+
+
+def test_identical_exports_are_served_from_history(history_db, monkeypatch):
+    builds = []
+    build_bank_xml_export = app.build_bank_xml_export
+    monkeypatch.setattr(app, "build_bank_xml_export", lambda *args: builds.append(args) or build_bank_xml_export(*args))
+    df = _statement()
+
+    first, artifact, reused = app.get_bank_export("a@x.com", df, "HDFC Bank", "Demo", source_digest="abc")
+    data = first.read()
+    assert not reused and len(builds) == 1
+    assert (artifact["voucher_count"], artifact["total_paise"]) == (2, 150050)
+    assert (artifact["file_name"], artifact["source_digest"], artifact["bank_ledger"]) == (
+        "BankVouchers.xml", "abc", "HDFC Bank")
+    assert data == app.create_bank_tally_xml(df, "HDFC Bank", "Demo").encode()
+    stored = os.path.join(app.EXPORT_HISTORY_DIR, f"{artifact['content_hash']}.gz")
+    assert os.path.getsize(stored) < len(data)
+
+    again, artifact_again, reused = app.get_bank_export("a@x.com", _statement(), "HDFC Bank", "Demo")
+    assert reused and len(builds) == 1
+    assert again.read() == data and artifact_again["id"] == artifact["id"]
+
+    # Any change to the inputs regenerates; another user never sees this user's exports
+    edited = _statement()
+    edited.loc[0, "Mapped Ledger"] = "Office Rent"
+    assert not app.get_bank_export("a@x.com", edited, "HDFC Bank", "Demo")[2]
+    assert not app.get_bank_export("b@x.com", df, "HDFC Bank", "Demo")[2]
+    assert len(builds) == 3
+    history = app.get_export_history("a@x.com", "bank")
+    assert len(history) == 2 and history[0]["id"] != artifact["id"]
+    # b@x.com's export has the same content as a@x.com's first one and shares its file
+    assert len(os.listdir(app.EXPORT_HISTORY_DIR)) == 2
+
+
+def test_retention_drops_old_entries_and_unreferenced_files(history_db):
+    df = _statement()
+    artifacts = []
+    for ledger in ("HDFC Bank", "SBI Bank", "ICICI Bank"):
+        artifacts.append(app.get_bank_export("a@x.com", df, ledger, "Demo")[1])
+    for name in os.listdir(app.EXPORT_HISTORY_DIR):
+        os.utime(os.path.join(app.EXPORT_HISTORY_DIR, name), (0, 0))
+    with history_db.session as s:
+        s.execute(text("UPDATE export_artifacts SET last_used_at = DATETIME('now', '-40 days') WHERE id = :id"),
+                  params=dict(id=artifacts[0]["id"]))
+        s.commit()
+
+    app.prune_export_artifacts("a@x.com", retention_days=30, max_per_user=1)
+    assert [a["id"] for a in app.get_export_history("a@x.com")] == [artifacts[2]["id"]]
+    assert os.listdir(app.EXPORT_HISTORY_DIR) == [f"{artifacts[2]['content_hash']}.gz"]
+    assert app.open_export_artifact(artifacts[2]).read().count(b"<VOUCHER ") == 2
+
+
+def test_inputs_key_covers_frames_and_nested_configs():
+    mappings = {"Employee": pd.DataFrame({"CSV Value": ["Asha"], "Mapped Ledger": ["Asha K"]})}
+    key = app.export_inputs_key("journal", _statement(), mappings, None)
+    assert key == app.export_inputs_key("journal", _statement(), {"Employee": mappings["Employee"].copy()}, None)
+    changed = {"Employee": pd.DataFrame({"CSV Value": ["Asha"], "Mapped Ledger": ["Asha R"]})}
+    assert key != app.export_inputs_key("journal", _statement(), changed, None)
+    assert key != app.export_inputs_key("journal", _statement(), mappings, "month")
+    assert key != app.export_inputs_key("bank", _statement(), mappings, None)
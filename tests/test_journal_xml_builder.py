@@ -0,0 +1,208 @@
+from html import escape
+
+import app
+
+pd = app.pd
+
+FIXED = [
+    {"Tally Ledger Name": "Salary & Wages", "CSV Column Name": "Gross", "Type (Debit/Credit)": "Debit"},
+    {"Tally Ledger Name": "TDS Payable", "CSV Column Name": "TDS", "Type (Debit/Credit)": "Credit"},
+    {"Tally Ledger Name": "Not In File", "CSV Column Name": "Missing", "Type (Debit/Credit)": "Debit"},
+    {"Tally Ledger Name": "Bonus", "CSV Column Name": "Bonus", "Type (Debit/Credit)": "Debit"},
+]
+DYNAMIC = [
+    {"CSV Column for Ledger Name": "Employee", "CSV Column for Amount": "Net", "Transaction Type": "Credit"},
+    {"CSV Column for Ledger Name": "Cost Centre", "CSV Column for Amount": "Gross", "Transaction Type": "Debit"},
+]
+MAPPINGS = {
+    "Employee": pd.DataFrame({"CSV Value": ["Asha", "Ravi", "Asha"], "Mapped Ledger": ["Asha <Payable>", None, "Asha K"]}),
+    "Cost Centre": pd.DataFrame({"CSV Value": ["Ops"], "Mapped Ledger": ["Operations"]}),
+}
+
+
+def _reference_journal_xml(df, fixed_ledger_config, dynamic_ledger_config, company_name, voucher_type, journal_mappings,
+                     date_format=None):
+    """The row-wise create_tally_xml this builder replaced, kept as the output oracle."""
+    xml_template = """<ENVELOPE>
+ <HEADER>
+  <TALLYREQUEST>Import Data</TALLYREQUEST>
+ </HEADER>
+ <BODY>
+  <IMPORTDATA>
+   <REQUESTDESC>
+    <REPORTNAME>Vouchers</REPORTNAME>
+    <STATICVARIABLES>
+     <SVCURRENTCOMPANY>{company_name}</SVCURRENTCOMPANY>
+    </STATICVARIABLES>
+   </REQUESTDESC>
+   <REQUESTDATA>
+{tally_messages}
+   </REQUESTDATA>
+  </IMPORTDATA>
+ </BODY>
+</ENVELOPE>"""
+    tally_message_template = """
+    <TALLYMESSAGE xmlns:UDF="TallyUDF">
+     <VOUCHER REMOTEID="{remote_id}" VCHTYPE="{voucher_type}" ACTION="Create">
+      <DATE>{date}</DATE>
+      <GUID>{remote_id}</GUID>
+      <VOUCHERTYPENAME>{voucher_type}</VOUCHERTYPENAME>
+      <VOUCHERNUMBER>{voucher_number}</VOUCHERNUMBER>
+      <NARRATION>{narration}</NARRATION>
+      <PERSISTEDVIEW>Accounting Voucher View</PERSISTEDVIEW>
+      {ledger_entries}
+     </VOUCHER>
+    </TALLYMESSAGE>"""
+    ledger_line_template = """
+      <ALLLEDGERENTRIES.LIST>
+       <LEDGERNAME>{ledger_name}</LEDGERNAME>
+       <ISDEEMEDPOSITIVE>{is_positive}</ISDEEMEDPOSITIVE>
+       <AMOUNT>{amount}</AMOUNT>
+      </ALLLEDGERENTRIES.LIST>"""
+    all_tally_messages = []
+    remote_ids = app.journal_voucher_ids(df)
+    
+    mapping_dicts = {}
+    for col_name, mapping_df in journal_mappings.items():
+        mapping_dicts[col_name] = pd.Series(mapping_df['Mapped Ledger'].values, index=mapping_df['CSV Value']).to_dict()
+
+    tally_dates = app.get_tally_dates(df, date_format)
+
+    # Parse every amount column once into exact integer paise
+    amount_columns = {ledger['CSV Column Name'] for ledger in fixed_ledger_config}
+    amount_columns.update(dyn['CSV Column for Amount'] for dyn in dynamic_ledger_config)
+    amount_paise, amount_invalid = {}, {}
+    for col in amount_columns:
+        if col in df.columns:
+            amount_paise[col], _, amount_invalid[col] = app.parse_amounts(df[col])
+
+    for index, row in df.iterrows():
+        try:
+            tally_date = tally_dates.at[index]
+            if pd.isna(tally_date):
+                raise ValueError(f"unreadable date '{row['Date']}'")
+            # Store tuples of (xml_string, transaction_type) for sorting
+            ledger_entries_list = []
+
+            # Handle voucher number - replace NaN with empty string
+            voucher_number = str(row['Voucher Number']) if pd.notna(row['Voucher Number']) else ""
+
+            for ledger in fixed_ledger_config:
+                amount_col = ledger['CSV Column Name']
+                if amount_col in row and pd.notna(row[amount_col]):
+                    if amount_invalid[amount_col].at[index]:
+                        raise ValueError(f"invalid amount '{row[amount_col]}' in column '{amount_col}'")
+                    amount_val = amount_paise[amount_col].at[index]
+                    if amount_val == 0: continue
+                    is_positive_flag = "No" if ledger['Type (Debit/Credit)'] == 'Credit' else "Yes"
+                    amount_for_xml = app.format_paise(amount_val if ledger['Type (Debit/Credit)'] == 'Credit' else -amount_val)
+                    # XML escape ledger name
+                    ledger_name_safe = escape(str(ledger['Tally Ledger Name']))
+                    ledger_xml = ledger_line_template.format(
+                        ledger_name=ledger_name_safe,
+                        is_positive=is_positive_flag,
+                        amount=amount_for_xml
+                    )
+                    # Store as tuple (xml, type) for sorting
+                    ledger_entries_list.append((ledger_xml, ledger['Type (Debit/Credit)']))
+
+            for dyn_ledger in dynamic_ledger_config:
+                name_col = dyn_ledger['CSV Column for Ledger Name']
+                amount_col = dyn_ledger['CSV Column for Amount']
+                trans_type = dyn_ledger['Transaction Type']
+
+                # Check if columns exist in the row
+                if name_col not in row.index or amount_col not in row.index:
+                    continue
+
+                csv_value_as_ledger = row[name_col]
+
+                # Skip if amount column has NaN or invalid value
+                if pd.isna(row[amount_col]):
+                    continue
+
+                if amount_invalid[amount_col].at[index]:
+                    raise ValueError(f"invalid amount '{row[amount_col]}' in column '{amount_col}'")
+                amount_from_col = amount_paise[amount_col].at[index]
+
+                if pd.notna(csv_value_as_ledger) and str(csv_value_as_ledger).strip() != "" and amount_from_col != 0:
+
+                    current_map = mapping_dicts.get(name_col, {})
+                    # Convert to string to ensure hashable type for dictionary lookup
+                    csv_value_str = str(csv_value_as_ledger)
+                    final_ledger_name = current_map.get(csv_value_str, csv_value_str)
+
+                    is_positive_flag = "No" if trans_type == 'Credit' else "Yes"
+                    amount_for_xml = app.format_paise(amount_from_col if trans_type == 'Credit' else -amount_from_col)
+
+                    # XML escape ledger name
+                    ledger_name_safe = escape(str(final_ledger_name))
+
+                    ledger_xml = ledger_line_template.format(
+                        ledger_name=ledger_name_safe,
+                        is_positive=is_positive_flag,
+                        amount=amount_for_xml
+                    )
+                    # Store as tuple (xml, type) for sorting
+                    ledger_entries_list.append((ledger_xml, trans_type))
+
+            if ledger_entries_list:
+                # Sort entries: Debit first (priority 0), Credit second (priority 1)
+                ledger_entries_list.sort(key=lambda x: 0 if x[1] == 'Debit' else 1)
+                # Extract only the XML strings
+                sorted_ledger_xmls = [entry[0] for entry in ledger_entries_list]
+                final_ledger_entries = "\n".join(sorted_ledger_xmls)
+                # Safely get narration with proper type checking and XML escaping
+                narration_raw = row.get('Narration', 'N/A')
+                narration_safe = escape(str(narration_raw)) if pd.notna(narration_raw) else "N/A"
+
+                all_tally_messages.append(tally_message_template.format(
+                    voucher_type=voucher_type,
+                    remote_id=remote_ids.at[index],
+                    date=tally_date,
+                    voucher_number=voucher_number,
+                    narration=narration_safe,
+                    ledger_entries=final_ledger_entries
+                ))
+        except Exception as e:
+            app.st.error(f"Error processing row {index} ('{row.get('Narration', 'N/A')}'): {e}. Skipping row.")
+
+    # XML escape company name before inserting into template
+    company_name_safe = escape(str(company_name))
+
+    return xml_template.format(
+        company_name=company_name_safe,
+        tally_messages="\n".join(all_tally_messages)
+    )
+
+
+def _journal():
+    return pd.DataFrame({
+        "Date": ["01-04-2024", "02-04-2024", "bad", "04-04-2024", "05-04-2024", "06-04-2024", "07-04-2024"],
+        "Voucher Number": ["JV-1", None, "JV-3", 4, "JV-5", "JV-6", "JV-7"],
+        "Narration": ["April 'salary'", None, "Bad date", "Zero row", "Bad amount", "Unmapped", "Cost centre"],
+        "Gross": ["1,00,000", "50000", "10", "0", "abc", "100.255", None],
+        "TDS": ["10,000", "0", "0", "0", "0", "5", "0"],
+        "Bonus": ["", "(500)", "0", "0", "0", "0", "1"],
+        "Employee": ["Asha", "Ravi", "Asha", "Asha", "Asha", "Meera & Co", "  "],
+        "Net": ["90,000", "50000", "10", "0", "x", "95", "7"],
+        "Cost Centre": ["Ops", None, "Ops", "Ops", "Ops", "Sales", "Ops"],
+    }, index=[10, 11, 12, 13, 14, 15, 16])
+
+
+def test_vectorized_journal_xml_matches_row_wise_builder(monkeypatch):
+    errors = []
+    monkeypatch.setattr(app.st, "error", errors.append)
+    df = _journal()
+    args = (FIXED, DYNAMIC, "Demo & Co", "Journal", MAPPINGS)
+    expected = _reference_journal_xml(df, *args)
+    expected_errors, errors[:] = errors[:], []
+    assert app.create_tally_xml(df, *args) == expected
+    assert expected.count("<VOUCHER ") == 4
+    assert errors == expected_errors and len(errors) == 2
+
+    assert app.create_tally_xml(df, FIXED, DYNAMIC, "Demo", "Journal", {}) == _reference_journal_xml(
+        df, FIXED, DYNAMIC, "Demo", "Journal", {})
+    no_narration = df.drop(columns="Narration")
+    assert app.create_tally_xml(no_narration, FIXED, [], "Demo", "Journal", {}) == _reference_journal_xml(
+        no_narration, FIXED, [], "Demo", "Journal", {})
@@ -0,0 +1,91 @@
+import app
+
+
+class _CountingNormalizer:
+    def __init__(self):
+        self.calls = 0
+        self._mapper = app.EnhancedLedgerMapper()
+
+    def __call__(self, name):
+        self.calls += 1
+        return self._mapper.preprocess_narration(name)
+
+
+def test_sync_only_indexes_added_ledgers():
+    normalize = _CountingNormalizer()
+    catalog = app.LedgerCatalog(normalize)
+    ledgers = [f"Vendor {chr(65 + i % 26)}{i // 26} Supplies" for i in range(1000)]
+    catalog.sync(ledgers)
+    version = catalog.version
+    normalize.calls = 0
+
+    changed = catalog.sync(ledgers + ["Fuel Expense", "Office Rent", "Acme Traders"])
+
+    assert changed
+    assert normalize.calls == 3
+    assert catalog.version > version
+    assert len(catalog) == 1003
+    assert catalog.substring_matches("PAID ACME TRADERS FOR GOODS") == [catalog.name_to_id["Acme Traders"]]
+
+
+def test_rename_and_delete_update_indexes_in_place():
+    catalog = app.LedgerCatalog(app.EnhancedLedgerMapper().preprocess_narration)
+    catalog.sync(["Fuel Expense", "Office Rent"])
+    rent_id = catalog.name_to_id["Office Rent"]
+    version = catalog.version
+
+    assert catalog.rename("Office Rent", "Warehouse Lease")
+    assert catalog.name_to_id["Warehouse Lease"] == rent_id
+    assert rent_id in catalog.keyword_index["warehouse"]
+    assert rent_id not in catalog.keyword_index.get("office", set())
+
+    fuel_id = catalog.name_to_id["Fuel Expense"]
+    assert catalog.delete("Fuel Expense")
+    assert fuel_id not in catalog.keyword_index["petrol"]
+    assert catalog.ordered_ids == [rent_id]
+    assert catalog.version == version + 2
+    assert not catalog.sync(["Warehouse Lease"])
+
+
+def test_near_duplicate_ledgers_share_a_cluster():
+    catalog = app.LedgerCatalog(app.EnhancedLedgerMapper().preprocess_narration)
+    catalog.sync(["ABC Ltd (Old)", "ABC Limited", "ABC Ltd", "XYZ Traders"])
+
+    assert catalog.duplicate_clusters() == [["ABC Limited", "ABC Ltd", "ABC Ltd (Old)"]]
+    clusters = catalog.cluster_candidates(catalog.ordered_ids)
+    assert [catalog.entries[rep_id].name for rep_id, _ in clusters] == ["ABC Limited", "XYZ Traders"]
+
+
+def test_focus_match_expands_winning_cluster():
+    mapper = app.EnhancedLedgerMapper()
+    ledgers = ["ABC Ltd (Old)", "ABC Limited", "Rent Expense"]
+
+    assert mapper.ledger_name_focus_match("ABC LIMITED INVOICE 42", ledgers)[0] == "ABC Limited"
+    assert mapper.ledger_name_focus_match("RENT FOR OFFICE", ledgers)[0] == "Rent Expense"
+
+
+def test_substring_matches_inside_longer_words():
+    catalog = app.LedgerCatalog(app.EnhancedLedgerMapper().preprocess_narration)
+    catalog.sync(["Amazon", "Office Rent", "GST", "TA"])
+    clean = catalog.normalize("AMAZONPAY ORDER 123 GSTIN DATA")
+
+    assert catalog.substring_matches(clean) == [catalog.name_to_id[name] for name in ["Amazon", "GST", "TA"]]
+
+    catalog.rename("Amazon", "Flipkart")
+    assert catalog.substring_matches(clean) == [catalog.name_to_id[name] for name in ["GST", "TA"]]
+
+
+def test_mapper_catalog_follows_in_place_renames_and_group_changes():
+    mapper = app.EnhancedLedgerMapper()
+    ledgers = ["Fuel Expense", "Office Rent"]
+    groups = {"Fuel Expense": "Indirect Expenses", "Office Rent": "Indirect Expenses"}
+    catalog = mapper.ensure_catalog(ledgers, groups)
+
+    ledgers[1] = "Warehouse Lease"
+    groups["Fuel Expense"] = "Sundry Creditors"
+    # Per-narration calls trust the lists they were given; batch entry points re-check content
+    assert "Warehouse Lease" not in mapper.ensure_catalog(ledgers, groups, check_content=False).name_to_id
+    mapper.ensure_catalog(ledgers, groups)
+
+    assert "Warehouse Lease" in catalog.name_to_id and "Office Rent" not in catalog.name_to_id
+    assert catalog.entry("Fuel Expense").group_key == app.get_group_key("Sundry Creditors")
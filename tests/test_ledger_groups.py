@@ -0,0 +1,35 @@
+import pandas as pd
+
+import app
+
+LEDGER_MASTER = ["Acme Traders", "Rent Expense", "Sales Account", "Office Misc"]
+LEDGER_GROUPS = {
+    "Acme Traders": "Sundry Debtors",
+    "Rent Expense": "Indirect Expenses",
+    "Sales Account": "Sales Accounts",
+    "Office Misc": "Office Overheads",
+}
+
+
+def test_candidates_pruned_by_direction_keep_custom_groups():
+    mapper = app.EnhancedLedgerMapper()
+
+    receipts = mapper.candidate_ledgers(LEDGER_MASTER, "Receipt", LEDGER_GROUPS)
+    payments = mapper.candidate_ledgers(LEDGER_MASTER, "Payment", LEDGER_GROUPS)
+
+    assert receipts == ["Acme Traders", "Sales Account", "Office Misc"]
+    assert payments == ["Rent Expense", "Office Misc"]
+    assert mapper.candidate_ledgers(LEDGER_MASTER, None, LEDGER_GROUPS) is LEDGER_MASTER
+
+
+def test_custom_policy_and_narration_directions():
+    mapper = app.EnhancedLedgerMapper()
+    policy = {"Receipt": ["Sundry Debtors"]}
+    df = pd.DataFrame({
+        "Narration": ["rent", "acme", "acme", "mixed", "mixed"],
+        "Debit": [100, 0, 0, 10, 0],
+        "Credit": [0, 50, 70, 0, 10],
+    })
+
+    assert mapper.candidate_ledgers(LEDGER_MASTER, "Receipt", LEDGER_GROUPS, policy) == ["Acme Traders", "Office Misc"]
+    assert app.get_narration_directions(df) == {"rent": "Payment", "acme": "Receipt", "mixed": None}
@@ -0,0 +1,78 @@
+import app
+
+
+def test_upi_narration_extracts_reference_name_and_vpa():
+    parsed = app.parse_payment_narration("UPI/312345678901/Rajesh Kumar/rajesh.k@okaxis/Payment from PhonePe")
+
+    assert parsed["rail"] == "UPI"
+    assert parsed["reference"] == "312345678901"
+    assert parsed["name"] == "RAJESH KUMAR"
+    assert parsed["vpa"] == "rajesh.k@okaxis"
+
+
+def test_neft_and_imps_narrations():
+    neft = app.parse_payment_narration("NEFT-HDFCN52024011512345-ACME TRADERS PVT LTD-0001-ICIC0000123")
+    imps = app.parse_payment_narration("IMPS/P2A/412345678901/M/S Shree Ganesh/SBIN/XXXXXX4321/rent")
+
+    assert neft["rail"] == "NEFT"
+    assert neft["reference"] == "HDFCN52024011512345"
+    assert neft["name"] == "ACME TRADERS PVT LTD"
+    assert neft["ifsc"] == "ICIC0000123"
+    assert imps["rail"] == "IMPS"
+    assert imps["name"] == "SHREE GANESH"
+    assert imps["account_tail"] == "4321"
+
+
+def test_cheque_narration_and_unrecognised_text():
+    cheque = app.parse_payment_narration("CHQ NO 004512 PAID TO SHARMA ENTERPRISES")
+
+    assert cheque["rail"] == "CHEQUE"
+    assert cheque["reference"] == "004512"
+    assert cheque["name"] == "SHARMA ENTERPRISES"
+    assert app.parse_payment_narration("Office rent for April") is None
+
+
+def test_learned_counterparty_matches_new_reference_numbers():
+    learned = {
+        "UPI/312345678901/Rajesh Kumar/rajesh.k@okaxis/rent": {"ledger": "Rent A/c", "score": 90, "count": 2},
+    }
+    mapper = app.EnhancedLedgerMapper()
+
+    ledger = mapper.counterparty_learned_match("UPI/998877665544/RAJESH KUMAR/rajesh.k@okaxis/May rent", learned)
+
+    assert ledger == "Rent A/c"
+    assert mapper.counterparty_learned_match("UPI/998877665544/Someone Else/other@ybl/x", learned) is None
+
+
+def test_counterparty_index_follows_in_place_count_changes():
+    learned = {
+        "UPI/312345678901/Rajesh Kumar/rajesh.k@okaxis/rent": {"ledger": "Rent A/c", "score": 90, "count": 2},
+        "UPI/312345678902/Rajesh Kumar/rajesh.k@okaxis/fees": {"ledger": "Consultancy", "score": 90, "count": 1},
+    }
+    mapper = app.EnhancedLedgerMapper()
+    narration = "UPI/998877665544/RAJESH KUMAR/rajesh.k@okaxis/June"
+    assert mapper.counterparty_learned_match(narration, learned) == "Rent A/c"
+
+    for _ in range(2):
+        learned["UPI/312345678902/Rajesh Kumar/rajesh.k@okaxis/fees"]["count"] += 1
+        mapper.record_learned_mapping(learned, "UPI/312345678902/Rajesh Kumar/rajesh.k@okaxis/fees")
+
+    assert mapper.counterparty_learned_match(narration, learned) == "Consultancy"
+
+
+def test_rail_narrations_keep_keyword_based_name_detection():
+    mapper = app.EnhancedLedgerMapper()
+    assert mapper.identify_person_or_company_name("UPI/312345678901/Rajesh Kumar/rajesh.k@okaxis/rent")[1] is False
+
+
+def test_imps_remark_before_payee_and_cheque_deposit_abbreviations():
+    mmt = app.parse_payment_narration("MMT/IMPS/412345678901/Rent April/JOHN DOE/SBIN0000123")
+    cheque = app.parse_payment_narration("CHQ DEP 123456 ABC ENTERPRISES")
+
+    assert mmt["rail"] == "IMPS" and mmt["name"] == "JOHN DOE" and mmt["ifsc"] == "SBIN0000123"
+    assert cheque["name"] == "ABC ENTERPRISES" and cheque["reference"] == "123456"
+
+    learned = {"MMT/IMPS/412345678901/Rent April/JOHN DOE/SBIN0000123": {"ledger": "John Doe", "score": 90, "count": 1}}
+    mapper = app.EnhancedLedgerMapper()
+    other_payee = "MMT/IMPS/412345678902/Rent April/JANE ROE/HDFC0000456"
+    assert mapper.counterparty_learned_match(other_payee, learned) is None
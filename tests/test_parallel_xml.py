@@ -0,0 +1,91 @@
+import app
+
+pd = app.pd
+
+FIXED = [
+    {"Tally Ledger Name": "Salary", "CSV Column Name": "Gross", "Type (Debit/Credit)": "Debit"},
+    {"Tally Ledger Name": "TDS Payable", "CSV Column Name": "TDS", "Type (Debit/Credit)": "Credit"},
+]
+DYNAMIC = [{"CSV Column for Ledger Name": "Employee", "CSV Column for Amount": "Net", "Transaction Type": "Credit"}]
+MAPPINGS = {"Employee": pd.DataFrame({"CSV Value": ["E1"], "Mapped Ledger": ["Employee One"]})}
+
+
+def _render(stream, monkeypatch):
+    errors = []
+    monkeypatch.setattr(app.st, "error", errors.append)
+    return stream.getvalue(), stream.voucher_count, errors
+
+
+def test_parallel_bank_xml_matches_serial(monkeypatch):
+    n = 53
+    df = pd.DataFrame({
+        "Date": ["bad" if i % 17 == 5 else f"{i % 28 + 1:02d}-04-2024" for i in range(n)],
+        "Narration": [f"Txn <{i}>" for i in range(n)],
+        "Debit": [str(i) if i % 3 else "0" for i in range(n)],
+        "Credit": ["0" if i % 3 else f"{i}.5" for i in range(n)],
+        "Mapped Ledger": "Suspense",
+    }, index=range(100, 100 + n))
+
+    serial = _render(app.stream_bank_tally_xml(df, "HDFC", "Demo", chunk_rows=7, parallel=False), monkeypatch)
+    parallel = _render(app.stream_bank_tally_xml(df, "HDFC", "Demo", chunk_rows=7, parallel=True), monkeypatch)
+    assert parallel == serial
+    assert serial[1] == n - 3 and len(serial[2]) == 3
+    assert serial[2][0].startswith("Error processing row 105 ")
+
+
+def test_parallel_journal_xml_matches_serial(monkeypatch):
+    n = 40
+    df = pd.DataFrame({
+        "Date": [f"{i % 28 + 1:02d}-05-2024" for i in range(n)],
+        "Voucher Number": [f"PR-{i}" for i in range(n)],
+        "Narration": [f"Payroll {i}" for i in range(n)],
+        "Gross": ["abc" if i % 13 == 4 else str(1000 + i) for i in range(n)],
+        "TDS": [str(i) for i in range(n)],
+        "Employee": [f"E{i % 3}" for i in range(n)],
+        "Net": [str(1000) for i in range(n)],
+    })
+    args = (df, FIXED, DYNAMIC, "Demo", "Journal", MAPPINGS)
+
+    serial = _render(app.stream_tally_xml(*args, chunk_rows=6, parallel=False), monkeypatch)
+    parallel = _render(app.stream_tally_xml(*args, chunk_rows=6, parallel=True), monkeypatch)
+    assert parallel == serial
+    assert len(serial[2]) == 3 and serial[1] == n - 3
+
+
+def test_pool_is_opt_in_above_the_row_threshold_and_needs_fork(monkeypatch):
+    df = pd.DataFrame({"Date": ["01-04-2024"] * 10})
+    monkeypatch.setattr(app, "XML_PARALLEL_WORKERS", 4)
+    monkeypatch.setattr(app, "XML_PARALLEL_MIN_ROWS", 10)
+    monkeypatch.setattr(app, "fork_is_default_start_method", lambda: True)
+    assert not app.use_parallel_xml(df)
+    monkeypatch.setattr(app, "XML_PARALLEL_ENABLED", True)
+    assert app.use_parallel_xml(df)
+    monkeypatch.setattr(app, "XML_PARALLEL_MIN_ROWS", 11)
+    assert not app.use_parallel_xml(df)
+    assert not app.use_parallel_xml(df, parallel=False)
+
+    monkeypatch.setattr(app, "fork_is_default_start_method", lambda: False)
+    monkeypatch.setattr(app, "XML_PARALLEL_MIN_ROWS", 10)
+    assert not app.use_parallel_xml(df)
+    assert not app.use_parallel_xml(df, parallel=True)
+
+
+def test_busy_pool_slots_fall_back_to_serial(monkeypatch):
+    df = pd.DataFrame({
+        "Date": [f"{i % 28 + 1:02d}-04-2024" for i in range(20)],
+        "Narration": [f"Txn {i}" for i in range(20)],
+        "Debit": [str(i + 1) for i in range(20)],
+        "Credit": ["0"] * 20,
+        "Mapped Ledger": "Suspense",
+    })
+    serial = _render(app.stream_bank_tally_xml(df, "HDFC", "Demo", chunk_rows=6, parallel=False), monkeypatch)
+
+    slots = app.threading.BoundedSemaphore(1)
+    monkeypatch.setattr(app, "_xml_pool_slots", slots)
+    monkeypatch.setattr(app, "ProcessPoolExecutor", None)  # any pool use would fail
+    assert slots.acquire(blocking=False)
+    try:
+        busy = _render(app.stream_bank_tally_xml(df, "HDFC", "Demo", chunk_rows=6, parallel=True), monkeypatch)
+    finally:
+        slots.release()
+    assert busy == serial
@@ -0,0 +1,69 @@
+import app
+
+pd = app.pd
+
+FIXED = [
+    {"Tally Ledger Name": "Salary & Wages", "CSV Column Name": "Gross", "Type (Debit/Credit)": "Debit"},
+    {"Tally Ledger Name": "TDS Payable", "CSV Column Name": "TDS", "Type (Debit/Credit)": "Credit"},
+]
+DYNAMIC = [{"CSV Column for Ledger Name": "Employee", "CSV Column for Amount": "Net", "Transaction Type": "Credit"}]
+MAPPINGS = {"Employee": pd.DataFrame({"CSV Value": ["Asha"], "Mapped Ledger": ["Asha <Payable>"]})}
+
+
+def _issues(issues):
+    return sorted(zip(issues["Row"], issues["Severity"], issues["Check"]))
+
+
+def test_journal_checks_balance_ledgers_dates_and_voucher_numbers():
+    df = pd.DataFrame({
+        "Date": ["01-04-2024", "02-04-2024", "bad", "04-03-2024", "05-04-2024", "06-04-2024"],
+        "Voucher Number": ["JV-1", "JV-2", "JV-3", "JV-4", "JV-1", "JV-6"],
+        "Narration": ["ok", "unbalanced", "bad date", "last year", "zero", "bad amount"],
+        "Gross": ["1,000", "1000", "10", "100", "0", "abc"],
+        "TDS": ["100", "0", "1", "10", "0", "0"],
+        "Employee": ["Asha", "Ravi", "Asha", "Asha", "Asha", "Asha"],
+        "Net": ["900", "900", "9", "90", "0", "0"],
+    }, index=[10, 11, 12, 13, 14, 15])
+    known = {"Salary & Wages", "TDS Payable", "Asha <Payable>"}
+
+    issues = app.validate_journal_vouchers(df, FIXED, DYNAMIC, MAPPINGS, known_ledgers=known,
+                                           period=("20240401", "20250331"))
+    assert _issues(issues) == sorted([
+        (11, "Error", "Balance"), (11, "Error", "Ledger"),
+        (12, "Error", "Date"),
+        (13, "Error", "Date"),
+        (14, "Warning", "Amount"),
+        (10, "Warning", "Voucher Number"), (14, "Warning", "Voucher Number"),
+        (15, "Error", "Amount"),
+    ])
+    assert "ledger 'Ravi' is not in the Tally company" in issues["Detail"].tolist()
+    assert "debits 1000.00 do not equal credits 900.00" in issues["Detail"].tolist()
+    assert sorted(app.rows_with_errors(issues)) == [11, 12, 13, 15]
+
+    # Without synced ledgers or a period only the data itself is checked
+    assert (11, "Error", "Ledger") not in _issues(app.validate_journal_vouchers(df, FIXED, DYNAMIC, MAPPINGS))
+
+
+def test_bank_checks_ledgers_amounts_and_duplicates():
+    df = pd.DataFrame({
+        "Date": ["01-04-2024", "02-04-2024", "02-04-2024", "03-04-2024", "04-04-2024"],
+        "Narration": ["Rent", "UPI/ACME", "UPI/ACME", "Nothing", "Odd"],
+        "Debit": ["500", "20", "20", "0", "x"],
+        "Credit": ["0", "0", "0", "0", "10"],
+        "Mapped Ledger": ["Rent", "Vendor & Co", "Vendor & Co", "Rent", "Rent"],
+    })
+
+    issues = app.validate_bank_vouchers(df, "HDFC Bank", known_ledgers={"HDFC Bank", "Rent"})
+    assert _issues(issues) == sorted([
+        (1, "Error", "Ledger"), (2, "Error", "Ledger"),
+        (1, "Warning", "Duplicate"), (2, "Warning", "Duplicate"),
+        (3, "Warning", "Amount"),
+        (4, "Error", "Amount"),
+    ])
+    assert "ledger 'Vendor & Co' is not in the Tally company" in issues["Detail"].tolist()
+    assert app.validate_bank_vouchers(df.iloc[:1], "HDFC Bank", known_ledgers={"HDFC Bank", "Rent"}).empty
+
+
+def test_financial_year_period():
+    assert app.financial_year_period("20240401") == ("20240401", "20250331")
+    assert app.financial_year_period("20250331") == ("20240401", "20250331")
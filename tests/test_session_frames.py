@@ -0,0 +1,63 @@
+import os
+
+import pandas as pd
+
+import app
+
+
+def _frame(rows, start=0):
+    return pd.DataFrame({'Amount': range(start, start + rows), 'Narration': [f"row {i}" for i in range(rows)]})
+
+
+def test_cold_frames_spill_to_disk_and_reload(tmp_path):
+    first, second = _frame(1000), _frame(1000, start=5000)
+    budget = app.SessionFrameStore._frame_bytes(first) + 10
+    store = app.SessionFrameStore(root=str(tmp_path), budget_bytes=budget)
+
+    store.put(("s1", "first"), first)
+    assert store.get(("s1", "first")) is first  # a view, not a copy
+    store.put(("s1", "second"), second)
+
+    assert ("s1", "first") not in store.hot
+    assert os.path.exists(tmp_path / "s1" / "first.parquet")
+    assert store.hot_bytes <= budget
+
+    reloaded = store.get(("s1", "first"))
+    pd.testing.assert_frame_equal(reloaded, first, check_dtype=False)
+    # Reloading made the second frame the coldest; it had never been written, so it spilled
+    assert os.path.exists(tmp_path / "s1" / "second.parquet")
+
+
+def test_drop_session_removes_hot_and_spilled_frames(tmp_path):
+    store = app.SessionFrameStore(root=str(tmp_path), budget_bytes=1)
+    store.put(("s1", "a"), _frame(10))
+    store.put(("s1", "b"), _frame(10))
+    store.put(("s2", "a"), _frame(10))
+
+    store.drop_session("s1")
+
+    assert store.get(("s1", "a")) is None
+    assert store.get(("s1", "b")) is None
+    assert not os.path.exists(tmp_path / "s1")
+    assert store.get(("s2", "a")) is not None
+
+
+def test_frame_size_counts_object_column_contents():
+    narrow = pd.DataFrame({'Ledger': pd.Series(["x"] * 1000, dtype=object)})
+    wide = pd.DataFrame({'Ledger': pd.Series(["x" * 200] * 1000, dtype=object)})
+    assert app.SessionFrameStore._frame_bytes(wide) > app.SessionFrameStore._frame_bytes(narrow) + 100 * 1000
+
+
+def test_frames_are_measured_once_on_put_not_on_reload(tmp_path, monkeypatch):
+    measured = []
+    measure = app.SessionFrameStore._frame_bytes
+    monkeypatch.setattr(app.SessionFrameStore, "_frame_bytes", staticmethod(lambda df: measured.append(1) or measure(df)))
+    store = app.SessionFrameStore(root=str(tmp_path), budget_bytes=1)
+    store.put(("s1", "a"), _frame(100))
+    store.put(("s1", "b"), _frame(100))
+
+    for _ in range(3):
+        assert store.get(("s1", "a")) is not None
+        assert store.get(("s1", "b")) is not None
+    assert len(measured) == 2
+    assert store.hot_bytes == sum(entry[1] for entry in store.hot.values())
@@ -0,0 +1,62 @@
+import time
+
+import app
+
+CANDIDATES = ["localhost", "127.0.0.1", "host.docker.internal", "172.17.0.1"]
+
+
+def test_probe_runs_candidates_concurrently_and_keeps_preference(monkeypatch):
+    def _port_open(host, port, timeout):
+        time.sleep(0.05 if host == "172.17.0.1" else 0.3)
+        return host in {"host.docker.internal", "172.17.0.1"}
+
+    monkeypatch.setattr(app, "_tally_port_open", _port_open)
+    started = time.monotonic()
+    assert app.probe_tally_hosts(CANDIDATES, 9000, timeout=1) == "host.docker.internal"
+    assert time.monotonic() - started < 0.9
+    assert app.probe_tally_hosts([], 9000) is None
+
+
+class _Response:
+    status_code = 200
+
+
+def test_resolved_endpoint_is_cached_per_user_and_reprobed_on_failure(monkeypatch):
+    probes, posts, down = [], [], set()
+
+    def _probe(candidates, port, timeout=None):
+        probes.append(port)
+        return next(c for c in candidates if c not in down)
+
+    def _post(session, url, data, headers, timeout):
+        posts.append(url)
+        if any(f"//{host}:" in url for host in down):
+            raise app.requests.exceptions.ConnectionError(url)
+        return _Response()
+
+    monkeypatch.setattr(app, "get_tally_host_candidates", lambda host: list(CANDIDATES))
+    monkeypatch.setattr(app, "probe_tally_hosts", _probe)
+    monkeypatch.setattr(app.requests.Session, "post", _post)
+    monkeypatch.setattr(app, "get_tally_http_pool", lambda: app.TallyHttpPool())
+    endpoints = app.TallyEndpointCache(ttl=60)
+    monkeypatch.setattr(app, "get_tally_endpoint_cache", lambda: endpoints)
+
+    for _ in range(3):
+        _, candidate, _ = app.post_to_tally_with_fallback("localhost", 9000, "<X/>", timeout=5, user="a@x.com")
+        assert candidate == "localhost"
+    assert probes == [9000]
+
+    app.post_to_tally_with_fallback("localhost", 9000, "<X/>", timeout=5, user="b@x.com")
+    assert len(probes) == 2
+
+    down.add("localhost")
+    _, candidate, _ = app.post_to_tally_with_fallback("localhost", 9000, "<X/>", timeout=5, user="a@x.com")
+    assert candidate == "127.0.0.1" and len(probes) == 3
+    assert endpoints.get(("a@x.com", "localhost", 9000)) == "127.0.0.1"
+    assert posts[-2:] == ["http://localhost:9000", "http://127.0.0.1:9000"]
+
+
+def test_endpoint_cache_expires_entries():
+    endpoints = app.TallyEndpointCache(ttl=0)
+    endpoints.remember(("a@x.com", "localhost", 9000), "127.0.0.1")
+    assert endpoints.get(("a@x.com", "localhost", 9000)) is None
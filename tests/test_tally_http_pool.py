@@ -0,0 +1,48 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import app
+
+
+class _TallyHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    bodies = []
+
+    def do_POST(self):
+        self.bodies.append(self.rfile.read(int(self.headers["Content-Length"])))
+        body = b"<RESPONSE><CREATED>1</CREATED></RESPONSE>"
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def tally_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _TallyHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server.server_address[1]
+    server.shutdown()
+    server.server_close()
+
+
+def test_requests_reuse_one_keep_alive_connection(tally_server, monkeypatch):
+    pool = app.TallyHttpPool(pool_maxsize=2, connect_timeout=2)
+    monkeypatch.setattr(app, "get_tally_http_pool", lambda: pool)
+    _TallyHandler.bodies = []
+
+    for i in range(3):
+        response, candidate, _ = app.post_to_tally_with_fallback("127.0.0.1", tally_server, f"<V{i}/>", timeout=5)
+        assert response.status_code == 200 and candidate == "127.0.0.1"
+    success, _, count = app.push_vouchers_to_tally("<ENVELOPE><TALLYMESSAGE/></ENVELOPE>", "127.0.0.1", tally_server)
+
+    assert success and count == 1
+    assert _TallyHandler.bodies[:3] == [b"<V0/>", b"<V1/>", b"<V2/>"]
+    assert pool.stats() == {("127.0.0.1", tally_server): {"requests": 4, "connections": 1, "reused": 3}}
+    assert pool.session("127.0.0.1", str(tally_server)) is pool.session("127.0.0.1", tally_server)
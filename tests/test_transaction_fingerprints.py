@@ -0,0 +1,45 @@
+import app
+
+pd = app.pd
+
+
+def _statement(rows):
+    return pd.DataFrame(rows, columns=["Date", "Narration", "Debit", "Credit"])
+
+
+def test_fingerprints_ignore_narration_spacing_and_keep_repeats_distinct():
+    april = _statement([
+        ["01-04-2024", "UPI/ACME  stores", 10.0, 0.0],
+        ["01-04-2024", "UPI/ACME stores", 10.0, 0.0],
+        ["02-04-2024", "NEFT/SALARY", 0.0, 500.0],
+    ])
+    fingerprints = app.compute_transaction_fingerprints(april, "%d-%m-%Y")
+
+    assert fingerprints.nunique() == 3
+    overlap = _statement([["02-04-2024", "neft/salary", 0.0, 500.0]])
+    assert app.compute_transaction_fingerprints(overlap, "%d-%m-%Y").iloc[0] == fingerprints.iloc[2]
+
+
+def test_overlapping_upload_only_keeps_the_delta(app_db):
+    april = _statement([["14-04-2024", "UPI/ACME", 10.0, 0.0], ["15-04-2024", "NEFT/SALARY", 0.0, 500.0]])
+    april["Fingerprint"] = app.compute_transaction_fingerprints(april, "%d-%m-%Y")
+    app.record_processed_transactions("a@b.com", april, "HDFC Bank")
+
+    may = _statement([["15-04-2024", "NEFT/SALARY", 0.0, 500.0], ["16-04-2024", "UPI/ACME", 10.0, 0.0]])
+    may["Fingerprint"] = app.compute_transaction_fingerprints(may, "%d-%m-%Y")
+
+    assert app.find_processed_transactions("a@b.com", may, "HDFC Bank").tolist() == [True, False]
+    assert app.find_processed_transactions("a@b.com", may, "SBI Bank").tolist() == [False, False]
+    assert app.find_processed_transactions("x@y.com", may, "HDFC Bank").tolist() == [False, False]
+
+
+def test_overlapping_statements_in_one_batch_share_fingerprints():
+    march = _statement([["31-03-2024", "UPI/ACME", 10.0, 0.0], ["01-04-2024", "UPI/ACME", 10.0, 0.0]])
+    april = _statement([["01-04-2024", "UPI/ACME", 10.0, 0.0], ["02-04-2024", "NEFT/SALARY", 0.0, 500.0]])
+    march["Source File"], april["Source File"] = "march.csv", "april.csv"
+    batch = pd.concat([march, april], ignore_index=True)
+    batch["Fingerprint"] = app.compute_transaction_fingerprints(batch, "%d-%m-%Y")
+
+    assert batch["Fingerprint"].iloc[1] == batch["Fingerprint"].iloc[2]
+    assert batch["Fingerprint"].iloc[2] == app.compute_transaction_fingerprints(april, "%d-%m-%Y").iloc[0]
+    assert app.find_repeated_transactions(batch, "HDFC Bank").tolist() == [False, False, True, False]
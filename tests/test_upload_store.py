@@ -0,0 +1,72 @@
+import os
+
+import app
+
+
+def _frame(rows):
+    return app.pd.DataFrame({"Narration": [f"UPI/{i}" for i in range(rows)], "Debit": [float(i) for i in range(rows)]})
+
+
+def test_upload_store_round_trip_and_mixed_type_fallback(tmp_path):
+    store = app.UploadStore(root=str(tmp_path), max_bytes=10 * 1024 * 1024)
+    df = _frame(5)
+    store.put("abc.bank", df)
+    assert os.path.exists(tmp_path / "abc.bank.parquet")
+    assert store.get("abc.bank").equals(df)
+
+    mixed = app.pd.DataFrame({"Debit": [1.5, "12,000.00 Dr", None]}, dtype=object)
+    store.put("mixed.raw", mixed)
+    assert os.path.exists(tmp_path / "mixed.raw.pkl")
+    assert store.get("mixed.raw")["Debit"].tolist()[:2] == [1.5, "12,000.00 Dr"]
+    assert store.get("missing.raw") is None
+
+
+def test_upload_store_evicts_least_recently_used(tmp_path):
+    store = app.UploadStore(root=str(tmp_path), max_bytes=10 * 1024 * 1024)
+    for i, key in enumerate(["old", "used", "new"]):
+        store.put(key, _frame(2000))
+        os.utime(tmp_path / f"{key}.parquet", (1000 + i, 1000 + i))
+    os.utime(tmp_path / "used.parquet", (2000, 2000))
+
+    store.max_bytes = os.path.getsize(tmp_path / "new.parquet") * 2
+    store.evict()
+
+    assert sorted(os.listdir(tmp_path)) == ["new.parquet", "used.parquet"]
+
+
+def test_large_uploads_are_spooled_hashed_and_cleaned_up(tmp_path, monkeypatch):
+    csv = b"Date,Narration,Debit,Credit\n" + b"".join(b"01-04-2024,UPI/%d,10,0\n" % i for i in range(500))
+    monkeypatch.setattr(app, "LARGE_UPLOAD_THRESHOLD_BYTES", 1024)
+    monkeypatch.setattr(app, "UPLOAD_SPOOL_DIR", str(tmp_path / "spool"))
+    os.makedirs(tmp_path / "spool")
+
+    spooled = app.spool_upload(app.UploadedMember("big.csv", csv), "big.csv", chunk_bytes=100)
+    assert spooled.digest == app.hashlib.sha256(csv).hexdigest() and spooled.size == len(csv)
+    assert len(app.load_uploaded_file(app.upload_source(spooled), spooled.name)) == 500
+    spooled.discard()
+
+    buffer = app.io.BytesIO()
+    with app.zipfile.ZipFile(buffer, "w", app.zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("big.csv", csv)
+    sources = app.expand_upload_batch([app.UploadedMember("batch.zip", buffer.getvalue()),
+                                       app.UploadedMember("direct.csv", csv)])
+    assert isinstance(sources[0], app.ZipMemberSource)
+
+    results = app.load_bank_statement_batch(sources)
+    assert [(name, len(df), error) for name, df, _, error in results] == [
+        ("batch.zip/big.csv", 500, None), ("direct.csv", 500, None)]
+    assert os.listdir(tmp_path / "spool") == []
+    # A second load is served from the store without extracting the zip member again
+    monkeypatch.setattr(app.ZipMemberSource, "spool", lambda self: (_ for _ in ()).throw(AssertionError))
+    assert len(app.load_bank_statement_batch(sources)[0][1]) == 500
+
+
+def test_parser_version_is_part_of_the_store_key(upload_store, monkeypatch):
+    csv = b"Date,Narration,Debit,Credit\n01-04-2024,UPI/ACME,100,0\n"
+
+    app.load_bank_statement_batch([app.UploadedMember("april.csv", csv)])
+    monkeypatch.setattr(app, "UPLOAD_PARSER_VERSION", app.UPLOAD_PARSER_VERSION + 1)
+    [(name, df, _, error)] = app.load_bank_statement_batch([app.UploadedMember("april.csv", csv)])
+
+    assert error is None and len(df) == 1
+    assert len(os.listdir(upload_store.root)) == 2
@@ -0,0 +1,97 @@
+import re
+
+import app
+
+pd = app.pd
+
+FIXED = [
+    {"Tally Ledger Name": "Salary", "CSV Column Name": "Gross", "Type (Debit/Credit)": "Debit"},
+    {"Tally Ledger Name": "Payable", "CSV Column Name": "Gross", "Type (Debit/Credit)": "Credit"},
+]
+
+
+def _remote_ids(xml):
+    ids = re.findall(r'<VOUCHER REMOTEID="([^"]+)"', xml)
+    assert ids == re.findall(r"<GUID>([^<]+)</GUID>", xml)
+    return ids
+
+
+def _statement():
+    return pd.DataFrame({
+        "Date": ["01-04-2024", "01-04-2024", "02-04-2024", "03-04-2024"],
+        "Narration": ["UPI/ACME", "UPI/ACME", "Salary", "Rent"],
+        "Debit": ["100", "100", "0", "500"],
+        "Credit": ["0", "0", "2000", "0"],
+        "Mapped Ledger": ["Vendor", "Vendor", "Income", "Rent"],
+    })
+
+
+def test_bank_ids_are_stable_across_runs_chunks_and_mapping_edits():
+    df = _statement()
+    ids = _remote_ids(app.create_bank_tally_xml(df, "HDFC Bank", "Demo"))
+    assert len(ids) == 4 and len(set(ids)) == 4  # identical rows still get their own id
+    assert all(re.fullmatch(r"X2T-[0-9a-f]{32}", value) for value in ids)
+
+    chunked = app.stream_bank_tally_xml(df, "HDFC Bank", "Demo", chunk_rows=1).getvalue()
+    assert _remote_ids(chunked) == ids
+    remapped = df.assign(**{"Mapped Ledger": "Suspense"})
+    assert _remote_ids(app.create_bank_tally_xml(remapped, "HDFC Bank", "Demo")) == ids
+
+    # Fingerprints from upload time are used when present; another bank account gets other ids
+    with_fingerprints = df.assign(Fingerprint=app.compute_transaction_fingerprints(df))
+    assert _remote_ids(app.create_bank_tally_xml(with_fingerprints, "HDFC Bank", "Demo")) == ids
+    assert set(_remote_ids(app.create_bank_tally_xml(df, "SBI Bank", "Demo"))).isdisjoint(ids)
+    assert _remote_ids(app.create_bank_tally_xml(df.iloc[2:], "HDFC Bank", "Demo")) == ids[2:]
+
+
+def test_journal_ids_follow_row_content_not_mappings():
+    df = pd.DataFrame({"Date": ["01-04-2024", "02-04-2024"], "Voucher Number": ["JV-1", "JV-2"],
+                       "Narration": ["April", "May"], "Gross": ["100", "200"]})
+    ids = _remote_ids(app.create_tally_xml(df, FIXED, [], "Demo", "Journal", {}))
+    assert len(set(ids)) == 2
+    assert _remote_ids(app.stream_tally_xml(df, FIXED, [], "Demo", "Journal", {}, chunk_rows=1).getvalue()) == ids
+    edited = df.assign(Gross=["100", "250"])
+    assert _remote_ids(app.create_tally_xml(edited, FIXED, [], "Demo", "Journal", {}))[0] == ids[0]
+    assert _remote_ids(app.create_tally_xml(edited, FIXED, [], "Demo", "Journal", {}))[1] != ids[1]
+
+
+def test_remote_id_digest_uses_all_128_bits():
+    ids = app.voucher_remote_ids(pd.DataFrame({"ledger": ["HDFC"] * 3, "number": [1, 2, 1]}))
+    assert len(set(ids)) == 3
+    assert all(value[4:20] != value[20:] for value in ids)
+
+
+def test_journal_ids_from_the_full_upload_survive_dropped_rows():
+    df = pd.DataFrame({"Date": ["01-04-2024"] * 3, "Voucher Number": ["JV-1"] * 3,
+                       "Narration": ["April"] * 3, "Gross": ["100"] * 3})
+    df[app.VOUCHER_ID_COLUMN] = app.journal_voucher_ids(df)
+    ids = _remote_ids(app.create_tally_xml(df, FIXED, [], "Demo", "Journal", {}))
+    assert ids == df[app.VOUCHER_ID_COLUMN].tolist() and len(set(ids)) == 3
+    assert _remote_ids(app.create_tally_xml(df.iloc[1:], FIXED, [], "Demo", "Journal", {})) == ids[1:]
+
+
+def test_timed_out_push_is_resent_and_altered_vouchers_count(monkeypatch):
+    attempts = []
+
+    class _Response:
+        status_code = 200
+        text = "<RESPONSE><CREATED>1</CREATED><ALTERED>3</ALTERED></RESPONSE>"
+
+    def _post(session, url, data, headers, timeout):
+        attempts.append(data.read())
+        if len(attempts) == 1:
+            raise app.requests.exceptions.Timeout()
+        return _Response()
+
+    monkeypatch.setattr(app.requests.Session, "post", _post)
+    xml_file = app.stream_bank_tally_xml(_statement(), "HDFC Bank", "Demo").to_file()
+    success, message, count = app.push_vouchers_to_tally(xml_file, "tally.local", 9000, voucher_count=4)
+    assert success and count == 4 and "3 already in Tally were updated" in message
+    assert len(attempts) == 2 and attempts[0] == attempts[1]
+
+    def _timeout(session, url, data, headers, timeout):
+        raise app.requests.exceptions.Timeout()
+
+    monkeypatch.setattr(app.requests.Session, "post", _timeout)
+    success, message, _ = app.push_vouchers_to_tally("<ENVELOPE/>", "tally.local", 9000, voucher_count=1, retries=0)
+    assert not success and "timed out" in message
@@ -0,0 +1,75 @@
+import io
+import json
+import xml.etree.ElementTree as ET
+import zipfile
+
+import app
+
+pd = app.pd
+
+
+def _statement():
+    months = ["04", "05", "04", "06", "05", "04", "04"]
+    return pd.DataFrame({
+        "Date": [f"{i + 1:02d}-{months[i % 7]}-2024" for i in range(14)],
+        "Narration": [f"Txn {i}" for i in range(14)],
+        "Debit": [str(100 + i) if i % 2 else "0" for i in range(14)],
+        "Credit": ["0" if i % 2 else str(1000 + i) for i in range(14)],
+        "Mapped Ledger": "Suspense",
+    })
+
+
+def _messages(xml):
+    messages = list(ET.fromstring(xml).iter("TALLYMESSAGE"))
+    for message in messages:
+        message.tail = None
+    return [ET.tostring(message) for message in messages]
+
+
+def _read(export_file):
+    with zipfile.ZipFile(io.BytesIO(export_file.read())) as archive:
+        manifest = json.loads(archive.read(app.XML_MANIFEST_NAME))
+        parts = {name: archive.read(name) for name in archive.namelist() if name != app.XML_MANIFEST_NAME}
+    return manifest, parts
+
+
+def test_split_by_voucher_count_and_month_keep_every_voucher_once():
+    df = _statement()
+    single = app.create_bank_tally_xml(df, "HDFC Bank", "Demo")
+
+    export_file, name, mime = app.build_bank_xml_export(df, "HDFC Bank", "Demo", split_by="vouchers", split_limit=5)
+    manifest, parts = _read(export_file)
+    assert name == "BankVouchers.zip" and mime == "application/zip"
+    assert sorted(parts) == ["BankVouchers_part001.xml", "BankVouchers_part002.xml", "BankVouchers_part003.xml"]
+    assert [(p["vouchers"], p["first_voucher"], p["last_voucher"]) for p in manifest["parts"]] == [
+        (5, 1, 5), (5, 6, 10), (4, 11, 14)]
+    assert manifest["vouchers"] == 14
+    assert manifest["total"] == app.format_paise(sum(range(101, 114, 2)) * 100 + sum(range(1000, 1013, 2)) * 100)
+    # Each part is a complete envelope; together they hold the single-file vouchers in order
+    assert [m for data in parts.values() for m in _messages(data)] == _messages(single)
+    assert [p["bytes"] for p in manifest["parts"]] == [len(parts[p["file"]]) for p in manifest["parts"]]
+
+    manifest, parts = _read(app.build_bank_xml_export(df, "HDFC Bank", "Demo", split_by="month")[0])
+    assert sorted(parts) == ["BankVouchers_2024-04.xml", "BankVouchers_2024-05.xml", "BankVouchers_2024-06.xml"]
+    by_file = {p["file"]: p for p in manifest["parts"]}
+    assert by_file["BankVouchers_2024-04.xml"]["vouchers"] == 8
+    assert by_file["BankVouchers_2024-05.xml"]["first_date"] == "20240502"
+    for data in parts.values():
+        ET.fromstring(data)
+
+
+def test_split_by_size_and_journal_export():
+    df = _statement()
+    limit_mb = 3000 / (1024 * 1024)
+    manifest, parts = _read(app.build_bank_xml_export(df, "HDFC Bank", "Demo", split_by="bytes", split_limit=limit_mb)[0])
+    assert len(parts) > 2 and all(len(data) <= 3000 for data in parts.values())
+    assert sum(p["vouchers"] for p in manifest["parts"]) == 14
+
+    journal = pd.DataFrame({"Date": ["01-04-2024", "01-05-2024"], "Voucher Number": ["J1", "J2"],
+                            "Narration": ["a", "b"], "Gross": ["100", "250.50"]})
+    fixed = [{"Tally Ledger Name": "Salary", "CSV Column Name": "Gross", "Type (Debit/Credit)": "Debit"}]
+    export_file = app.build_split_xml_export(
+        {"JournalVouchers": app.journal_voucher_batches(journal, fixed, [], "Journal", {})}, "Demo", "month")
+    manifest, parts = _read(export_file)
+    assert sorted(parts) == ["JournalVouchers_2024-04.xml", "JournalVouchers_2024-05.xml"]
+    assert manifest["total"] == "350.50"